@@ -3,20 +3,26 @@
 import asyncio
 import json
 import os
-from datetime import datetime
+import time
+from datetime import datetime, date
 from g2a_api_client import G2AApiClient
 from telegram_notifier import notifier
 from database import PriceDatabase
+from daily_quota import PRICE_CHANGES_SCOPE, get_quota_used, reserve_quota, release_quota
+from price_history import PriceHistoryRecorder
+from competitor_cache import CompetitorCache, api_fetcher
+from reprice_scheduler import RepriceScheduler, load_signals
+from pricing_strategies import make_batch, compute_prices
 import g2a_config
 
 
 class AutoPriceSettings:
     """Управление настройками автоизменения цен"""
 
-    def __init__(self, settings_file="auto_price_settings.json"):
+    def __init__(self, settings_file="auto_price_settings.json", db=None):
         self.settings_file = settings_file
         self.settings = self.load_settings()
-        self.db = PriceDatabase()
+        self.db = db or PriceDatabase()
 
     def load_settings(self):
         try:
@@ -34,6 +40,8 @@ class AutoPriceSettings:
             "min_price": 0.1,  # Глобальный порог
             "max_price": 100.0,
             "daily_limit": 20,
+            "scan_concurrency": 10,  # Параллельных запросов цен конкурентов
+            "pricing_strategy": "undercut",  # Стратегия из pricing_strategies.STRATEGIES
             "excluded_products": [],  # Чёрный список
             "included_products": []   # Белый список
         }
@@ -100,45 +108,27 @@ class AutoPriceSettings:
 
 
 class DailyLimitTracker:
-    """Отслеживание дневного лимита изменений"""
-
-    def __init__(self, limit_file="daily_limit.json"):
-        self.limit_file = limit_file
-        self.data = self.load_data()
-
-    def load_data(self):
-        try:
-            if os.path.exists(self.limit_file):
-                with open(self.limit_file, 'r') as f:
-                    return json.load(f)
-        except:
-            pass
-        return {"date": str(datetime.now().date()), "changes": 0}
+    """Отслеживание дневного лимита изменений (общий счётчик в БД, см. daily_quota.py)"""
 
-    def save_data(self):
-        try:
-            with open(self.limit_file, 'w') as f:
-                json.dump(self.data, f)
-        except:
-            pass
-
-    def reset_if_new_day(self):
-        """Сбросить счётчик если новый день"""
-        today = str(datetime.now().date())
-        if self.data.get("date") != today:
-            self.data = {"date": today, "changes": 0}
-            self.save_data()
+    def __init__(self, conn, scope=PRICE_CHANGES_SCOPE):
+        self.conn = conn
+        self.scope = scope
+        # День последнего резерва: возврат после полуночи идёт во вчерашний счётчик
+        self.reserved_day = None
 
     def can_change(self, limit):
         """Проверить есть ли ещё изменения в лимите"""
-        self.reset_if_new_day()
-        remaining = limit - self.data.get("changes", 0)
+        remaining = limit - get_quota_used(self.conn, self.scope)
         return remaining > 0, remaining
 
-    def record_change(self):
-        """Записать изменение"""
-        self.data["changes"] = self.data.get("changes", 0) + 1
-        self.save_data()
+    def reserve(self, limit, amount=1):
+        """Зарезервировать изменения в пределах лимита, возвращает сколько выдано"""
+        self.reserved_day = date.today().isoformat()
+        return reserve_quota(self.conn, self.scope, limit, amount, day=self.reserved_day)
+
+    def release(self, amount=1):
+        """Вернуть неиспользованные изменения"""
+        release_quota(self.conn, self.scope, amount, day=self.reserved_day)
 
 
 class AutoPriceChanger:
@@ -153,9 +143,19 @@ class AutoPriceChanger:
 
     def __init__(self):
         self.api_client = None
-        self.settings = AutoPriceSettings()
-        self.limit_tracker = DailyLimitTracker()
+        # Цены конкурентов - через общий кэш (competitor_snapshots)
+        self.competitor_cache = None
+        # Одна БД на настройки и цикл: общий кэш product_settings
         self.db = PriceDatabase()
+        self.settings = AutoPriceSettings(db=self.db)
+        self.limit_tracker = DailyLimitTracker(self.db.conn)
+        # Снимки цен конкурентов из каждого цикла сканирования
+        self.price_history = PriceHistoryRecorder()
+        self.last_history_compact = 0
+        # Когда проверять каждый товар (волатильные и дорогие - чаще)
+        self.scheduler = RepriceScheduler(self.settings.settings.get("check_interval", 1800))
+        self.offers = {}
+        self.offers_loaded_at = 0
         self.running = False
         self.seller_id = None
 
@@ -172,8 +172,21 @@ class AutoPriceChanger:
                 import traceback
                 traceback.print_exc()
 
-            check_interval = self.settings.settings.get("check_interval", 1800)
-            await asyncio.sleep(check_interval)
+            await asyncio.sleep(self.next_wakeup())
+
+        self.price_history.flush()
+        if self.competitor_cache:
+            await self.competitor_cache.close()
+        if self.api_client:
+            await self.api_client.close()
+
+    def next_wakeup(self):
+        """Сон до ближайшей проверки по расписанию, но не дольше check_interval"""
+        check_interval = self.settings.settings.get("check_interval", 1800)
+        delay = self.scheduler.next_due_in()
+        if delay is None:
+            return check_interval
+        return max(1.0, min(check_interval, delay))
 
     def stop(self):
         """Остановить"""
@@ -187,18 +200,33 @@ class AutoPriceChanger:
         try:
             if not self.api_client:
                 self.api_client = G2AApiClient()
+                self.api_client.price_history = self.price_history
+                self.competitor_cache = CompetitorCache(api_fetcher(self.api_client))
 
-            await self.api_client.get_token()
-            offers_result = await self.api_client.get_offers()
+            await self.api_client.ensure_token()
 
-            if not offers_result.get("success"):
-                print(f"❌ Ошибка: {offers_result.get('error')}")
-                return
+            check_interval = self.settings.settings.get("check_interval", 1800)
+            self.scheduler.base_interval = check_interval
 
-            offers = offers_result.get("offers_cache", {})
-            if not offers:
-                print("⚠️ Нет офферов")
-                return
+            # Список офферов - раз в check_interval, между загрузками проверяются
+            # только товары, чьё время подошло по расписанию
+            if not self.offers or time.time() - self.offers_loaded_at >= check_interval:
+                offers_result = await self.api_client.get_offers()
+
+                if not offers_result.get("success"):
+                    print(f"❌ Ошибка: {offers_result.get('error')}")
+                    return
+
+                offers = offers_result.get("offers_cache", {})
+                if not offers:
+                    print("⚠️ Нет офферов")
+                    return
+
+                self.offers = offers
+                self.offers_loaded_at = time.time()
+                self.scheduler.sync(offers.keys())
+
+            offers = self.offers
 
             # ✅ Получаем seller_id
             if not self.seller_id and offers:
@@ -213,160 +241,237 @@ class AutoPriceChanger:
 
             if not can_change:
                 print(f"⚠️ Лимит исчерпан (0/{daily_limit})")
+                self.scheduler.postpone(check_interval)
                 return
 
-            print(f"📊 Проверка {len(offers)} офферов (осталось {remaining})")
-
-            for product_id, offer_info in offers.items():
-                try:
-                    # Проверяем разрешено ли автоизменение
-                    if not self.settings.is_product_allowed(product_id):
-                        continue
+            due = {
+                product_id: offers[product_id]
+                for product_id in self.scheduler.pop_due() if product_id in offers
+            }
+            if not due:
+                return
 
-                    can_change, remaining = self.limit_tracker.can_change(daily_limit)
-                    if not can_change:
-                        break
+            print(f"📊 Проверка {len(due)} из {len(offers)} офферов (осталось {remaining})")
+
+            # Настройки товаров - в память на весь цикл (перечитываются только после изменений)
+            self.db.refresh_product_settings_cache()
+
+            # 1️⃣ Фаза сканирования: параллельно считаем новые цены
+            candidates = await self.scan_prices(due)
+            self.save_price_history()
+
+            # 2️⃣ Фаза применения: одним пакетом, в пределах дневного лимита
+            updates = []
+            for product_id, offer_info, new_price, market_price in candidates:
+                current_price = offer_info.get("price", 0)
+                if new_price and new_price != current_price:
+                    updates.append({
+                        "offer_id": offer_info.get("id"),
+                        "data": self.build_update_data(new_price, offer_info),
+                        "product_id": product_id,
+                        "offer_info": offer_info,
+                        "new_price": new_price,
+                        "market_price": market_price
+                    })
+
+            # Квота резервируется атомарно - сервер и другие воркеры не потратят её дважды
+            granted = self.limit_tracker.reserve(daily_limit, len(updates))
+            if granted < len(updates):
+                print(f"⚠️ Лимит: применяем {granted} из {len(updates)} изменений")
+                updates = updates[:granted]
 
-                    offer_id = offer_info.get("id")
+            try:
+                results = await self.api_client.update_offers_batch(updates)
+            except Exception:
+                self.limit_tracker.release(len(updates))
+                self.reschedule(due, set())
+                raise
+
+            failed = sum(1 for result in results if not result["success"])
+            if failed:
+                self.limit_tracker.release(failed)
+
+            for result in results:
+                product_id = result["product_id"]
+                try:
+                    offer_info = result["offer_info"]
+                    new_price = result["new_price"]
                     current_price = offer_info.get("price", 0)
                     game_name = offer_info.get("product_name", "Unknown")
 
-                    # ✅ Рассчитываем новую цену
-                    new_price = await self.calculate_new_price(
-                        product_id, current_price, game_name, offer_id
+                    if not result["success"]:
+                        print(f"❌ Ошибка обновления {game_name}: {result.get('error')}")
+                        continue
+
+                    # ✅ Сохраняем статистику в БД
+                    self.db.save_price_change(
+                        product_id=product_id,
+                        old_price=current_price,
+                        new_price=new_price,
+                        market_price=new_price,
+                        reason="автоизменение",
+                        game_name=game_name
                     )
 
-                    if new_price and new_price != current_price:
-                        success = await self.update_offer_price(offer_id, new_price, offer_info)
-                        
-                        if success:
-                            self.limit_tracker.record_change()
-                            
-                            # ✅ Сохраняем статистику в БД
-                            self.db.save_price_change(
-                                product_id=product_id,
-                                old_price=current_price,
-                                new_price=new_price,
-                                market_price=new_price,
-                                reason="автоизменение",
-                                game_name=game_name
-                            )
-                            
-                            print(f"✅ {game_name}: €{current_price:.2f} → €{new_price:.2f}")
-                            
-                            # Telegram уведомление
-                            await self.send_telegram_notification(
-                                game_name, current_price, new_price, "автоизменение"
-                            )
+                    print(f"✅ {game_name}: €{current_price:.2f} → €{new_price:.2f}")
+                    # Список офферов перечитывается реже проверок
+                    offer_info["price"] = new_price
+
+                    # Telegram уведомление
+                    await self.send_telegram_notification(
+                        game_name, current_price, new_price, "автоизменение"
+                    )
 
                 except Exception as e:
                     print(f"❌ Ошибка {product_id}: {e}")
 
+            # Цену сменили, а конкурент всё ещё дешевле (упёрлись в порог) - проверяем
+            # почти сразу; товары без изменения (квота, ошибка PATCH) - по обычному расписанию
+            contested = {
+                result["product_id"] for result in results
+                if result["success"] and result["market_price"] is not None
+                and result["new_price"] > result["market_price"]
+            }
+            self.reschedule(due, contested)
+
         except Exception as e:
             print(f"❌ Критическая ошибка: {e}")
             import traceback
             traceback.print_exc()
 
-    async def calculate_new_price(self, product_id, current_price, game_name, offer_id):
+    def reschedule(self, offers, contested):
+        """Следующие проверки по сигналам из БД (волатильность, продажи, изменения цен)"""
+        signals = load_signals(self.db.conn)
+        intervals = [
+            self.scheduler.reschedule(
+                product_id,
+                offer_info.get("price"),
+                offer_info.get("current_stock"),
+                signals.get(product_id),
+                product_id in contested
+            )
+            for product_id, offer_info in offers.items()
+        ]
+        if intervals:
+            print(f"⏱️ Следующие проверки через {min(intervals):.0f}-{max(intervals):.0f}с")
+
+    def save_price_history(self):
+        """Записать снимки цикла; раз в сутки - свернуть старую историю"""
+        self.price_history.flush()
+        if time.time() - self.last_history_compact >= 86400:
+            try:
+                result = self.price_history.compact()
+                self.last_history_compact = time.time()
+                if result["downsampled"] or result["expired"]:
+                    print(f"🗜️ История цен: свёрнуто {result['downsampled']}, удалено {result['expired']}")
+            except Exception as e:
+                print(f"⚠️ Ошибка сжатия истории цен: {e}")
+
+    async def scan_prices(self, offers):
         """
-        ✅ ФИНАЛЬНАЯ ЛОГИКА РАСЧЁТА ЦЕНЫ
-        
+        Параллельно получить цены конкурентов и одним пакетом посчитать новые цены
+
+        Запросы цен конкурентов идут одновременно, но не больше
+        scan_concurrency штук за раз.
+
+        Returns:
+            list: [(product_id, offer_info, new_price, market_price), ...] в порядке offers,
+                  только для товаров, где цену нужно менять
+        """
+        concurrency = max(1, int(self.settings.settings.get("scan_concurrency", 10)))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        allowed = [
+            (product_id, offer_info) for product_id, offer_info in offers.items()
+            if self.settings.is_product_allowed(product_id)
+        ]
+
+        async def fetch_one(product_id):
+            async with semaphore:
+                try:
+                    # Снимок из общего кэша или свежий запрос к API
+                    return await self.competitor_cache.get(
+                        product_id, max_age=self.scheduler.max_age(product_id)
+                    )
+                except Exception as e:
+                    print(f"❌ Ошибка {product_id}: {e}")
+                    return None
+
+        started = datetime.now()
+        snapshots = await asyncio.gather(*(fetch_one(pid) for pid, _info in allowed))
+        elapsed = (datetime.now() - started).total_seconds()
+
+        candidates = self.calculate_new_prices(allowed, snapshots)
+        print(f"🔎 Просканировано {len(allowed)} товаров за {elapsed:.1f}с "
+              f"(параллельно: {concurrency}), к изменению: {len(candidates)}")
+        return candidates
+
+    def calculate_new_prices(self, offers, snapshots):
+        """
+        ✅ ФИНАЛЬНАЯ ЛОГИКА РАСЧЁТА ЦЕН - одним пакетом (стратегия undercut)
+
         Правила:
-        1. Получаем мин. конкурента из G2A API
-        2. Твоя_цена = мин_конкурент - 0.01€
-        3. Если цена < порога → СТОП, не меняем!
-        4. Индивидуальный порог > глобальный
+        1. Твоя_цена = мин_конкурент - снижение (0.01€)
+        2. Если цена < порога → СТОП, не меняем!
+        3. Индивидуальный порог/снижение > глобальные
+
+        Args:
+            offers: [(product_id, offer_info)]
+            snapshots: Снимки рынка в том же порядке (None - не получен)
         """
-        try:
-            # 1️⃣ Получаем мин. конкурента из API
-            market_info = await self.api_client.check_market_price(product_id)
-            
-            if not market_info.get("success"):
-                return None
-            
-            min_competitor_price = market_info.get("market_price", 0)
-            competitors_count = market_info.get("competitor_count", 0)
-            
-            if not min_competitor_price or min_competitor_price == 0:
+        settings = self.settings.settings
+        current, market, floor, undercut = [], [], [], []
+
+        for (product_id, offer_info), snapshot in zip(offers, snapshots):
+            product_settings = self.db.get_product_settings(product_id) or {}
+            current.append(offer_info.get("price", 0))
+            market.append(snapshot.get("min_price") if snapshot else None)
+            floor.append(product_settings.get("min_floor_price") or settings.get("min_price", 0.1))
+            undercut.append(product_settings.get("undercut_amount") or settings.get("undercut_amount", 0.01))
+
+        batch = make_batch(current, market, floor, settings.get("max_price", 100.0), undercut)
+        result = compute_prices(settings.get("pricing_strategy", "undercut"), batch)
+
+        candidates = []
+        for index, (product_id, offer_info) in enumerate(offers):
+            game_name = offer_info.get("product_name", "Unknown")
+            reason = result["reasons"][index]
+
+            if snapshots[index] is None:
+                continue
+            if reason == "no_market":
                 print(f"⚠️ {game_name}: нет конкурентов")
-                return None
-            
-            # 2️⃣ Получаем индивидуальные настройки
-            product_settings = self.db.get_product_settings(product_id)
-            
-            # 3️⃣ Определяем порог (индивидуальный или глобальный)
-            if product_settings and product_settings.get("min_floor_price"):
-                min_floor = product_settings["min_floor_price"]
-                print(f"🛡️ Индивидуальный порог: €{min_floor:.2f}")
-            else:
-                min_floor = self.settings.settings.get("min_price", 0.1)
-                print(f"🌐 Глобальный порог: €{min_floor:.2f}")
-            
-            # 4️⃣ Определяем снижение
-            if product_settings and product_settings.get("undercut_amount"):
-                undercut = product_settings["undercut_amount"]
-            else:
-                undercut = self.settings.settings.get("undercut_amount", 0.01)
-            
-            # 5️⃣ Проверяем макс. порог
-            max_price = self.settings.settings.get("max_price", 100.0)
-            
-            if min_competitor_price < min_floor or min_competitor_price > max_price:
+            elif reason == "out_of_range":
                 print(f"⚠️ {game_name}: конкурент вне диапазона")
-                return None
-            
-            # 6️⃣ Рассчитываем новую цену
-            # ✅ ФИНАЛЬНАЯ ЛОГИКА: твоя_цена = мин_конкурент - 0.01€
-            new_price = round(min_competitor_price - undercut, 2)
-            
-            # 7️⃣ ✅ ПРОВЕРКА ПОРОГА!
-            if new_price < min_floor:
-                print(f"🛑 СТОП! {game_name}:")
-                print(f"   Новая цена €{new_price:.2f} < порога €{min_floor:.2f}")
-                print(f"   🛡️ Оставляем текущую: €{current_price:.2f}")
-                return None  # НЕ МЕНЯЕМ!
-            
-            # 8️⃣ Проверяем максимум
-            if new_price > max_price:
-                new_price = max_price
-            
-            # 9️⃣ Информация
-            print(f"📊 {game_name}:")
-            print(f"   Мин. конкурент: €{min_competitor_price:.2f}")
-            print(f"   Твоя цена: €{new_price:.2f} (-€{undercut:.2f})")
-            print(f"   🛡️ Порог: €{min_floor:.2f}")
-            
-            return new_price
-        
-        except Exception as e:
-            print(f"❌ Ошибка расчёта: {e}")
-            return None
-
-    async def update_offer_price(self, offer_id, new_price, offer_info):
-        """Обновить цену оффера"""
-        try:
-            update_data = {
-                "offerType": offer_info.get("offer_type", "dropshipping"),
-                "variant": {
-                    "price": {
-                        "retail": str(new_price),
-                        "business": str(new_price)
-                    },
-                    "active": True
-                }
+            elif reason == "below_floor":
+                print(f"🛑 СТОП! {game_name}: цена ниже порога €{floor[index]:.2f}, оставляем текущую")
+            elif result["changed"][index]:
+                new_price = result["prices"][index]
+                print(f"📊 {game_name}: мин. конкурент €{market[index]:.2f} → "
+                      f"твоя цена €{new_price:.2f} (🛡️ порог €{floor[index]:.2f})")
+                candidates.append((product_id, offer_info, new_price, market[index]))
+
+        return candidates
+
+    def build_update_data(self, new_price, offer_info):
+        """Тело PATCH запроса для смены цены оффера"""
+        update_data = {
+            "offerType": offer_info.get("offer_type", "dropshipping"),
+            "variant": {
+                "price": {
+                    "retail": str(new_price),
+                    "business": str(new_price)
+                },
+                "active": True
             }
-            
-            if "regions" in offer_info:
-                update_data["variant"]["regions"] = offer_info["regions"]
-            if "regionRestrictions" in offer_info:
-                update_data["variant"]["regionRestrictions"] = offer_info["regionRestrictions"]
-            
-            result = await self.api_client.update_offer_partial(offer_id, update_data)
-            return result.get("success", False)
+        }
 
-        except Exception as e:
-            print(f"❌ Ошибка обновления: {e}")
-            return False
+        if "regions" in offer_info:
+            update_data["variant"]["regions"] = offer_info["regions"]
+        if "regionRestrictions" in offer_info:
+            update_data["variant"]["regionRestrictions"] = offer_info["regionRestrictions"]
+
+        return update_data
 
     async def send_telegram_notification(self, game_name, old_price, new_price, reason):
         """Отправить уведомление в Telegram"""
@@ -327,7 +327,6 @@ def copy_files():
     files_to_copy = [
         "g2a_config_saved.json",
         "auto_price_settings.json",
-        "daily_limit.json",
         "keys.db",
         "proxy.txt"
     ]
@@ -0,0 +1,221 @@
+"""
+Общий кэш снимков цен конкурентов (SQLite, TTL + stale-while-revalidate)
+
+Снимок рынка по товару хранится в таблице competitor_snapshots общей БД,
+поэтому его видят все процессы: сервер (auto_price_adjustment),
+AutoPriceChanger и GUI. Каждый товар запрашивается у G2A не чаще
+раза в TTL:
+
+    - возраст < ttl - снимок свежий, запроса нет
+    - ttl <= возраст < ttl + stale_ttl - отдаём устаревший снимок сразу,
+      обновление идёт в фоне
+    - старше или нет снимка - ждём запрос к G2A
+
+Одновременные запросы одного товара в процессе объединяются (single-flight).
+Работа с БД идёт в потоках (пул SQLitePool или своё WAL-соединение),
+event loop не блокируется.
+
+    cache = CompetitorCache(api_fetcher(api_client))           # своё соединение
+    cache = CompetitorCache(api_fetcher(api_client), pool=db_pool)
+    snapshot = await cache.get(product_id)
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+from g2a_config import DATABASE_FILE, DB_BUSY_TIMEOUT_MS, COMPETITOR_CACHE_TTL, COMPETITOR_CACHE_STALE
+
+
+def create_competitor_snapshots(cursor):
+    """Создать таблицу снимков"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS competitor_snapshots (
+            product_id INTEGER NOT NULL PRIMARY KEY,
+            min_price REAL,
+            my_price REAL,
+            competitor_count INTEGER NOT NULL DEFAULT 0,
+            competitors TEXT,
+            fetched_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+def api_fetcher(api_client):
+    """
+    Запрос снимка через G2AApiClient.get_competitor_min_price
+
+    Returns:
+        async fn(product_id) -> dict | None (None - запрос не удался)
+    """
+    async def fetch(product_id):
+        await api_client.ensure_token()
+        result = await api_client.get_competitor_min_price(product_id)
+        if not result.get("success"):
+            print(f"⚠️ Цены конкурентов для {product_id} не получены: {result.get('error')}")
+            return None
+        return {
+            "min_price": result.get("min_price"),
+            "my_price": result.get("my_price"),
+            "competitor_count": result.get("competitor_count", 0),
+            "competitors": result.get("all_competitors", []),
+        }
+
+    return fetch
+
+
+def load_snapshot(conn, product_id):
+    """Снимок товара из таблицы (None - нет)"""
+    cursor = conn.execute("""
+        SELECT min_price, my_price, competitor_count, competitors, fetched_at
+        FROM competitor_snapshots WHERE product_id = ?
+    """, (product_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    min_price, my_price, competitor_count, competitors, fetched_at = row
+    return {
+        "product_id": product_id,
+        "min_price": min_price,
+        "my_price": my_price,
+        "competitor_count": competitor_count,
+        "competitors": json.loads(competitors) if competitors else [],
+        "fetched_at": fetched_at,
+        "from_cache": True,
+    }
+
+
+def store_snapshot(conn, product_id, snapshot, fetched_at):
+    """Записать снимок товара (UPSERT)"""
+    conn.execute("""
+        INSERT INTO competitor_snapshots
+            (product_id, min_price, my_price, competitor_count, competitors, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(product_id) DO UPDATE SET
+            min_price = excluded.min_price,
+            my_price = excluded.my_price,
+            competitor_count = excluded.competitor_count,
+            competitors = excluded.competitors,
+            fetched_at = excluded.fetched_at
+    """, (
+        product_id,
+        snapshot.get("min_price"),
+        snapshot.get("my_price"),
+        snapshot.get("competitor_count", 0),
+        json.dumps(snapshot.get("competitors") or []),
+        fetched_at
+    ))
+    conn.commit()
+
+
+class CompetitorCache:
+    """Кэш снимков рынка поверх таблицы competitor_snapshots"""
+
+    def __init__(self, fetch, db_path=None, ttl=None, stale_ttl=None, pool=None):
+        self.fetch = fetch
+        self.ttl = ttl if ttl is not None else COMPETITOR_CACHE_TTL
+        self.stale_ttl = stale_ttl if stale_ttl is not None else COMPETITOR_CACHE_STALE
+        # С пулом (сервер) - его соединения, иначе своё, открывается в потоке при первом запросе
+        self.pool = pool
+        self.db_path = db_path or DATABASE_FILE
+        self.conn = None
+        self._conn_lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False  # запросы идут из потоков asyncio.to_thread
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}")
+        create_competitor_snapshots(conn)
+        conn.commit()
+        return conn
+
+    def _run_sync(self, fn, args):
+        with self._conn_lock:
+            if self.conn is None:
+                self.conn = self._connect()
+            return fn(self.conn, *args)
+
+    async def _db(self, fn, *args):
+        """fn(conn, *args) в потоке - SQLite не блокирует event loop"""
+        if self.pool is not None:
+            return await self.pool.run(fn, *args)
+        return await asyncio.to_thread(self._run_sync, fn, args)
+
+    async def _refresh(self, product_id):
+        try:
+            snapshot = await self.fetch(product_id)
+        except Exception as e:
+            print(f"⚠️ Ошибка запроса цен конкурентов {product_id}: {e}")
+            snapshot = None
+        if snapshot is None:
+            return None
+        fetched_at = int(time.time())
+        try:
+            await self._db(store_snapshot, product_id, snapshot, fetched_at)
+        except sqlite3.Error as e:
+            print(f"⚠️ Снимок цен {product_id} не сохранён: {e}")
+        return dict(snapshot, product_id=product_id, fetched_at=fetched_at, from_cache=False)
+
+    def _refresh_once(self, product_id):
+        """Один запрос на товар, сколько бы корутин его ни ждали"""
+        task = self._inflight.get(product_id)
+        if task is None:
+            task = asyncio.create_task(self._refresh(product_id))
+            self._inflight[product_id] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(product_id, None))
+        return task
+
+    async def get(self, product_id, max_age=None):
+        """
+        Снимок рынка товара
+
+        Args:
+            max_age: Снимок не старше, сек (меньше TTL - без stale, ждём свежий;
+                     0 - принудительно обновить)
+
+        Returns:
+            dict | None: {"product_id", "min_price", "my_price", "competitor_count",
+                          "competitors", "fetched_at", "from_cache"}
+        """
+        strict = max_age is not None and max_age < self.ttl
+        ttl = max_age if strict else self.ttl
+        cached = await self._db(load_snapshot, product_id)
+        age = time.time() - cached["fetched_at"] if cached else None
+
+        if cached and age < ttl:
+            self.hits += 1
+            return cached
+
+        if cached and not strict and age < ttl + self.stale_ttl:
+            # Stale-while-revalidate: отвечаем сразу, обновляем в фоне
+            self.stale_hits += 1
+            self._refresh_once(product_id)
+            return cached
+
+        self.misses += 1
+        snapshot = await asyncio.shield(self._refresh_once(product_id))
+        # Запрос не удался - лучше старый снимок, чем ничего
+        return snapshot if snapshot is not None else cached
+
+    def stats(self):
+        return {"hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses}
+
+    async def close(self):
+        """Дождаться фоновых обновлений и закрыть соединение"""
+        if self._inflight:
+            await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+        with self._conn_lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
@@ -0,0 +1,93 @@
+"""
+Дневные квоты (лимит изменений цен в день) в SQLite
+
+Счётчик (scope, day) -> used живёт в общей БД, поэтому лимит один
+для задачи auto_price_adjustment сервера и AutoPriceChanger. Квота
+сначала резервируется (атомарно, под BEGIN IMMEDIATE), а неиспользованная
+часть возвращается через release_quota - параллельные воркеры не могут
+потратить одну и ту же единицу лимита дважды.
+
+    granted = reserve_quota(conn, PRICE_CHANGES_SCOPE, limit=20, amount=5)
+    ...
+    release_quota(conn, PRICE_CHANGES_SCOPE, failed)
+"""
+
+from datetime import date
+
+from db_migrations import atomic
+
+
+# Изменения цен: общий лимит для сервера и AutoPriceChanger
+PRICE_CHANGES_SCOPE = "price_changes"
+
+
+def create_daily_quota(cursor):
+    """Создать таблицу счётчиков квот"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_quota (
+            scope TEXT NOT NULL,
+            day TEXT NOT NULL,
+            used INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, day)
+        ) WITHOUT ROWID
+    """)
+
+
+def _today():
+    return date.today().isoformat()
+
+
+def get_quota_used(conn, scope, day=None):
+    """Сколько квоты израсходовано за день (по умолчанию - сегодня)"""
+    cursor = conn.execute(
+        "SELECT used FROM daily_quota WHERE scope = ? AND day = ?",
+        (scope, day or _today())
+    )
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def reserve_quota(conn, scope, limit, amount=1, day=None):
+    """
+    Атомарно зарезервировать до amount единиц квоты
+
+    Args:
+        limit: Дневной лимит (None или <= 0 - без ограничения)
+
+    Returns:
+        int: выдано единиц (0..amount)
+    """
+    if amount <= 0:
+        return 0
+    day = day or _today()
+
+    # Своя транзакция - BEGIN IMMEDIATE (блокировка записи до чтения: два резерва
+    # не увидят одно и то же used); внутри транзакции вызывающего - savepoint,
+    # коммит остаётся за ним
+    with atomic(conn, "reserve_quota"):
+        cursor = conn.execute(
+            "SELECT used FROM daily_quota WHERE scope = ? AND day = ?", (scope, day)
+        )
+        row = cursor.fetchone()
+        used = row[0] if row else 0
+
+        granted = amount if not limit or limit <= 0 else max(0, min(amount, limit - used))
+        if granted:
+            conn.execute("""
+                INSERT INTO daily_quota (scope, day, used) VALUES (?, ?, ?)
+                ON CONFLICT(scope, day) DO UPDATE SET used = used + excluded.used
+            """, (scope, day, granted))
+
+    return granted
+
+
+def release_quota(conn, scope, amount=1, day=None):
+    """Вернуть неиспользованную квоту (изменение не состоялось)"""
+    if amount <= 0:
+        return
+    with atomic(conn, "release_quota"):
+        conn.execute("""
+            UPDATE daily_quota SET used = MAX(used - ?, 0)
+            WHERE scope = ? AND day = ?
+        """, (amount, scope, day or _today()))
+
@@ -1,40 +1,148 @@
+import asyncio
 import sqlite3
 import datetime
 import json
 import os
+import time
+from contextlib import contextmanager
 from datetime import timedelta
-from g2a_config import DATABASE_FILE, PRICE_EXPIRY_DAYS
+from g2a_config import DATABASE_FILE, PRICE_EXPIRY_DAYS, CATALOG_MIN_SIMILARITY
+from g2a_config import DB_WRITE_BEHIND_ROWS, DB_WRITE_BEHIND_MS
+from db_migrations import apply_migrations
+from daily_quota import create_daily_quota
+from name_matching import normalize_name, name_trigrams, trigram_similarity, same_numbers, clean_product_id
 
 
 class PriceDatabase:
-    def __init__(self):
+    def __init__(self, write_behind=False, flush_rows=None, flush_interval_ms=None):
+        """
+        Args:
+            write_behind: Отложенная запись - коммит раз в flush_rows записей
+                или через flush_interval_ms после первой незакоммиченной
+                (быстрее, но при падении теряются последние записи)
+        """
         self.conn = sqlite3.connect(DATABASE_FILE)
         self.conn.row_factory = sqlite3.Row  # Для доступа по ключам
+
+        self.write_behind = write_behind
+        self.flush_rows = flush_rows or DB_WRITE_BEHIND_ROWS
+        self.flush_interval_ms = flush_interval_ms or DB_WRITE_BEHIND_MS
+        self._pending_writes = 0
+        self._first_pending_at = None
+        self._flush_handle = None
+        self._transaction_depth = 0
+
+        # Кэш product_settings (None - не загружен, читаем из БД)
+        self._settings_cache = None
+        self._settings_generation = None
+
         self.create_tables()
         self.migrate_database()  # ✅ ДОБАВЛЕНА МИГРАЦИЯ
 
+    # ==================== ЗАПИСЬ / ТРАНЗАКЦИИ ====================
+
+    def _commit(self, rows=1):
+        """Коммит после изменения: сразу, в конце transaction() или отложенно"""
+        if self._transaction_depth:
+            return
+        if not self.write_behind:
+            self.conn.commit()
+            return
+
+        self._pending_writes += rows
+        if self._first_pending_at is None:
+            self._first_pending_at = time.monotonic()
+            self._schedule_flush()
+
+        elapsed_ms = (time.monotonic() - self._first_pending_at) * 1000
+        if self._pending_writes >= self.flush_rows or elapsed_ms >= self.flush_interval_ms:
+            self.flush()
+
+    def _schedule_flush(self):
+        # Незакоммиченная транзакция держит блокировку записи для сервера -
+        # в async-коде коммитим по таймеру, даже если новых записей нет
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._flush_handle = loop.call_later(self.flush_interval_ms / 1000, self.flush)
+
+    def flush(self):
+        """Закоммитить отложенные записи"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._pending_writes = 0
+        self._first_pending_at = None
+        if self._transaction_depth == 0 and self.conn.in_transaction:
+            self.conn.commit()
+
+    @contextmanager
+    def write_behind_mode(self):
+        """
+        Отложенная запись только на время блока (например, прогон конвейера)
+
+        На выходе всё коммитится: вне блока записи снова сразу в БД, и
+        незакоммиченная транзакция не держит блокировку записи для сервера.
+        """
+        previous = self.write_behind
+        self.write_behind = True
+        try:
+            yield self
+        finally:
+            self.flush()
+            self.write_behind = previous
+
+    @contextmanager
+    def transaction(self):
+        """
+        Все записи внутри блока - одна транзакция (вложенные блоки - часть внешнего)
+
+            with db.transaction():
+                db.save_price(...)
+                db.save_g2a_id(...)
+        """
+        if self._transaction_depth == 0:
+            # Отложенные записи не должны откатиться вместе с этим блоком
+            self.flush()
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.conn.rollback()
+            raise
+        else:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.conn.commit()
+
     def create_tables(self):
         """Создание всех необходимых таблиц"""
         
-        # Таблица цен (старая)
+        # Кэш цен: одна строка на (name, region), expires_at - unix-время устаревания
+        # (старая таблица с id AUTOINCREMENT перестраивается миграцией)
         self.conn.execute("""
             CREATE TABLE IF NOT EXISTS prices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
+                name TEXT NOT NULL,
+                region TEXT NOT NULL DEFAULT 'GLOBAL',
                 price REAL,
-                region TEXT,
-                date TIMESTAMP
-            )
+                date TIMESTAMP,
+                expires_at INTEGER NOT NULL,
+                PRIMARY KEY (name, region)
+            ) WITHOUT ROWID
         """)
 
-        # Таблица ID продуктов (старая)
+        # Кэш ID продуктов (id = "{name}_{region}")
         self.conn.execute("""
             CREATE TABLE IF NOT EXISTS product_ids (
                 id TEXT PRIMARY KEY,
                 name TEXT,
                 g2a_id TEXT,
                 region TEXT DEFAULT 'GLOBAL',
-                date TIMESTAMP
+                date TIMESTAMP,
+                expires_at INTEGER
             )
         """)
 
@@ -50,6 +158,24 @@ class PriceDatabase:
             )
         """)
 
+        # Поколение product_settings: триггеры увеличивают его при любом изменении,
+        # по нему кэш настроек узнаёт о правках из других процессов (GUI, API)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS product_settings_generation (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("INSERT OR IGNORE INTO product_settings_generation (id, generation) VALUES (1, 0)")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            self.conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_product_settings_{event.lower()}
+                AFTER {event} ON product_settings
+                BEGIN
+                    UPDATE product_settings_generation SET generation = generation + 1 WHERE id = 1;
+                END
+            """)
+
         # ✅ НОВАЯ: Таблица заказов (для статистики продаж)
         self.conn.execute("""
             CREATE TABLE IF NOT EXISTS orders (
@@ -80,6 +206,30 @@ class PriceDatabase:
             )
         """)
 
+        # Каталог товаров G2A из выдачи поиска (офлайн-поиск ID по названию)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_products (
+                product_id TEXT NOT NULL,
+                region TEXT NOT NULL,
+                name TEXT,
+                normalized TEXT NOT NULL,
+                updated_at TEXT,
+                PRIMARY KEY (product_id, region)
+            )
+        """)
+
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_trigrams (
+                trigram TEXT NOT NULL,
+                region TEXT NOT NULL,
+                product_id TEXT NOT NULL,
+                PRIMARY KEY (trigram, region, product_id)
+            ) WITHOUT ROWID
+        """)
+
+        # Дневные квоты (лимит изменений цен, общий с сервером)
+        create_daily_quota(self.conn)
+
         # Добавляем колонку region если её нет
         try:
             self.conn.execute("ALTER TABLE product_ids ADD COLUMN region TEXT DEFAULT 'GLOBAL'")
@@ -89,6 +239,9 @@ class PriceDatabase:
 
         self.conn.commit()
 
+        # Индексы - в общих миграциях схемы (общий файл БД с сервером)
+        apply_migrations(self.conn)
+
     def migrate_database(self):
         """✅ НОВОЕ: Миграция существующей БД"""
         try:
@@ -117,10 +270,15 @@ class PriceDatabase:
     def get_product_settings(self, product_id):
         """
         ✅ НОВОЕ: Получить индивидуальные настройки товара
-        
+
+        При загруженном кэше (refresh_product_settings_cache) - без запроса к БД.
+
         Returns:
             dict или None
         """
+        if self._settings_cache is not None:
+            return self._settings_cache.get(str(product_id))
+
         try:
             cursor = self.conn.execute("""
                 SELECT * FROM product_settings WHERE product_id = ?
@@ -138,6 +296,8 @@ class PriceDatabase:
                             undercut_amount=None, auto_enabled=None):
         """
         ✅ НОВОЕ: Установить индивидуальные настройки товара
+
+        Одним UPSERT без предварительного чтения: None - поле не меняется.
         
         Args:
             product_id: ID товара
@@ -148,50 +308,45 @@ class PriceDatabase:
         """
         try:
             now = datetime.datetime.now().isoformat()
-            
-            # Получаем текущие настройки
-            current = self.get_product_settings(product_id)
-            
-            if current:
-                # Обновляем существующие
-                updates = []
-                values = []
-                
-                if game_name is not None:
-                    updates.append("game_name = ?")
-                    values.append(game_name)
-                if min_floor_price is not None:
-                    updates.append("min_floor_price = ?")
-                    values.append(min_floor_price)
-                if undercut_amount is not None:
-                    updates.append("undercut_amount = ?")
-                    values.append(undercut_amount)
-                if auto_enabled is not None:
-                    updates.append("auto_enabled = ?")
-                    values.append(auto_enabled)
-                
-                updates.append("updated_at = ?")
-                values.append(now)
-                values.append(str(product_id))
-                
-                query = f"UPDATE product_settings SET {', '.join(updates)} WHERE product_id = ?"
-                self.conn.execute(query, values)
-            else:
-                # Создаём новую запись
-                self.conn.execute("""
-                    INSERT INTO product_settings 
-                    (product_id, game_name, min_floor_price, undercut_amount, auto_enabled, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    str(product_id),
-                    game_name,
-                    min_floor_price if min_floor_price is not None else None,
-                    undercut_amount if undercut_amount is not None else 0.01,
-                    auto_enabled if auto_enabled is not None else 0,
-                    now
-                ))
-            
-            self.conn.commit()
+            values = {
+                "product_id": str(product_id),
+                "game_name": game_name,
+                "min_floor_price": min_floor_price,
+                "undercut_amount": undercut_amount,
+                "auto_enabled": auto_enabled,
+                "updated_at": now,
+            }
+
+            self.conn.execute("""
+                INSERT INTO product_settings
+                (product_id, game_name, min_floor_price, undercut_amount, auto_enabled, updated_at)
+                VALUES (:product_id, :game_name, :min_floor_price,
+                        COALESCE(:undercut_amount, 0.01), COALESCE(:auto_enabled, 0), :updated_at)
+                ON CONFLICT(product_id) DO UPDATE SET
+                    game_name = COALESCE(:game_name, game_name),
+                    min_floor_price = COALESCE(:min_floor_price, min_floor_price),
+                    undercut_amount = COALESCE(:undercut_amount, undercut_amount),
+                    auto_enabled = COALESCE(:auto_enabled, auto_enabled),
+                    updated_at = :updated_at
+            """, values)
+            self._commit()
+
+            # Write-through: кэш обновляем сразу, без перечитывания строки
+            if self._settings_cache is not None:
+                cached = self._settings_cache.get(values["product_id"])
+                if cached is None:
+                    cached = {
+                        "product_id": values["product_id"],
+                        "game_name": None,
+                        "min_floor_price": None,
+                        "undercut_amount": 0.01,
+                        "auto_enabled": 0,
+                    }
+                    self._settings_cache[values["product_id"]] = cached
+                for field, value in values.items():
+                    if value is not None:
+                        cached[field] = value
+
             return True
         except Exception as e:
             print(f"❌ Ошибка сохранения настроек: {e}")
@@ -199,6 +354,34 @@ class PriceDatabase:
             traceback.print_exc()
             return False
 
+    def refresh_product_settings_cache(self):
+        """
+        Загрузить product_settings в память (раз в цикл автоизменения)
+
+        Перечитывает таблицу, только если её поколение изменилось -
+        обычно это один запрос к однострочной таблице.
+
+        Returns:
+            bool: True если кэш был перезагружен
+        """
+        try:
+            row = self.conn.execute(
+                "SELECT generation FROM product_settings_generation WHERE id = 1"
+            ).fetchone()
+        except Exception as e:
+            print(f"❌ Ошибка проверки настроек: {e}")
+            return False
+
+        generation = row[0] if row else None
+        if self._settings_cache is not None and generation == self._settings_generation:
+            return False
+
+        self._settings_cache = None
+        settings = self.get_all_product_settings()
+        self._settings_cache = settings
+        self._settings_generation = generation
+        return True
+
     def get_all_product_settings(self):
         """
         ✅ НОВОЕ: Получить настройки всех товаров
@@ -224,7 +407,9 @@ class PriceDatabase:
         """Удалить настройки товара"""
         try:
             self.conn.execute("DELETE FROM product_settings WHERE product_id = ?", (str(product_id),))
-            self.conn.commit()
+            self._commit()
+            if self._settings_cache is not None:
+                self._settings_cache.pop(str(product_id), None)
             return True
         except Exception as e:
             print(f"❌ Ошибка удаления настроек: {e}")
@@ -255,7 +440,7 @@ class PriceDatabase:
                 now
             ))
             
-            self.conn.commit()
+            self._commit()
             return True
         except Exception as e:
             print(f"❌ Ошибка сохранения изменения: {e}")
@@ -378,7 +563,7 @@ class PriceDatabase:
                 now
             ))
             
-            self.conn.commit()
+            self._commit()
             return True
         except Exception as e:
             print(f"❌ Ошибка сохранения заказа: {e}")
@@ -465,55 +650,53 @@ class PriceDatabase:
 
     # ==================== СТАРЫЕ МЕТОДЫ (совместимость) ====================
 
+    def _cache_expires_at(self):
+        return int(time.time()) + PRICE_EXPIRY_DAYS * 86400
+
     def get_price(self, name, region="GLOBAL"):
         """Получить цену из кэша"""
         cursor = self.conn.execute("""
-            SELECT price, date FROM prices 
-            WHERE name = ? AND region = ?
-        """, (name, region))
+            SELECT price FROM prices
+            WHERE name = ? AND region = ? AND expires_at > ?
+        """, (name, region, int(time.time())))
 
         result = cursor.fetchone()
-        if not result:
-            return None
-
-        price, date_str = result
-        stored_date = datetime.datetime.fromisoformat(date_str)
-        now = datetime.datetime.now()
-
-        if (now - stored_date).days < PRICE_EXPIRY_DAYS:
-            return price
-        else:
-            return None
+        return result[0] if result else None
 
     def save_price(self, name, price, region="GLOBAL"):
         """Сохранить цену в кэш"""
+        self.save_prices([(name, price, region)])
+
+    def save_prices(self, rows):
+        """
+        Сохранить пачку цен одной транзакцией
+
+        Args:
+            rows: [(name, price, region)]
+        """
         now = datetime.datetime.now().isoformat()
+        expires_at = self._cache_expires_at()
+        values = [(name, price, region, now, expires_at) for name, price, region in rows]
 
-        self.conn.execute("""
-            INSERT OR REPLACE INTO prices (name, price, region, date)
-            VALUES (?, ?, ?, ?)
-        """, (name, price, region, now))
-        self.conn.commit()
+        self.conn.executemany("""
+            INSERT INTO prices (name, price, region, date, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(name, region) DO UPDATE SET
+                price = excluded.price,
+                date = excluded.date,
+                expires_at = excluded.expires_at
+        """, values)
+        self._commit(len(values))
 
     def get_g2a_id(self, name, region="GLOBAL"):
         """Получить G2A ID из кэша"""
         cursor = self.conn.execute("""
-            SELECT g2a_id, date FROM product_ids 
-            WHERE name = ? AND region = ?
-        """, (name, region))
+            SELECT g2a_id FROM product_ids
+            WHERE name = ? AND region = ? AND expires_at > ?
+        """, (name, region, int(time.time())))
 
         result = cursor.fetchone()
-        if not result:
-            return None
-
-        g2a_id, date_str = result
-        stored_date = datetime.datetime.fromisoformat(date_str)
-        now = datetime.datetime.now()
-
-        if (now - stored_date).days < PRICE_EXPIRY_DAYS:
-            return g2a_id
-        else:
-            return None
+        return result[0] if result else None
 
     def save_g2a_id(self, name, g2a_id, region="GLOBAL"):
         """Сохранить G2A ID в кэш"""
@@ -521,11 +704,137 @@ class PriceDatabase:
         unique_id = f"{name}_{region}"
 
         self.conn.execute("""
-            INSERT OR REPLACE INTO product_ids (id, name, g2a_id, region, date)
+            INSERT INTO product_ids (id, name, g2a_id, region, date, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                g2a_id = excluded.g2a_id,
+                date = excluded.date,
+                expires_at = excluded.expires_at
+        """, (unique_id, name, g2a_id, region, now, self._cache_expires_at()))
+        self._commit()
+
+    def purge_expired_cache(self):
+        """
+        Удалить устаревшие цены и ID (по индексу expires_at)
+
+        Returns:
+            dict: {"prices": удалено цен, "product_ids": удалено ID}
+        """
+        now = int(time.time())
+        prices_deleted = self.conn.execute(
+            "DELETE FROM prices WHERE expires_at <= ?", (now,)
+        ).rowcount
+        ids_deleted = self.conn.execute(
+            "DELETE FROM product_ids WHERE expires_at <= ?", (now,)
+        ).rowcount
+        self._commit()
+        return {"prices": prices_deleted, "product_ids": ids_deleted}
+
+    # ==================== КАТАЛОГ ТОВАРОВ ====================
+
+    def save_catalog_items(self, items, region="GLOBAL"):
+        """
+        Сохранить товары из выдачи поиска G2A в каталог
+
+        Args:
+            items: Массив items со страницы поиска
+            region: Регион, с фильтром которого выполнялся поиск
+        """
+        now = datetime.datetime.now().isoformat()
+        products = []
+        trigrams = []
+
+        for item in items:
+            name = item.get("name", "")
+            product_id = item.get("meta", {}).get("productId", "")
+            if not name or not product_id or "random" in name.lower():
+                continue
+
+            product_id = clean_product_id(product_id)
+            normalized = normalize_name(name)
+            products.append((product_id, region, name, normalized, now))
+            trigrams.extend((trigram, region, product_id) for trigram in name_trigrams(normalized))
+
+        if not products:
+            return 0
+
+        self.conn.executemany("""
+            INSERT INTO catalog_products (product_id, region, name, normalized, updated_at)
             VALUES (?, ?, ?, ?, ?)
-        """, (unique_id, name, g2a_id, region, now))
-        self.conn.commit()
+            ON CONFLICT(product_id, region) DO UPDATE SET
+                name = excluded.name,
+                normalized = excluded.normalized,
+                updated_at = excluded.updated_at
+        """, products)
+        # Лишние триграммы после переименования только добавят кандидатов,
+        # итоговое сходство всё равно считается по текущему normalized
+        self.conn.executemany("""
+            INSERT OR IGNORE INTO catalog_trigrams (trigram, region, product_id)
+            VALUES (?, ?, ?)
+        """, trigrams)
+        self._commit(len(products))
+        return len(products)
+
+    def find_catalog_product(self, name, region="GLOBAL", min_similarity=None):
+        """
+        Найти G2A ID в локальном каталоге без запроса к G2A
+
+        Сначала точное совпадение нормализованного названия, затем
+        ближайшее по триграммам (не ниже min_similarity) с теми же
+        номерами частей.
+
+        Returns:
+            str | None: product_id
+        """
+        normalized = normalize_name(name)
+        if not normalized:
+            return None
+
+        cursor = self.conn.execute("""
+            SELECT product_id FROM catalog_products
+            WHERE normalized = ? AND region = ?
+            ORDER BY length(name)
+            LIMIT 1
+        """, (normalized, region))
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+
+        min_similarity = min_similarity if min_similarity is not None else CATALOG_MIN_SIMILARITY
+        query_trigrams = list(name_trigrams(normalized))
+        # Чтобы Жаккар был >= порога, общих триграмм нужно не меньше порог * |запрос|
+        min_shared = max(1, int(len(query_trigrams) * min_similarity))
+
+        cursor = self.conn.execute(f"""
+            SELECT p.product_id, p.name, p.normalized
+            FROM (
+                SELECT product_id, COUNT(*) AS shared
+                FROM catalog_trigrams
+                WHERE region = ? AND trigram IN ({','.join('?' * len(query_trigrams))})
+                GROUP BY product_id
+                HAVING shared >= ?
+                ORDER BY shared DESC
+                LIMIT 20
+            ) AS candidates
+            JOIN catalog_products p ON p.product_id = candidates.product_id AND p.region = ?
+        """, (region, *query_trigrams, min_shared, region))
+
+        best_id = None
+        best_score = (min_similarity, 0)
+        for product_id, product_name, product_normalized in cursor.fetchall():
+            # "Dark Souls II" и "Dark Souls III" похожи по триграммам, но это разные игры
+            if not same_numbers(normalized, product_normalized):
+                continue
+            similarity = trigram_similarity(normalized, product_normalized)
+            # При равном сходстве - более короткое название
+            score = (similarity, -len(product_name or ""))
+            if similarity >= min_similarity and (best_id is None or score > best_score):
+                best_id = product_id
+                best_score = score
+
+        return best_id
 
     def close(self):
-        """Закрыть соединение"""
+        """Закрыть соединение (отложенные записи коммитятся)"""
+        self.flush()
         self.conn.close()
\ No newline at end of file
@@ -0,0 +1,363 @@
+"""
+Версионные миграции схемы SQLite (индексы и служебные таблицы)
+
+Один файл БД используют сервер (init_database), KeyManager и PriceDatabase,
+и каждый создаёт свои таблицы. Поэтому миграция применяется только когда
+её таблица уже существует и в ней есть нужные колонки - иначе она
+откладывается до следующего запуска. Применённые версии хранятся
+в таблице schema_migrations, повторный запуск ничего не делает.
+
+Проверка планов запросов (нет ли полного сканирования таблиц):
+    python db_migrations.py [путь_к_БД]
+"""
+
+import sqlite3
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+
+from g2a_config import PRICE_EXPIRY_DAYS
+from product_stock import create_product_stock
+
+
+# Локальное ISO-время из колонки date -> unix-время (NULL/мусор -> 0, т.е. уже устарело)
+_DATE_TO_EPOCH = "COALESCE(CAST(strftime('%s', date, 'utc') AS INTEGER), 0)"
+
+
+def migrate_prices_cache(cursor):
+    """
+    prices: UNIQUE (name, region) и expires_at вместо истории строк
+
+    Старая таблица (id AUTOINCREMENT) копила строку на каждое сохранение -
+    оставляем по последней строке на (name, region).
+    """
+    cursor.execute("PRAGMA table_info(prices)")
+    columns = {row[1] for row in cursor.fetchall()}
+    # Первичный ключ новой таблицы заменяет старый индекс
+    cursor.execute("DROP INDEX IF EXISTS idx_prices_name_region")
+
+    if "expires_at" not in columns:
+        cursor.execute("""
+            CREATE TABLE prices_new (
+                name TEXT NOT NULL,
+                region TEXT NOT NULL DEFAULT 'GLOBAL',
+                price REAL,
+                date TIMESTAMP,
+                expires_at INTEGER NOT NULL,
+                PRIMARY KEY (name, region)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute(f"""
+            INSERT INTO prices_new (name, region, price, date, expires_at)
+            SELECT name, COALESCE(region, 'GLOBAL'), price, date, {_DATE_TO_EPOCH} + ?
+            FROM prices
+            WHERE id IN (
+                SELECT MAX(id) FROM prices
+                WHERE name IS NOT NULL
+                GROUP BY name, COALESCE(region, 'GLOBAL')
+            )
+        """, (PRICE_EXPIRY_DAYS * 86400,))
+        cursor.execute("DROP TABLE prices")
+        cursor.execute("ALTER TABLE prices_new RENAME TO prices")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_prices_expires ON prices(expires_at)")
+
+
+def migrate_product_ids_expiry(cursor):
+    """product_ids: колонка expires_at (заполняется по date) и индекс для очистки"""
+    cursor.execute("PRAGMA table_info(product_ids)")
+    columns = {row[1] for row in cursor.fetchall()}
+
+    if "expires_at" not in columns:
+        cursor.execute("ALTER TABLE product_ids ADD COLUMN expires_at INTEGER")
+    cursor.execute(f"""
+        UPDATE product_ids SET expires_at = {_DATE_TO_EPOCH} + ?
+        WHERE expires_at IS NULL
+    """, (PRICE_EXPIRY_DAYS * 86400,))
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_ids_expires ON product_ids(expires_at)")
+
+
+def migrate_price_history_sum_sq(cursor):
+    """price_history_hourly: сумма квадратов цен часа (разброс внутри часа для volatility)"""
+    cursor.execute("PRAGMA table_info(price_history_hourly)")
+    columns = {row[1] for row in cursor.fetchall()}
+
+    if "sum_sq_cents" not in columns:
+        # Старые агрегаты остаются с NULL - для них разброс внутри часа неизвестен
+        cursor.execute("ALTER TABLE price_history_hourly ADD COLUMN sum_sq_cents INTEGER")
+
+
+MIGRATIONS = [
+    {
+        "version": 1,
+        "name": "keys_indexes",
+        "table": "keys",
+        "columns": ["product_id", "status", "reservation_id", "order_id", "game_name"],
+        "sql": [
+            "CREATE INDEX IF NOT EXISTS idx_keys_product_status ON keys(product_id, status)",
+            "CREATE INDEX IF NOT EXISTS idx_keys_reservation ON keys(reservation_id)",
+            "CREATE INDEX IF NOT EXISTS idx_keys_order ON keys(order_id)",
+            "CREATE INDEX IF NOT EXISTS idx_keys_game_name ON keys(game_name)",
+        ],
+    },
+    {
+        "version": 2,
+        "name": "reservations_indexes",
+        "table": "reservations",
+        "columns": ["reservation_id", "status", "expires_at"],
+        "sql": [
+            "CREATE INDEX IF NOT EXISTS idx_reservations_reservation_status ON reservations(reservation_id, status)",
+            "CREATE INDEX IF NOT EXISTS idx_reservations_status_expires ON reservations(status, expires_at)",
+        ],
+    },
+    {
+        # Таблица orders сервера (заказы G2A по резервациям)
+        "version": 3,
+        "name": "server_orders_indexes",
+        "table": "orders",
+        "columns": ["reservation_id"],
+        "sql": [
+            "CREATE INDEX IF NOT EXISTS idx_orders_reservation ON orders(reservation_id)",
+        ],
+    },
+    {
+        # Таблица orders PriceDatabase (статистика продаж)
+        "version": 4,
+        "name": "sales_orders_indexes",
+        "table": "orders",
+        "columns": ["product_id", "created_at"],
+        "sql": [
+            "CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_orders_product ON orders(product_id)",
+        ],
+    },
+    {
+        "version": 5,
+        "name": "price_changes_indexes",
+        "table": "price_changes",
+        "columns": ["product_id", "created_at"],
+        "sql": [
+            "CREATE INDEX IF NOT EXISTS idx_price_changes_date ON price_changes(created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_price_changes_product ON price_changes(product_id)",
+        ],
+    },
+    {
+        "version": 6,
+        "name": "product_ids_indexes",
+        "table": "product_ids",
+        "columns": ["name", "region"],
+        "sql": [
+            "CREATE INDEX IF NOT EXISTS idx_product_ids_name_region ON product_ids(name, region)",
+        ],
+    },
+    {
+        "version": 7,
+        "name": "prices_indexes",
+        "table": "prices",
+        "columns": ["name", "region"],
+        "sql": [
+            "CREATE INDEX IF NOT EXISTS idx_prices_name_region ON prices(name, region)",
+        ],
+    },
+    {
+        "version": 8,
+        "name": "product_stock",
+        "table": "keys",
+        "columns": ["product_id", "status"],
+        "apply": create_product_stock,
+    },
+    {
+        "version": 9,
+        "name": "catalog_indexes",
+        "table": "catalog_products",
+        "columns": ["normalized", "region"],
+        "sql": [
+            "CREATE INDEX IF NOT EXISTS idx_catalog_products_normalized ON catalog_products(normalized, region)",
+        ],
+    },
+    {
+        "version": 10,
+        "name": "prices_unique_ttl",
+        "table": "prices",
+        "columns": ["name", "region", "price", "date"],
+        "apply": migrate_prices_cache,
+    },
+    {
+        "version": 11,
+        "name": "product_ids_ttl",
+        "table": "product_ids",
+        "columns": ["name", "region", "date"],
+        "apply": migrate_product_ids_expiry,
+    },
+    {
+        "version": 12,
+        "name": "price_history_hourly_sum_sq",
+        "table": "price_history_hourly",
+        "columns": ["product_id", "hour_ts", "sum_cents", "samples"],
+        "apply": migrate_price_history_sum_sq,
+    },
+]
+
+
+# Горячие запросы: (описание, таблица, SQL, параметры)
+HOT_QUERIES = [
+    ("reservation claim", "keys",
+     "SELECT id FROM keys WHERE product_id = ? AND status = 'available' LIMIT ?", (1, 1)),
+    ("order keys", "keys",
+     "SELECT id, key_value FROM keys WHERE reservation_id = ? AND product_id = ? AND status = 'reserved'",
+     ("r", 1)),
+    ("inventory by order", "keys",
+     "SELECT id, key_value FROM keys WHERE order_id = ?", ("o",)),
+    ("active reservation", "reservations",
+     "SELECT * FROM reservations WHERE reservation_id = ? AND status = 'active'", ("r",)),
+    ("order lookup", "orders",
+     "SELECT * FROM orders WHERE order_id = ?", ("o",)),
+    ("stock lookup", "product_stock",
+     "SELECT available FROM product_stock WHERE product_id = ?", (1,)),
+    ("price changes today", "price_changes",
+     "SELECT COUNT(*) FROM price_changes WHERE created_at >= ?", ("2000-01-01",)),
+    ("g2a id cache", "product_ids",
+     "SELECT g2a_id FROM product_ids WHERE name = ? AND region = ? AND expires_at > ?", ("n", "GLOBAL", 0)),
+    ("price cache", "prices",
+     "SELECT price FROM prices WHERE name = ? AND region = ? AND expires_at > ?", ("n", "GLOBAL", 0)),
+    ("expired prices", "prices",
+     "SELECT COUNT(*) FROM prices WHERE expires_at <= ?", (0,)),
+    ("expired g2a ids", "product_ids",
+     "SELECT COUNT(*) FROM product_ids WHERE expires_at <= ?", (0,)),
+    ("catalog exact match", "catalog_products",
+     "SELECT product_id FROM catalog_products WHERE normalized = ? AND region = ?", ("n", "GLOBAL")),
+]
+
+
+@contextmanager
+def atomic(conn, name):
+    """
+    Атомарный блок, не трогающий чужую транзакцию
+
+    Нет открытой транзакции - своя BEGIN IMMEDIATE с коммитом в конце.
+    Вызывающий уже в транзакции - SAVEPOINT: при ошибке откатывается только
+    блок, а коммит остаётся за вызывающим.
+    """
+    own = not conn.in_transaction
+    conn.execute("BEGIN IMMEDIATE" if own else f"SAVEPOINT {name}")
+    try:
+        yield conn
+    except BaseException:
+        if own:
+            conn.rollback()
+        else:
+            conn.execute(f"ROLLBACK TO SAVEPOINT {name}")
+            conn.execute(f"RELEASE SAVEPOINT {name}")
+        raise
+    if own:
+        conn.commit()
+    else:
+        conn.execute(f"RELEASE SAVEPOINT {name}")
+
+
+def _table_columns(conn, table):
+    cursor = conn.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cursor.fetchall()}
+
+
+def _applied_versions(conn):
+    with atomic(conn, "schema_migrations"):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        """)
+    cursor = conn.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def apply_migrations(conn, verbose=False):
+    """
+    Применить все ещё не применённые миграции, для которых есть таблицы
+
+    Returns:
+        list: версии, применённые в этом запуске
+    """
+    applied = _applied_versions(conn)
+    newly_applied = []
+
+    for migration in MIGRATIONS:
+        if migration["version"] in applied:
+            continue
+
+        columns = _table_columns(conn, migration["table"])
+        if not columns or not set(migration["columns"]) <= columns:
+            # Таблицы (или её варианта с нужными колонками) пока нет
+            continue
+
+        try:
+            # Открытая транзакция вызывающего не коммитится и не откатывается
+            with atomic(conn, "migration"):
+                cursor = conn.cursor()
+                if "apply" in migration:
+                    migration["apply"](cursor)
+                for statement in migration.get("sql", []):
+                    cursor.execute(statement)
+                cursor.execute("""
+                    INSERT OR IGNORE INTO schema_migrations (version, name, applied_at)
+                    VALUES (?, ?, ?)
+                """, (migration["version"], migration["name"], datetime.now().isoformat()))
+        except sqlite3.Error as e:
+            print(f"⚠️ Миграция {migration['version']} ({migration['name']}) не применена: {e}")
+            continue
+
+        newly_applied.append(migration["version"])
+        if verbose:
+            print(f"✅ Миграция {migration['version']}: {migration['name']}")
+
+    return newly_applied
+
+
+def check_query_plans(conn):
+    """
+    EXPLAIN QUERY PLAN для горячих запросов
+
+    Returns:
+        list: [{"query", "plan"}] для запросов, которые сканируют всю таблицу
+    """
+    problems = []
+
+    for description, table, query, params in HOT_QUERIES:
+        if not _table_columns(conn, table):
+            continue
+        try:
+            cursor = conn.execute(f"EXPLAIN QUERY PLAN {query}", params)
+        except sqlite3.OperationalError:
+            # Вариант таблицы без нужных колонок - запрос к ней не относится
+            continue
+
+        details = [row[3] for row in cursor.fetchall()]
+        full_scans = [d for d in details if d.startswith("SCAN") and "INDEX" not in d]
+        if full_scans:
+            problems.append({"query": description, "plan": details})
+
+    return problems
+
+
+if __name__ == "__main__":
+    from g2a_config import DATABASE_FILE
+
+    db_path = sys.argv[1] if len(sys.argv) > 1 else DATABASE_FILE
+    connection = sqlite3.connect(db_path)
+
+    applied_now = apply_migrations(connection, verbose=True)
+    if not applied_now:
+        print("✅ Схема актуальна")
+
+    problems = check_query_plans(connection)
+    connection.close()
+
+    if problems:
+        for problem in problems:
+            print(f"❌ Полное сканирование: {problem['query']} -> {' | '.join(problem['plan'])}")
+        sys.exit(1)
+
+    print("✅ Все горячие запросы используют индексы")
@@ -0,0 +1,105 @@
+"""
+Пул соединений SQLite для асинхронного кода
+
+Соединения открываются один раз в режиме WAL (читатели не блокируют
+писателя) с настроенными PRAGMA, а вся работа с БД выполняется
+в потоках через asyncio.to_thread - event loop не блокируется.
+
+    pool = SQLitePool(DATABASE_FILE)
+    rows = await pool.run(lambda conn: conn.execute("SELECT 1").fetchall())
+    pool.close()
+"""
+
+import asyncio
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from g2a_config import DB_POOL_SIZE, DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE
+
+
+class SQLitePool:
+    """Фиксированный пул WAL-соединений SQLite"""
+
+    def __init__(self, db_path, size=None, busy_timeout_ms=None, cache_size_kb=None, mmap_size=None):
+        self.db_path = db_path
+        self.size = size or DB_POOL_SIZE
+        self.busy_timeout_ms = busy_timeout_ms or DB_BUSY_TIMEOUT_MS
+        self.cache_size_kb = cache_size_kb or DB_CACHE_SIZE_KB
+        self.mmap_size = mmap_size if mmap_size is not None else DB_MMAP_SIZE
+
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False  # соединение переходит между потоками пула
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _acquire(self):
+        if self._closed:
+            raise RuntimeError("SQLite pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = self._connect()
+                self._all.append(conn)
+                return conn
+
+        # Все соединения заняты - ждём освобождения
+        return self._idle.get()
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            # Обработчик упал посреди транзакции - не отдаём "грязное" соединение
+            conn.rollback()
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула (синхронно, для кода в потоке)"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def _run_sync(self, fn, args, kwargs):
+        with self.connection() as conn:
+            return fn(conn, *args, **kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        """Выполнить fn(conn, *args, **kwargs) в потоке с соединением из пула"""
+        return await asyncio.to_thread(self._run_sync, fn, args, kwargs)
+
+    def close(self):
+        """Закрыть все соединения (занятые закроются при возврате)"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+        with self._lock:
+            self._all.clear()
@@ -74,16 +74,22 @@ class G2AErrorHandler:
 
     def __init__(self):
         self.error_log = []
+        self.rate_limit_listeners = []
+
+    def add_rate_limit_listener(self, callback):
+        """Подписка на BR03: callback(endpoint, retry_after)"""
+        self.rate_limit_listeners.append(callback)
 
     def handle_http_error(self, status_code: int, response_text: str = None,
-                          endpoint: str = None) -> G2AError:
+                          endpoint: str = None, retry_after: float = None) -> G2AError:
         """Обработка HTTP ошибок согласно документации G2A"""
 
         error_info = {
             "timestamp": datetime.now().isoformat(),
             "status_code": status_code,
             "endpoint": endpoint,
-            "response": response_text
+            "response": response_text,
+            "retry_after": retry_after
         }
 
         if status_code == 400:
@@ -164,6 +170,13 @@ class G2AErrorHandler:
     def _handle_rate_limit(self, response_text: str, error_info: dict) -> G2AError:
         """Обработка ошибок 429 Too Many Requests"""
         self.error_log.append({**error_info, "type": "rate_limit"})
+
+        for listener in self.rate_limit_listeners:
+            try:
+                listener(error_info.get("endpoint"), error_info.get("retry_after"))
+            except Exception as e:
+                logger.error(f"Rate limit listener error: {e}")
+
         return G2AError("Rate limit exceeded. Max 600 requests per minute", "BR03", 429)
 
     def _handle_server_error(self, response_text: str, error_info: dict) -> G2AError:
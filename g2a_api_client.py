@@ -1,13 +1,29 @@
 import asyncio
 import hashlib
 import json
+import os
+import time
 import httpx
 import g2a_config
-from g2a_config import REQUEST_TIMEOUT, G2A_API_BASE
+from g2a_config import (
+    REQUEST_TIMEOUT, G2A_API_BASE,
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY, HTTP2_ENABLED,
+    RATE_LIMIT_MAX_RETRIES, TOKEN_REFRESH_MARGIN, TOKEN_CACHE_FILE,
+    OFFER_BATCH_CONCURRENCY, OFFER_JOB_TIMEOUT, OFFER_JOB_POLL_INTERVAL
+)
 from proxy_manager import ProxyManager
+from rate_limiter import api_rate_limiter, endpoint_family, parse_retry_after
+from pricing_strategies import listing_price
+from error_handling import error_handler
 from color_utils import print_success, print_error, print_warning, print_info
 import functools
 
+try:
+    import h2  # noqa: F401 - нужен httpx для HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 
 def handle_api_exception(e):
     """Вспомогательная функция для обработки исключений API"""
@@ -24,6 +40,7 @@ def auto_refresh_token(func):
 
     @functools.wraps(func)
     async def wrapper(self, *args, **kwargs):
+        used_token = self.token
         try:
             return await func(self, *args, **kwargs)
         except Exception as e:
@@ -34,7 +51,8 @@ def auto_refresh_token(func):
 
                 print_warning("🔄 Токен истек, обновляем и повторяем запрос...")
                 try:
-                    await self.get_token()
+                    # Обновит только если никто ещё не заменил отклонённый токен
+                    await self.get_token(force=True, stale_token=used_token)
                     print_info("✓ Токен обновлен, повторяем запрос...")
                     return await func(self, *args, **kwargs)
                 except Exception as token_error:
@@ -47,22 +65,107 @@ def auto_refresh_token(func):
 
 
 class G2AApiClient:
-    def __init__(self):
+    def __init__(self, max_connections=None, max_keepalive_connections=None,
+                 keepalive_expiry=None, http2=None, timeout=None, rate_limiter=None):
         self.token = None
+        self.token_expires_at = 0.0  # time.time(), когда токен истекает
+        self._token_lock = asyncio.Lock()
+        self._refresh_task = None
         self.rate = 1.1  # Дефолтный курс
         self.proxy_manager = ProxyManager()
+        self.rate_limiter = rate_limiter or api_rate_limiter
+        # PriceHistoryRecorder: если задан, каждый снимок конкурентов пишется в историю
+        self.price_history = None
+
+        # Один долгоживущий пул соединений на весь клиент (keep-alive + HTTP/2)
+        self.timeout = timeout if timeout is not None else REQUEST_TIMEOUT
+        self.limits = httpx.Limits(
+            max_connections=max_connections or HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=max_keepalive_connections or HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=keepalive_expiry if keepalive_expiry is not None else HTTP_KEEPALIVE_EXPIRY
+        )
+        use_http2 = HTTP2_ENABLED if http2 is None else http2
+        if use_http2 and not HTTP2_AVAILABLE:
+            print_warning("⚠️ Пакет h2 не установлен, используем HTTP/1.1 (pip install httpx[http2])")
+        self.http2 = use_http2 and HTTP2_AVAILABLE
+        self._client = None
+
+    async def __aenter__(self):
+        self._get_client()
+        return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        pass  # httpx клиенты закрываются автоматически через async with
+        await self.close()
+
+    def _get_client(self):
+        """Общий httpx клиент, создаётся лениво и переиспользуется всеми методами"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                verify=False,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2
+            )
+        return self._client
+
+    async def close(self):
+        """Закрыть пул соединений"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        self._refresh_task = None
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def _request(self, method, url, timeout=None, family=None, **kwargs):
+        """
+        Запрос через общий пул соединений с учётом rate limit
+
+        Args:
+            timeout: Таймаут только для этого запроса (по умолчанию - таймаут клиента)
+            family: Семейство эндпоинтов для лимитера (по умолчанию - по URL)
+
+        На 429 бюджет семейства уменьшается (с учётом Retry-After) и запрос
+        повторяется, когда лимитер снова разрешит.
+        """
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        family = family or endpoint_family(url)
+
+        headers = kwargs.get("headers")
+        if family != "oauth" and headers and "Authorization" in headers and self.token:
+            # Истёкший токен обновляем до запроса, а не после 401
+            await self.ensure_token()
+            kwargs["headers"] = {**headers, "Authorization": f"Bearer {self.token}"}
+
+        response = None
+        for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+            await self.rate_limiter.acquire(family)
+            response = await self._get_client().request(method, url, **kwargs)
+
+            if response.status_code != 429:
+                self.rate_limiter.record_success(family)
+                return response
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            # BR03: обработчик ошибок уведомит лимитер и тот снизит скорость
+            error_handler.handle_http_error(429, response.text, endpoint=family, retry_after=retry_after)
+            print_warning(
+                f"⏳ Rate limit ({family or url}), попытка {attempt + 1}/{RATE_LIMIT_MAX_RETRIES + 1}"
+                + (f", Retry-After: {retry_after}с" if retry_after else "")
+            )
+
+        return response
 
     @auto_refresh_token
-    async def get_competitor_min_price(self, product_id, country_code="PL"):
+    async def get_competitor_min_price(self, product_id, country_code="PL", timeout=None):
         """
         ✅ НОВАЯ ФУНКЦИЯ: Получить минимальную цену конкурента для продукта
         
         Args:
             product_id: ID продукта G2A
             country_code: Код страны (по умолчанию PL - Польша)
+            timeout: Таймаут запроса (по умолчанию - таймаут клиента)
         
         Returns:
             dict: {
@@ -85,81 +188,87 @@ class G2AApiClient:
             # Получаем наш seller_id
             my_seller_id = g2a_config.G2A_SELLER_ID
             
-            async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-                # Запрашиваем все офферы для продукта
-                response = await client.get(
-                    f"{G2A_API_BASE}/v3/products/{product_id}/offers",
-                    headers=headers,
-                    params={
-                        "visibility": "all",
-                        "countryCode": country_code,
-                        "itemsPerPage": 50,
-                        "page": 1
-                    }
-                )
-                
-                if response.status_code != 200:
-                    if self.is_auth_error(response.status_code, response.text):
-                        raise Exception(f"401 Unauthorized: {response.text}")
-                    return {
-                        "success": False,
-                        "error": f"HTTP {response.status_code}: {response.text}",
-                        "min_price": None,
-                        "competitor_count": 0
-                    }
-                
-                data = response.json()
-                offers = data.get("data", [])
-                
-                if not offers:
-                    return {
-                        "success": True,
-                        "min_price": None,
-                        "competitor_count": 0,
-                        "message": "Нет конкурентов для этого продукта"
-                    }
-                
-                # Фильтруем активные офферы и сортируем по цене
-                active_offers = []
-                my_price = None
-                
-                for offer in offers:
-                    seller_id = offer.get("seller", {}).get("id")
-                    is_active = offer.get("status") == "active"
-                    price_data = offer.get("price", {})
-                    price = float(price_data.get("retail", 0))
-                    
-                    if is_active and price > 0:
-                        if seller_id == my_seller_id:
-                            my_price = price
-                        else:
-                            active_offers.append({
-                                "seller_id": seller_id,
-                                "price": price
-                            })
-                
-                # Сортируем по цене (от меньшей к большей)
-                active_offers.sort(key=lambda x: x["price"])
-                
-                # Минимальная цена конкурента
-                min_competitor_price = active_offers[0]["price"] if active_offers else None
-                
-                # Определяем нашу позицию
-                my_position = None
-                if my_price:
-                    # Считаем сколько конкурентов дешевле нас
-                    cheaper_count = sum(1 for o in active_offers if o["price"] < my_price)
-                    my_position = cheaper_count + 1
-                
+            # Запрашиваем все офферы для продукта
+            response = await self._request(
+                "GET",
+                f"{G2A_API_BASE}/v3/products/{product_id}/offers",
+                headers=headers,
+                params={
+                    "visibility": "all",
+                    "countryCode": country_code,
+                    "itemsPerPage": 50,
+                    "page": 1
+                },
+                timeout=timeout
+            )
+            
+            if response.status_code != 200:
+                if self.is_auth_error(response.status_code, response.text):
+                    raise Exception(f"401 Unauthorized: {response.text}")
+                return {
+                    "success": False,
+                    "error": f"HTTP {response.status_code}: {response.text}",
+                    "min_price": None,
+                    "competitor_count": 0
+                }
+            
+            data = response.json()
+            offers = data.get("data", [])
+            
+            if not offers:
+                if self.price_history is not None:
+                    self.price_history.record(product_id, None, None, 0)
                 return {
                     "success": True,
-                    "min_price": min_competitor_price,
-                    "competitor_count": len(active_offers),
-                    "my_price": my_price,
-                    "my_position": my_position,
-                    "all_competitors": active_offers[:10]  # Топ-10 конкурентов
+                    "min_price": None,
+                    "competitor_count": 0,
+                    "message": "Нет конкурентов для этого продукта"
                 }
+            
+            # Фильтруем активные офферы и сортируем по цене
+            active_offers = []
+            my_price = None
+            
+            for offer in offers:
+                seller_id = offer.get("seller", {}).get("id")
+                is_active = offer.get("status") == "active"
+                price_data = offer.get("price", {})
+                price = float(price_data.get("retail", 0))
                 
+                if is_active and price > 0:
+                    if seller_id == my_seller_id:
+                        my_price = price
+                    else:
+                        active_offers.append({
+                            "seller_id": seller_id,
+                            "price": price
+                        })
+            
+            # Сортируем по цене (от меньшей к большей)
+            active_offers.sort(key=lambda x: x["price"])
+            
+            # Минимальная цена конкурента
+            min_competitor_price = active_offers[0]["price"] if active_offers else None
+            
+            # Определяем нашу позицию
+            my_position = None
+            if my_price:
+                # Считаем сколько конкурентов дешевле нас
+                cheaper_count = sum(1 for o in active_offers if o["price"] < my_price)
+                my_position = cheaper_count + 1
+
+            if self.price_history is not None:
+                self.price_history.record(product_id, min_competitor_price, my_price, len(active_offers))
+            
+            return {
+                "success": True,
+                "min_price": min_competitor_price,
+                "competitor_count": len(active_offers),
+                "my_price": my_price,
+                "my_position": my_position,
+                "all_competitors": active_offers[:10]  # Топ-10 конкурентов
+            }
+            
         except Exception as e:
             if "401" in str(e) or "unauthorized" in str(e).lower():
                 raise e
@@ -202,18 +311,113 @@ class G2AApiClient:
                 "competitors": []
             }
 
-    async def get_token(self):
-        """Получение OAuth токена для G2A API (с httpx)"""
+    def token_seconds_left(self):
+        """Сколько секунд осталось жить текущему токену"""
+        if not self.token:
+            return 0.0
+        return self.token_expires_at - time.time()
+
+    def _token_is_fresh(self):
+        return self.token_seconds_left() > TOKEN_REFRESH_MARGIN
+
+    async def ensure_token(self):
+        """
+        Проверка токена перед запросом
+
+        Истёк - ждём обновления. Скоро истечёт - обновляем в фоне,
+        а текущий запрос уходит со старым (ещё валидным) токеном.
+        """
+        if self._token_is_fresh():
+            return
+        if self.token_seconds_left() <= 0:
+            await self.get_token()
+        elif self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._background_refresh(self.token))
+
+    async def _background_refresh(self, stale_token):
+        try:
+            await self.get_token(force=True, stale_token=stale_token)
+        except Exception as e:
+            print_warning(f"⚠️ Фоновое обновление токена не удалось: {e}")
+
+    async def get_token(self, timeout=None, force=False, stale_token=None):
+        """
+        Получение OAuth токена для G2A API (с кешем)
+
+        Args:
+            force: Получить новый токен, даже если текущий ещё не истёк
+            stale_token: Токен, который отклонил сервер. Если его уже заменили
+                (параллельный запрос успел обновить) - повторно не обновляем.
+
+        Одновременные вызовы делают ровно один запрос к /oauth/token.
+        """
+        if not force and self._token_is_fresh():
+            return self.token
+
+        async with self._token_lock:
+            # Пока ждали блокировку, токен мог обновить другой вызов
+            if force and stale_token is not None and self.token != stale_token and self.token_seconds_left() > 0:
+                return self.token
+            if not force and self._token_is_fresh():
+                return self.token
+            if not force and not self.token and self._load_cached_token():
+                return self.token
+            await self._fetch_token(timeout)
+            return self.token
+
+    def _token_cache_key(self, client_id):
+        return hashlib.sha256(f"{client_id}:{g2a_config.G2A_API_BASE}".encode()).hexdigest()
+
+    def _load_cached_token(self):
+        """Токен из файла кеша (если он от тех же учётных данных и ещё свежий)"""
+        if not TOKEN_CACHE_FILE or not os.path.exists(TOKEN_CACHE_FILE):
+            return False
+        try:
+            with open(TOKEN_CACHE_FILE, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except Exception:
+            return False
+
+        if cached.get("key") != self._token_cache_key(g2a_config.G2A_CLIENT_ID):
+            return False
+        if cached.get("expires_at", 0) - time.time() <= TOKEN_REFRESH_MARGIN:
+            return False
+
+        self.token = cached["access_token"]
+        self.token_expires_at = float(cached["expires_at"])
+        print_info(f"🔑 Токен из кеша, действует ещё {int(self.token_seconds_left())}с")
+        return True
+
+    def _save_cached_token(self, client_id):
+        if not TOKEN_CACHE_FILE:
+            return
+        # Файл сразу создаётся с правами 0600 и подменяется атомарно:
+        # токен не бывает виден другим пользователям или записан наполовину
+        tmp_path = f"{TOKEN_CACHE_FILE}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({
+                    "key": self._token_cache_key(client_id),
+                    "access_token": self.token,
+                    "expires_at": self.token_expires_at
+                }, f)
+            os.replace(tmp_path, TOKEN_CACHE_FILE)
+        except Exception as e:
+            print_warning(f"⚠️ Не удалось сохранить токен в кеш: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    async def _fetch_token(self, timeout=None):
+        """Запрос нового токена у /oauth/token"""
         g2a_config.reload_config()
 
         client_id = g2a_config.G2A_CLIENT_ID
         client_secret = g2a_config.G2A_CLIENT_SECRET
         api_base = g2a_config.G2A_API_BASE
 
-        print(f"DEBUG: Получение токена G2A...")
-        print(f"DEBUG: Client ID: {client_id[:10] if client_id else 'ПУСТО'}... (длина: {len(client_id)})")
-        print(f"DEBUG: Secret: {client_secret[:10] if client_secret else 'ПУСТО'}... (длина: {len(client_secret)})")
-
         if not client_id or not client_secret:
             raise Exception(
                 "❌ G2A Client ID или Secret пусты!\n\n"
@@ -221,35 +425,38 @@ class G2AApiClient:
                 "⚙️ Настройки → G2A API → Сохранить"
             )
 
-        async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-            response = await client.post(
-                f"{api_base}/oauth/token",
-                json={
-                    "grant_type": "client_credentials",
-                    "client_id": client_id,
-                    "client_secret": client_secret,
-                }
-            )
-
-            if response.status_code == 200:
-                self.token = response.json()["access_token"]
-                print(f"✅ Токен получен успешно!")
-            else:
-                error_msg = f"Token error: {response.status_code} - {response.text}"
-                print(f"❌ {error_msg}")
-                raise Exception(error_msg)
+        response = await self._request(
+            "POST",
+            f"{api_base}/oauth/token",
+            json={
+                "grant_type": "client_credentials",
+                "client_id": client_id,
+                "client_secret": client_secret,
+            },
+            timeout=timeout
+        )
+
+        if response.status_code == 200:
+            data = response.json()
+            self.token = data["access_token"]
+            self.token_expires_at = time.time() + float(data.get("expires_in", 3600))
+            self._save_cached_token(client_id)
+            print(f"✅ Токен получен успешно! (действует {int(self.token_seconds_left())}с)")
+        else:
+            error_msg = f"Token error: {response.status_code} - {response.text}"
+            print(f"❌ {error_msg}")
+            raise Exception(error_msg)
 
     async def get_rate(self):
         """Получение курса EUR/USD"""
         try:
-            async with httpx.AsyncClient(verify=False, timeout=10.0) as client:
-                response = await client.get("https://api.exchangerate-api.com/v4/latest/EUR")
-                if response.status_code == 200:
-                    self.rate = response.json()["rates"]["USD"]
-                    print(f"✅ Курс EUR/USD: {self.rate}")
-                else:
-                    self.rate = 1.1
-                    print(f"⚠️  Не удалось получить курс, используем дефолтный: {self.rate}")
+            response = await self._request("GET", "https://api.exchangerate-api.com/v4/latest/EUR", timeout=10.0)
+            if response.status_code == 200:
+                self.rate = response.json()["rates"]["USD"]
+                print(f"✅ Курс EUR/USD: {self.rate}")
+            else:
+                self.rate = 1.1
+                print(f"⚠️  Не удалось получить курс, используем дефолтный: {self.rate}")
         except Exception as e:
             self.rate = 1.1
             print(f"⚠️  Ошибка получения курса ({e}), используем дефолтный: {self.rate}")
@@ -264,7 +471,7 @@ class G2AApiClient:
         return any(keyword in response_lower for keyword in auth_keywords)
 
     @auto_refresh_token
-    async def get_offers(self):
+    async def get_offers(self, timeout=None):
         """Получение списка офферов (с httpx)"""
         if not self.token:
             raise Exception("No token available")
@@ -277,54 +484,55 @@ class G2AApiClient:
         all_offers = {}
         page = 1
 
-        async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-            while True:
-                response = await client.get(
-                    f"{G2A_API_BASE}/v3/sales/offers",
-                    headers=headers,
-                    params={
-                        "itemsPerPage": 100,
-                        "page": page
-                    }
-                )
+        while True:
+            response = await self._request(
+                "GET",
+                f"{G2A_API_BASE}/v3/sales/offers",
+                headers=headers,
+                params={
+                    "itemsPerPage": 100,
+                    "page": page
+                },
+                timeout=timeout
+            )
 
-                if response.status_code != 200:
-                    if self.is_auth_error(response.status_code, response.text):
-                        raise Exception(f"401 Unauthorized: {response.text}")
-                    return {
-                        "success": False,
-                        "error": f"HTTP {response.status_code}: {response.text}"
+            if response.status_code != 200:
+                if self.is_auth_error(response.status_code, response.text):
+                    raise Exception(f"401 Unauthorized: {response.text}")
+                return {
+                    "success": False,
+                    "error": f"HTTP {response.status_code}: {response.text}"
+                }
+
+            data = response.json()
+            offers_data = data.get("data", [])
+            meta = data.get("meta", {})
+
+            for offer in offers_data:
+                product_id = str(offer.get("product", {}).get("id"))
+                if product_id and product_id != "None":
+                    # ✅ ДОБАВЛЕНО: Извлекаем seller_id
+                    seller_data = offer.get("seller", {})
+                    seller_id = seller_data.get("id", "")
+                    
+                    all_offers[product_id] = {
+                        "id": offer.get("id"),
+                        "product_name": offer.get("product", {}).get("name", f"ID: {product_id}"),
+                        "price": offer.get("price", "N/A"),
+                        "current_stock": offer.get("inventory", {}).get("size", 0),
+                        "is_active": offer.get("status") == "active",
+                        "offer_type": offer.get("type", "game"),
+                        "seller_id": seller_id  # ✅ НОВОЕ
                     }
 
-                data = response.json()
-                offers_data = data.get("data", [])
-                meta = data.get("meta", {})
-
-                for offer in offers_data:
-                    product_id = str(offer.get("product", {}).get("id"))
-                    if product_id and product_id != "None":
-                        # ✅ ДОБАВЛЕНО: Извлекаем seller_id
-                        seller_data = offer.get("seller", {})
-                        seller_id = seller_data.get("id", "")
-                        
-                        all_offers[product_id] = {
-                            "id": offer.get("id"),
-                            "product_name": offer.get("product", {}).get("name", f"ID: {product_id}"),
-                            "price": offer.get("price", "N/A"),
-                            "current_stock": offer.get("inventory", {}).get("size", 0),
-                            "is_active": offer.get("status") == "active",
-                            "offer_type": offer.get("type", "game"),
-                            "seller_id": seller_id  # ✅ НОВОЕ
-                        }
-
-                total_results = meta.get("totalResults", 0)
-                items_per_page = meta.get("itemsPerPage", 100)
-                current_page = meta.get("page", 1)
-
-                if current_page * items_per_page >= total_results:
-                    break
-
-                page += 1
+            total_results = meta.get("totalResults", 0)
+            items_per_page = meta.get("itemsPerPage", 100)
+            current_page = meta.get("page", 1)
+
+            if current_page * items_per_page >= total_results:
+                break
+
+            page += 1
 
         return {
             "success": True,
@@ -333,7 +541,7 @@ class G2AApiClient:
         }
 
     @auto_refresh_token
-    async def get_product_price(self, product_id):
+    async def get_product_price(self, product_id, timeout=None):
         """Получение цены продукта с minPrice и retailMinBasePrice (с httpx)"""
         if not self.token:
             raise Exception("No token available")
@@ -352,42 +560,36 @@ class G2AApiClient:
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-                    response = await client.get(url, params=params, headers=headers)
-
-                    if response.status_code == 429:
-                        print(f"Rate limited on API, waiting...")
-                        await asyncio.sleep(2)
-                        continue
-
-                    if response.status_code != 200:
-                        if self.is_auth_error(response.status_code, response.text):
-                            raise Exception(f"401 Unauthorized: {response.text}")
-                        print(f"API HTTP {response.status_code} for product {product_id}")
-                        return None
-
-                    data = response.json()
-                    products = data.get("docs", [])
-
-                    if not products:
-                        print(f"Не найдена игра по ID {product_id}")
-                        return None
-
-                    product = products[0]
-
-                    min_price = product.get("minPrice")
-                    retail_min_base_price = product.get("retailMinBasePrice")
-
-                    if min_price is not None and retail_min_base_price is not None:
-                        usd_price = float(min_price) * self.rate
-                        return {
-                            "min_price": float(min_price),
-                            "min_price_usd": usd_price,
-                            "retail_price": float(retail_min_base_price)
-                        }
-                    else:
-                        print(f"Не найдена цена для {product_id}")
-                        return None
+                response = await self._request("GET", url, params=params, headers=headers, timeout=timeout)
+
+                if response.status_code != 200:
+                    if self.is_auth_error(response.status_code, response.text):
+                        raise Exception(f"401 Unauthorized: {response.text}")
+                    print(f"API HTTP {response.status_code} for product {product_id}")
+                    return None
+
+                data = response.json()
+                products = data.get("docs", [])
+
+                if not products:
+                    print(f"Не найдена игра по ID {product_id}")
+                    return None
+
+                product = products[0]
+
+                min_price = product.get("minPrice")
+                retail_min_base_price = product.get("retailMinBasePrice")
+
+                if min_price is not None and retail_min_base_price is not None:
+                    usd_price = float(min_price) * self.rate
+                    return {
+                        "min_price": float(min_price),
+                        "min_price_usd": usd_price,
+                        "retail_price": float(retail_min_base_price)
+                    }
+                else:
+                    print(f"Не найдена цена для {product_id}")
+                    return None
 
             except Exception as e:
                 error_str = str(e)
@@ -404,16 +606,13 @@ class G2AApiClient:
 
     @auto_refresh_token
     async def create_offer(self, product_id: str, price: float, quantity: int = 1, currency: str = "EUR",
-                           restrictions=None):
+                           restrictions=None, timeout=None):
         """Создание оффера (с httpx)"""
         if not self.token:
             raise Exception("No token available")
 
-        if price <= 5:
-            price = price * 0.97
-        elif price > 5:
-            price = price * 0.99
-        price = round(price, 2)
+        # Ступени наценки - PRICING_LISTING_TIERS (0.97 до 5€, дальше 0.99)
+        price = listing_price(price)
 
         variant = {
             "productId": product_id,
@@ -448,31 +647,32 @@ class G2AApiClient:
         }
 
         try:
-            async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-                response = await client.post(
-                    f"{G2A_API_BASE}/v3/sales/offers",
-                    json=data,
-                    headers=headers
-                )
+            response = await self._request(
+                "POST",
+                f"{G2A_API_BASE}/v3/sales/offers",
+                json=data,
+                headers=headers,
+                timeout=timeout
+            )
 
-                if response.status_code in [200, 201, 202]:
-                    result = response.json()
-                    job_id = result.get("data", {}).get("jobId") if "data" in result else result.get("jobId")
-                    return {
-                        "success": True,
-                        "data": result,
-                        "job_id": job_id,
-                        "message": f"Оффер создан успешно для продукта {product_id}. Job ID: {job_id}"
-                    }
-                else:
-                    error_text = response.text
-                    if self.is_auth_error(response.status_code, error_text):
-                        raise Exception(f"401 Unauthorized: {error_text}")
-                    return {
-                        "success": False,
-                        "error": f"HTTP {response.status_code}: {error_text}",
-                        "message": "Ошибка создания оффера"
-                    }
+            if response.status_code in [200, 201, 202]:
+                result = response.json()
+                job_id = result.get("data", {}).get("jobId") if "data" in result else result.get("jobId")
+                return {
+                    "success": True,
+                    "data": result,
+                    "job_id": job_id,
+                    "message": f"Оффер создан успешно для продукта {product_id}. Job ID: {job_id}"
+                }
+            else:
+                error_text = response.text
+                if self.is_auth_error(response.status_code, error_text):
+                    raise Exception(f"401 Unauthorized: {error_text}")
+                return {
+                    "success": False,
+                    "error": f"HTTP {response.status_code}: {error_text}",
+                    "message": "Ошибка создания оффера"
+                }
         except Exception as e:
             if ("401" in str(e) or "unauthorized" in str(e).lower()):
                 raise e
@@ -483,7 +683,7 @@ class G2AApiClient:
             }
 
     @auto_refresh_token
-    async def check_job_status_simple(self, job_id: str):
+    async def check_job_status_simple(self, job_id: str, timeout=None):
         """Проверка статуса задачи (с httpx)"""
         if not self.token:
             raise Exception("No token available")
@@ -494,28 +694,29 @@ class G2AApiClient:
         }
 
         try:
-            async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-                response = await client.get(
-                    f"{G2A_API_BASE}/v3/jobs/{job_id}",
-                    headers=headers
-                )
+            response = await self._request(
+                "GET",
+                f"{G2A_API_BASE}/v3/jobs/{job_id}",
+                headers=headers,
+                timeout=timeout
+            )
 
-                if response.status_code == 200:
-                    data = response.json()
-                    job_data = data.get("data", {})
+            if response.status_code == 200:
+                data = response.json()
+                job_data = data.get("data", {})
 
-                    return {
-                        "success": True,
-                        "status": job_data.get("status"),
-                        "elements": job_data.get("elements", [])
-                    }
-                else:
-                    if self.is_auth_error(response.status_code, response.text):
-                        raise Exception(f"401 Unauthorized: {response.text}")
-                    return {
-                        "success": False,
-                        "error": f"HTTP {response.status_code}"
-                    }
+                return {
+                    "success": True,
+                    "status": job_data.get("status"),
+                    "elements": job_data.get("elements", [])
+                }
+            else:
+                if self.is_auth_error(response.status_code, response.text):
+                    raise Exception(f"401 Unauthorized: {response.text}")
+                return {
+                    "success": False,
+                    "error": f"HTTP {response.status_code}"
+                }
         except Exception as e:
             return handle_api_exception(e)
 
@@ -532,14 +733,11 @@ class G2AApiClient:
                 job_id = create_result.get("job_id")
                 if job_id:
                     print(f"Оффер создается... Job ID: {job_id}")
-                    await asyncio.sleep(4)
+                    job_result = await self.wait_for_job(job_id)
+                    if job_result["success"]:
 
-                    status_result = await self.check_job_status_simple(job_id)
-                    if (status_result.get("success") and
-                            status_result.get("status") == "complete"):
-
-                        elements = status_result.get("elements", [])
-                        if elements and elements[0].get("status") == "completed":
+                        elements = job_result["elements"]
+                        if elements:
                             real_offer_id = elements[0].get("resourceId")
 
                             if real_offer_id:
@@ -554,10 +752,10 @@ class G2AApiClient:
                                 print_error(f"❌ Не найден resourceId в elements")
                                 return False
                         else:
-                            print_error(f"❌ Элемент не completed или elements пустой")
+                            print_error(f"❌ Job {job_id} завершён без elements")
                             return False
                     else:
-                        print_error(f"❌ Job не завершен успешно: {status_result}")
+                        print_error(f"❌ Job не завершен успешно: {job_result['error']}")
                         return False
                 else:
                     print_error(f"❌ Не получен job_id")
@@ -671,7 +869,7 @@ class G2AApiClient:
             return False
 
     @auto_refresh_token
-    async def update_offer_partial(self, offer_id: str, update_data: dict):
+    async def update_offer_partial(self, offer_id: str, update_data: dict, timeout=None):
         """Частичное обновление оффера (PATCH запрос с httpx)"""
         if not self.token:
             raise Exception("No token available")
@@ -682,64 +880,178 @@ class G2AApiClient:
             "Content-Type": "application/json"
         }
 
-        async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-            response = await client.patch(
-                f"{G2A_API_BASE}/v3/sales/offers/{offer_id}",
-                json=update_data,
-                headers=headers
-            )
+        response = await self._request(
+            "PATCH",
+            f"{G2A_API_BASE}/v3/sales/offers/{offer_id}",
+            json=update_data,
+            headers=headers,
+            timeout=timeout
+        )
+
+        if response.status_code in [200, 202]:
+            try:
+                result = response.json()
+            except ValueError:
+                result = {}
+            job_id = result.get("data", {}).get("jobId") if isinstance(result.get("data"), dict) else result.get("jobId")
+            return {
+                "success": True,
+                "data": result if response.status_code == 200 else {},
+                "job_id": job_id,
+                "message": f"Оффер {offer_id} обновлен"
+            }
+        else:
+            if self.is_auth_error(response.status_code, response.text):
+                raise Exception(f"401 Unauthorized: {response.text}")
+            return {
+                "success": False,
+                "error": f"HTTP {response.status_code}: {response.text}"
+            }
 
-            if response.status_code in [200, 202]:
+    async def wait_for_job(self, job_id, timeout=None, poll_interval=None):
+        """
+        Дождаться завершения асинхронной задачи G2A
+
+        Returns:
+            dict: {"success", "status", "elements", "error"} - success=True только
+                если задача complete и все её элементы completed
+        """
+        deadline = time.monotonic() + (timeout or OFFER_JOB_TIMEOUT)
+        poll_interval = poll_interval or OFFER_JOB_POLL_INTERVAL
+
+        while True:
+            status_result = await self.check_job_status_simple(job_id)
+            status = status_result.get("status") if status_result.get("success") else None
+
+            if status in ("complete", "completed", "failed", "error"):
+                elements = status_result.get("elements", [])
+                failed = [el for el in elements if el.get("status") not in (None, "completed")]
                 return {
-                    "success": True,
-                    "data": response.json() if response.status_code == 200 else {},
-                    "message": f"Оффер {offer_id} обновлен"
+                    "success": status in ("complete", "completed") and not failed,
+                    "status": status,
+                    "elements": elements,
+                    "error": None if status in ("complete", "completed") and not failed else f"Job {job_id}: {status}"
                 }
-            else:
-                if self.is_auth_error(response.status_code, response.text):
-                    raise Exception(f"401 Unauthorized: {response.text}")
+
+            if time.monotonic() >= deadline:
                 return {
                     "success": False,
-                    "error": f"HTTP {response.status_code}: {response.text}"
+                    "status": status,
+                    "elements": [],
+                    "error": f"Job {job_id} не завершился за {timeout or OFFER_JOB_TIMEOUT}с"
                 }
 
+            await asyncio.sleep(poll_interval)
+
+    async def update_offers_batch(self, updates, concurrency=None, wait_jobs=False,
+                                  job_timeout=None, on_result=None):
+        """
+        Пакетное обновление офферов (цена / остаток / активность)
+
+        PATCH'и уходят параллельно, общий темп держит rate limiter семейства offers.
+
+        Args:
+            updates: [{"offer_id": str, "data": dict, ...}] - прочие поля
+                (product_id, new_price...) копируются в результат как есть
+            concurrency: Одновременных запросов (по умолчанию OFFER_BATCH_CONCURRENCY)
+            wait_jobs: Дождаться задач G2A (jobId) и учесть их итоговый статус
+            on_result: Вызывается с результатом каждого оффера сразу по готовности
+
+        Returns:
+            list: результаты в порядке updates:
+                {"offer_id", "success", "job_id", "job_status", "error", ...}
+        """
+        semaphore = asyncio.Semaphore(concurrency or OFFER_BATCH_CONCURRENCY)
+
+        async def update_one(update):
+            result = {key: value for key, value in update.items() if key != "data"}
+            result.update({"success": False, "job_id": None, "job_status": None, "error": None})
+
+            async with semaphore:
+                try:
+                    response = await self.update_offer_partial(update["offer_id"], update["data"])
+                except Exception as e:
+                    response = {"success": False, "error": str(e)}
+
+            result["success"] = response.get("success", False)
+            result["job_id"] = response.get("job_id")
+            result["error"] = response.get("error")
+
+            # Ожидание задачи идёт вне семафора - не занимает слот для PATCH
+            if wait_jobs and result["success"] and result["job_id"]:
+                job_result = await self.wait_for_job(result["job_id"], timeout=job_timeout)
+                result["success"] = job_result["success"]
+                result["job_status"] = job_result["status"]
+                result["error"] = job_result["error"]
+
+            if on_result:
+                on_result(result)
+            return result
+
+        results = await asyncio.gather(*(update_one(update) for update in updates))
+        return list(results)
+
+    async def get_offer_details_batch(self, offer_ids, concurrency=None):
+        """
+        Детали нескольких офферов параллельно
+
+        Returns:
+            dict: {offer_id: результат get_offer_details}
+        """
+        semaphore = asyncio.Semaphore(concurrency or OFFER_BATCH_CONCURRENCY)
+
+        async def fetch_one(offer_id):
+            async with semaphore:
+                try:
+                    return offer_id, await self.get_offer_details(offer_id)
+                except Exception as e:
+                    return offer_id, {"success": False, "error": str(e)}
+
+        results = await asyncio.gather(*(fetch_one(offer_id) for offer_id in offer_ids))
+        return dict(results)
+
     @auto_refresh_token
-    async def get_offer_details(self, offer_id):
+    async def get_offer_details(self, offer_id, timeout=None):
         """Получение деталей конкретного оффера по ID (с httpx)"""
         if not self.token:
             raise Exception("No token available")
 
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Accept": "application/json"
-        }
-
         try:
-            async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-                response = await client.get(
+            # 401 - один повтор с новым токеном, дальше отдаём ошибку
+            for attempt in range(2):
+                headers = {
+                    "Authorization": f"Bearer {self.token}",
+                    "Accept": "application/json"
+                }
+
+                response = await self._request(
+                    "GET",
                     f"{G2A_API_BASE}/v3/sales/offers/{offer_id}",
-                    headers=headers
+                    headers=headers,
+                    timeout=timeout
                 )
 
-                if response.status_code == 200:
-                    return {
-                        "success": True,
-                        "data": response.json()
-                    }
-                elif response.status_code == 404:
-                    return {
-                        "success": False,
-                        "error": f"Оффер {offer_id} не найден"
-                    }
-                elif response.status_code == 401:
-                    await self.get_token()
-                    print('получен новый токен, пробуем еще раз')
-                    return await self.get_offer_details(offer_id)
-                else:
-                    return {
-                        "success": False,
-                        "error": f"HTTP {response.status_code}: {response.text}"
-                    }
+                if response.status_code == 401 and attempt == 0:
+                    sent_auth = response.request.headers.get("Authorization", "")
+                    await self.get_token(force=True, stale_token=sent_auth[len("Bearer "):])
+                    continue
+                break
+
+            if response.status_code == 200:
+                return {
+                    "success": True,
+                    "data": response.json()
+                }
+            elif response.status_code == 404:
+                return {
+                    "success": False,
+                    "error": f"Оффер {offer_id} не найден"
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": f"HTTP {response.status_code}: {response.text}"
+                }
         except Exception as e:
             return {
                 "success": False,
@@ -747,7 +1059,7 @@ class G2AApiClient:
             }
 
     @auto_refresh_token
-    async def delete_offer(self, offer_id: str):
+    async def delete_offer(self, offer_id: str, timeout=None):
         """Удаление офера (с httpx)"""
         if not self.token:
             raise Exception("No token available")
@@ -758,22 +1070,23 @@ class G2AApiClient:
         }
 
         try:
-            async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-                response = await client.delete(
-                    f"{G2A_API_BASE}/v3/sales/offers/{offer_id}",
-                    headers=headers
-                )
+            response = await self._request(
+                "DELETE",
+                f"{G2A_API_BASE}/v3/sales/offers/{offer_id}",
+                headers=headers,
+                timeout=timeout
+            )
 
-                if response.status_code in [200, 204]:
-                    return {
-                        "success": True,
-                        "message": f"Офер {offer_id} удален"
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": f"HTTP {response.status_code}: {response.text}"
-                    }
+            if response.status_code in [200, 204]:
+                return {
+                    "success": True,
+                    "message": f"Офер {offer_id} удален"
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": f"HTTP {response.status_code}: {response.text}"
+                }
         except Exception as e:
             return {
                 "success": False,
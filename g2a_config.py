@@ -61,6 +61,20 @@ if PYDANTIC_AVAILABLE:
         # ===== HTTP Settings =====
         request_timeout: int = Field(default=30, description="HTTP request timeout (seconds)")
         max_retries: int = Field(default=3, description="Max retry attempts")
+        http_max_connections: int = Field(default=50, description="Max pooled connections to G2A API")
+        http_max_keepalive: int = Field(default=20, description="Max idle keep-alive connections")
+        http_keepalive_expiry: float = Field(default=30.0, description="Keep-alive expiry (seconds)")
+        http2_enabled: bool = Field(default=True, description="Use HTTP/2 for G2A API")
+        token_refresh_margin: int = Field(default=300, description="Refresh OAuth token this many seconds before expiry")
+        token_cache_file: str = Field(default=".g2a_token.json", description="OAuth token cache file (empty = disabled)")
+        
+        # ===== Database Pool (FastAPI server) =====
+        db_pool_size: int = Field(default=4, description="SQLite connections in server pool")
+        db_busy_timeout_ms: int = Field(default=5000, description="SQLite busy_timeout (ms)")
+        db_cache_size_kb: int = Field(default=20000, description="SQLite page cache per connection (KiB)")
+        db_mmap_size: int = Field(default=268435456, description="SQLite mmap_size (bytes)")
+        db_write_behind_rows: int = Field(default=500, description="Write-behind: commit after this many writes")
+        db_write_behind_ms: int = Field(default=1000, description="Write-behind: commit at most this many ms after a write")
         
         # ===== Price Parser Settings =====
         min_price_to_sell: float = Field(default=0.1, description="Minimum price to sell (EUR)")
@@ -112,6 +126,18 @@ else:
             self.default_eur_usd_rate = float(os.getenv("DEFAULT_EUR_USD_RATE", "1.1"))
             self.request_timeout = int(os.getenv("REQUEST_TIMEOUT", "30"))
             self.max_retries = int(os.getenv("MAX_RETRIES", "3"))
+            self.http_max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+            self.http_max_keepalive = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+            self.http_keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+            self.http2_enabled = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+            self.token_refresh_margin = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+            self.token_cache_file = os.getenv("TOKEN_CACHE_FILE", ".g2a_token.json")
+            self.db_pool_size = int(os.getenv("DB_POOL_SIZE", "4"))
+            self.db_busy_timeout_ms = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+            self.db_cache_size_kb = int(os.getenv("DB_CACHE_SIZE_KB", "20000"))
+            self.db_mmap_size = int(os.getenv("DB_MMAP_SIZE", "268435456"))
+            self.db_write_behind_rows = int(os.getenv("DB_WRITE_BEHIND_ROWS", "500"))
+            self.db_write_behind_ms = int(os.getenv("DB_WRITE_BEHIND_MS", "1000"))
             self.min_price_to_sell = float(os.getenv("MIN_PRICE_TO_SELL", "0.1"))
         
         def is_g2a_configured(self):
@@ -167,6 +193,18 @@ G2A_CLIENT_EMAIL = config.g2a_client_email
 G2A_SELLER_ID = config.g2a_seller_id
 G2A_API_BASE = config.g2a_api_base
 REQUEST_TIMEOUT = config.request_timeout
+HTTP_MAX_CONNECTIONS = config.http_max_connections
+HTTP_MAX_KEEPALIVE = config.http_max_keepalive
+HTTP_KEEPALIVE_EXPIRY = config.http_keepalive_expiry
+HTTP2_ENABLED = config.http2_enabled
+TOKEN_REFRESH_MARGIN = config.token_refresh_margin
+TOKEN_CACHE_FILE = config.token_cache_file
+DB_POOL_SIZE = config.db_pool_size
+DB_BUSY_TIMEOUT_MS = config.db_busy_timeout_ms
+DB_CACHE_SIZE_KB = config.db_cache_size_kb
+DB_MMAP_SIZE = config.db_mmap_size
+DB_WRITE_BEHIND_ROWS = config.db_write_behind_rows
+DB_WRITE_BEHIND_MS = config.db_write_behind_ms
 TELEGRAM_BOT_TOKEN = config.telegram_bot_token or ""
 TELEGRAM_CHAT_ID = config.telegram_chat_id or ""
 TELEGRAM_ENABLED = config.telegram_enabled
@@ -187,6 +225,67 @@ DELAY_BETWEEN_REQUESTS = 1
 G2A_BASE_URL = "https://www.g2a.com/category/gaming-c1"
 G2A_BASE_PARAMS = "f%5Bplatform%5D%5B0%5D=1&f%5Btype%5D%5B0%5D=10"
 
+# Лимиты запросов: семейство эндпоинтов -> (запросов в секунду, burst)
+# G2A допускает ~600 запросов в минуту, "search" - парсинг сайта g2a.com
+API_RATE_LIMITS = {
+    "products": (3.0, 6),
+    "offers": (3.0, 6),
+    "jobs": (1.5, 3),
+    "oauth": (0.5, 2),
+    "search": (2.0, 4),
+}
+RATE_LIMIT_MAX_RETRIES = 3
+
+# Пакетное обновление офферов: одновременных PATCH и ожидание задач G2A (jobId)
+OFFER_BATCH_CONCURRENCY = 8
+OFFER_JOB_TIMEOUT = 60
+OFFER_JOB_POLL_INTERVAL = 2
+
+# Минимальное сходство названий (Жаккар по триграммам) для офлайн-поиска в каталоге
+CATALOG_MIN_SIMILARITY = 0.85
+
+# Размер пачки для POST /admin/keys/bulk (строк на один executemany)
+BULK_INSERT_BATCH_SIZE = 5000
+
+# Конвейер обработки файлов ключей: воркеров на стадию и размер очередей между стадиями
+# (частоту запросов к G2A по-прежнему ограничивает API_RATE_LIMITS)
+PIPELINE_RESOLVE_WORKERS = 4
+PIPELINE_PRICE_WORKERS = 4
+PIPELINE_SELL_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 200
+
+# История цен конкурентов: сырые снимки (дней) -> часовые агрегаты (дней), размер пачки записи
+PRICE_HISTORY_RAW_DAYS = 7
+PRICE_HISTORY_KEEP_DAYS = 180
+PRICE_HISTORY_FLUSH_ROWS = 200
+
+# Пул прокси для парсинга g2a.com: одновременных запросов на прокси, карантин после
+# N ошибок подряд (сек, удваивается до максимума), пауза на 429 без Retry-After, сглаживание EWMA
+PROXY_MAX_IN_FLIGHT = 2
+PROXY_FAILURE_THRESHOLD = 3
+PROXY_QUARANTINE_BASE = 30
+PROXY_QUARANTINE_MAX = 900
+PROXY_COOLDOWN_429 = 60
+PROXY_EWMA_ALPHA = 0.3
+
+# Общий кэш цен конкурентов (competitor_snapshots): снимок свежий TTL секунд,
+# ещё STALE секунд отдаётся устаревшим с обновлением в фоне
+COMPETITOR_CACHE_TTL = 300
+COMPETITOR_CACHE_STALE = 900
+
+# Адаптивное расписание проверок цен (сек): интервал от базового (check_interval)
+# сокращается волатильностью, продажами/изменениями за окно, ценой и остатком
+REPRICE_MIN_INTERVAL = 30
+REPRICE_MAX_INTERVAL = 7200
+REPRICE_SIGNAL_WINDOW = 86400
+REPRICE_VOLATILITY_WEIGHT = 20
+REPRICE_ACTIVITY_WEIGHT = 0.5
+# Сервер: одновременных запросов цен конкурентов (пачка между проверками квоты)
+REPRICE_SCAN_CONCURRENCY = 10
+
+# Цена при выставлении оффера: (цена до, множитель) по возрастанию порога
+PRICING_LISTING_TIERS = ((5.0, 0.97), (float("inf"), 0.99))
+
 # ОЧЕНЬ ВАЖНО: DATABASE_FILE для backward compatibility!
 DATABASE_FILE = config.database_path
 
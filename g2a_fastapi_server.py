@@ -1,5 +1,5 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Depends, status, Response, Header
+from fastapi import FastAPI, HTTPException, Depends, status, Response, Header, Request, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
@@ -10,7 +10,20 @@ import logging
 from typing import Optional, List
 import os
 import uuid
+import codecs
+import csv
+import json
+import time
 from telegram_notifier import notifier
+from product_stock import get_available_stock, check_product_stock, rebuild_product_stock
+from db_migrations import apply_migrations
+from daily_quota import PRICE_CHANGES_SCOPE, create_daily_quota, get_quota_used, reserve_quota, release_quota
+from price_history import create_price_history, append_snapshots, compact_price_history, get_price_range
+from price_history import get_price_stats as get_market_stats
+from competitor_cache import CompetitorCache, create_competitor_snapshots, api_fetcher
+from reprice_scheduler import RepriceScheduler, load_signals
+from pricing_strategies import make_batch, compute_prices, get_strategy
+from db_pool import SQLitePool
 import asyncio
 
 # Настройка логирования
@@ -22,7 +35,9 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
     # Startup
+    global db_pool
     init_database()
+    db_pool = SQLitePool(DATABASE_FILE)
 
     # Создаём фоновые задачи
     cleanup_task = asyncio.create_task(cleanup_expired_tokens())
@@ -35,6 +50,7 @@ async def lifespan(app: FastAPI):
     # Shutdown
     cleanup_task.cancel()
     auto_price_task.cancel()
+    db_pool.close()
     logger.info("🛑 Server shutting down...")
 
 
@@ -56,7 +72,7 @@ app.add_middleware(
 security = HTTPBearer()
 
 # Конфигурация
-from g2a_config import SERVER_CLIENT_SECRET, SERVER_CLIENT_ID, DATABASE_FILE
+from g2a_config import SERVER_CLIENT_SECRET, SERVER_CLIENT_ID, DATABASE_FILE, BULK_INSERT_BATCH_SIZE, REPRICE_SCAN_CONCURRENCY
 
 CLIENT_ID = SERVER_CLIENT_ID
 CLIENT_SECRET = SERVER_CLIENT_SECRET
@@ -64,6 +80,9 @@ CLIENT_SECRET = SERVER_CLIENT_SECRET
 # Активные токены
 active_tokens = {}
 
+# Пул соединений SQLite (создаётся в lifespan)
+db_pool: Optional[SQLitePool] = None
+
 
 # Модели данных согласно G2A спецификации
 class TokenRequest(BaseModel):
@@ -99,12 +118,6 @@ class InventoryProduct(BaseModel):
     inventory: List[InventoryItem]
 
 
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
 def init_database():
     conn = sqlite3.connect(DATABASE_FILE)
     cursor = conn.cursor()
@@ -166,17 +179,19 @@ def init_database():
         )
     """)
 
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_price_changes_date
-        ON price_changes(created_at)
-    """)
+    # Дневной лимит изменений цен (общий с AutoPriceChanger)
+    create_daily_quota(cursor)
 
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_price_changes_product
-        ON price_changes(product_id)
-    """)
+    # История рыночных цен (снимки из auto_price_adjustment и AutoPriceChanger)
+    create_price_history(cursor)
+
+    # Общий кэш цен конкурентов
+    create_competitor_snapshots(cursor)
 
     conn.commit()
+
+    # Индексы и product_stock - в общих миграциях схемы
+    apply_migrations(conn)
     conn.close()
 
 
@@ -247,91 +262,81 @@ async def get_access_token(
     }
 
 
-# Создание резервации
-@app.post("/reservation")
-async def create_reservation(
-        reservation_data: List[ReservationItem],
-        token: str = Depends(verify_token)
-):
-    """Создание резервации согласно G2A спецификации"""
-    reservation_id = str(uuid.uuid4())
-    logger.info(f"Creating reservation: {reservation_id}")
+def reserve_keys(conn, reservation_id, items, expires_at):
+    """
+    Атомарная резервация ключей (выполняется в потоке пула)
 
-    conn = get_db_connection()
+    Ключи по каждой позиции забираются одним UPDATE внутри BEGIN IMMEDIATE,
+    поэтому между проверкой и резервацией никто не успеет забрать те же ключи.
+    Остаток считается в той же транзакции.
+    """
     cursor = conn.cursor()
 
     try:
+        cursor.execute("BEGIN IMMEDIATE")
         stock_response = []
-        expires_at = datetime.now() + timedelta(minutes=30)
 
-        for item in reservation_data:
+        for item in items:
             product_id = item.product_id
             quantity = item.quantity
 
-            # Проверка наличия ключей
             cursor.execute("""
-                SELECT COUNT(*) as available_count
-                FROM keys 
-                WHERE product_id = ? AND status = 'available'
-            """, (product_id,))
-
-            result = cursor.fetchone()
-            available = result['available_count'] if result else 0
+                UPDATE keys
+                SET status = 'reserved',
+                    reserved_at = CURRENT_TIMESTAMP,
+                    reservation_id = ?
+                WHERE id IN (
+                    SELECT id FROM keys
+                    WHERE product_id = ? AND status = 'available'
+                    LIMIT ?
+                )
+            """, (reservation_id, product_id, quantity))
+            claimed = cursor.rowcount
 
-            if available < quantity:
-                # НЕ закрываем соединение здесь
+            if claimed < quantity:
+                # Забрали всё, что было - значит доступно ровно claimed
+                conn.rollback()
                 raise HTTPException(
                     status_code=400,
                     detail={
                         "code": "INSUFFICIENT_STOCK",
-                        "message": f"Not enough stock for product {product_id}. Available: {available}, requested: {quantity}",
-                        "stock": [{"product_id": product_id, "inventory_size": available}]
+                        "message": f"Not enough stock for product {product_id}. Available: {claimed}, requested: {quantity}",
+                        "stock": [{"product_id": product_id, "inventory_size": claimed}]
                     }
                 )
 
-            # Резервация ключей
-            cursor.execute("""
-                SELECT id FROM keys 
-                WHERE product_id = ? AND status = 'available' 
-                LIMIT ?
-            """, (product_id, quantity))
-
-            keys_to_reserve = cursor.fetchall()
-            key_ids = [key['id'] for key in keys_to_reserve]
-
-            # Обновление статуса ключей
-            for key_id in key_ids:
-                cursor.execute("""
-                    UPDATE keys 
-                    SET status = 'reserved', 
-                        reserved_at = CURRENT_TIMESTAMP,
-                        reservation_id = ?
-                    WHERE id = ?
-                """, (reservation_id, key_id))
-
-            # Создание записи резервации
             cursor.execute("""
                 INSERT INTO reservations (id, reservation_id, product_id, quantity, expires_at)
                 VALUES (?, ?, ?, ?, ?)
             """, (str(uuid.uuid4()), reservation_id, product_id, quantity, expires_at))
 
-            # Добавление в ответ
-            cursor.execute("""
-                SELECT COUNT(*) as total_available
-                FROM keys 
-                WHERE product_id = ? AND status = 'available'
-            """, (product_id,))
-
-            remaining_result = cursor.fetchone()
-            remaining_stock = remaining_result['total_available'] if remaining_result else 0
-
             stock_response.append({
                 "product_id": product_id,
-                "inventory_size": remaining_stock
+                "inventory_size": get_available_stock(cursor, product_id)
             })
 
         conn.commit()
-        conn.close()
+        return stock_response
+
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# Создание резервации
+@app.post("/reservation")
+async def create_reservation(
+        reservation_data: List[ReservationItem],
+        token: str = Depends(verify_token)
+):
+    """Создание резервации согласно G2A спецификации"""
+    reservation_id = str(uuid.uuid4())
+    logger.info(f"Creating reservation: {reservation_id}")
+
+    try:
+        expires_at = datetime.now() + timedelta(minutes=30)
+        # SQLite блокирующий - уводим в поток, event loop продолжает принимать запросы
+        stock_response = await db_pool.run(reserve_keys, reservation_id, reservation_data, expires_at)
 
         return {
             "reservation_id": reservation_id,
@@ -339,29 +344,16 @@ async def create_reservation(
         }
 
     except HTTPException:
-        conn.rollback()
-        conn.close()
         raise
     except Exception as e:
-        conn.rollback()
-        conn.close()
         logger.error(f"Error creating reservation: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail={"code": "INTERNAL_ERROR", "message": "Internal server error"}
         )
 
-# Создание заказа
-@app.post("/order")
-async def create_order(
-        order_data: OrderRequest,
-        token: str = Depends(verify_token)
-):
-    """Создание заказа согласно G2A спецификации"""
-    order_id = str(uuid.uuid4())
-    logger.info(f"Creating order: {order_id}")
-
-    conn = get_db_connection()
+def complete_order(conn, order_id, order_data):
+    """Продажа зарезервированных ключей (выполняется в потоке пула)"""
     cursor = conn.cursor()
 
     try:
@@ -406,7 +398,7 @@ async def create_order(
 
             # Получение зарезервированных ключей
             cursor.execute("""
-                SELECT id, key_value FROM keys 
+                SELECT id, key_value, game_name, price, prefix FROM keys 
                 WHERE reservation_id = ? AND product_id = ? AND status = 'reserved'
                 LIMIT ?
             """, (order_data.reservation_id, product_id, quantity))
@@ -421,39 +413,24 @@ async def create_order(
                     "kind": "text"
                 })
 
-                # Получаем полную информацию о ключе для уведомления
-                cursor.execute("""
-                    SELECT game_name, price, prefix FROM keys 
-                    WHERE id = ?
-                """, (key['id'],))
-
-                key_info = cursor.fetchone()
-                if key_info:
-                    sold_keys_info.append({
-                        'game_name': key_info['game_name'],
-                        'key_value': key['key_value'],
-                        'price': key_info['price'] or 0,
-                        'prefix': key_info['prefix'] or 'unknown'
-                    })
-
-                # Обновление статуса ключа на "продано"
-                cursor.execute("""
-                    UPDATE keys 
-                    SET status = 'sold', 
-                        sold_at = CURRENT_TIMESTAMP,
-                        order_id = ?
-                    WHERE id = ?
-                """, (order_id, key['id']))
-
-            # Подсчет оставшегося инвентаря
-            cursor.execute("""
-                SELECT COUNT(*) as remaining
-                FROM keys 
-                WHERE product_id = ? AND status = 'available'
-            """, (product_id,))
+                sold_keys_info.append({
+                    'game_name': key['game_name'],
+                    'key_value': key['key_value'],
+                    'price': key['price'] or 0,
+                    'prefix': key['prefix'] or 'unknown'
+                })
 
-            remaining_result = cursor.fetchone()
-            remaining = remaining_result['remaining'] if remaining_result else 0
+            # Обновление статуса ключей на "продано"
+            cursor.executemany("""
+                UPDATE keys 
+                SET status = 'sold', 
+                    sold_at = CURRENT_TIMESTAMP,
+                    order_id = ?
+                WHERE id = ?
+            """, [(order_id, key['id']) for key in reserved_keys])
+
+            # Оставшийся инвентарь
+            remaining = get_available_stock(cursor, product_id)
 
             stock_response.append({
                 "product_id": product_id,
@@ -469,7 +446,25 @@ async def create_order(
         """, (order_data.reservation_id,))
 
         conn.commit()
-        conn.close()
+        return stock_response, sold_keys_info
+
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# Создание заказа
+@app.post("/order")
+async def create_order(
+        order_data: OrderRequest,
+        token: str = Depends(verify_token)
+):
+    """Создание заказа согласно G2A спецификации"""
+    order_id = str(uuid.uuid4())
+    logger.info(f"Creating order: {order_id}")
+
+    try:
+        stock_response, sold_keys_info = await db_pool.run(complete_order, order_id, order_data)
 
         # Отправляем уведомления в Telegram асинхронно
         for key_data in sold_keys_info:
@@ -488,12 +483,8 @@ async def create_order(
         }
 
     except HTTPException:
-        conn.rollback()
-        conn.close()
         raise
     except Exception as e:
-        conn.rollback()
-        conn.close()
         logger.error(f"Error creating order: {str(e)}")
         raise HTTPException(
             status_code=500,
@@ -501,84 +492,66 @@ async def create_order(
         )
 
 
-# Получение инвентаря заказа
-@app.get("/order/{order_id}/inventory")
-async def get_inventory_from_order(
-        order_id: str,
-        token: str = Depends(verify_token)
-):
-    """Получение инвентаря заказа согласно G2A спецификации"""
-    logger.info(f"Getting inventory for order: {order_id}")
-
-    conn = get_db_connection()
+def load_order_inventory(conn, order_id):
+    """Ключи заказа по продуктам (выполняется в потоке пула)"""
     cursor = conn.cursor()
 
-    try:
-        # Проверка существования заказа
-        cursor.execute("""
-            SELECT reservation_id FROM orders 
-            WHERE order_id = ?
-        """, (order_id,))
-
-        order = cursor.fetchone()
-        if not order:
-            raise HTTPException(
-                status_code=404,
-                detail={"code": "ORDER_NOT_FOUND", "message": "Order not found"}
-            )
-
-        # Получение всех ключей заказа, сгруппированных по продуктам
-        cursor.execute("""
-            SELECT DISTINCT product_id FROM keys 
-            WHERE order_id = ?
-        """, (order_id,))
-
-        products = cursor.fetchall()
-        inventory_response = []
+    # Проверка существования заказа
+    cursor.execute("""
+        SELECT reservation_id FROM orders 
+        WHERE order_id = ?
+    """, (order_id,))
 
-        for product in products:
-            product_id = product['product_id']
+    order = cursor.fetchone()
+    if not order:
+        raise HTTPException(
+            status_code=404,
+            detail={"code": "ORDER_NOT_FOUND", "message": "Order not found"}
+        )
 
-            # Получение ключей для этого продукта
-            cursor.execute("""
-                SELECT id, key_value FROM keys 
-                WHERE order_id = ? AND product_id = ?
-            """, (order_id, product_id))
+    # Все ключи заказа одним запросом, группируем по продуктам
+    cursor.execute("""
+        SELECT product_id, id, key_value FROM keys 
+        WHERE order_id = ?
+    """, (order_id,))
+
+    inventory_by_product = {}
+    for key in cursor.fetchall():
+        inventory_by_product.setdefault(key['product_id'], []).append({
+            "id": key['id'],
+            "value": key['key_value'],
+            "kind": "text"
+        })
 
-            keys = cursor.fetchall()
+    inventory_response = []
+    for product_id, inventory_items in inventory_by_product.items():
+        # Оставшийся инвентарь
+        remaining = get_available_stock(cursor, product_id)
 
-            inventory_items = []
-            for key in keys:
-                inventory_items.append({
-                    "id": key['id'],
-                    "value": key['key_value'],
-                    "kind": "text"
-                })
+        inventory_response.append({
+            "product_id": product_id,
+            "inventory_size": remaining,
+            "inventory": inventory_items
+        })
 
-            # Подсчет оставшегося инвентаря
-            cursor.execute("""
-                SELECT COUNT(*) as remaining
-                FROM keys 
-                WHERE product_id = ? AND status = 'available'
-            """, (product_id,))
+    return inventory_response
 
-            remaining_result = cursor.fetchone()
-            remaining = remaining_result['remaining'] if remaining_result else 0
 
-            inventory_response.append({
-                "product_id": product_id,
-                "inventory_size": remaining,
-                "inventory": inventory_items
-            })
+# Получение инвентаря заказа
+@app.get("/order/{order_id}/inventory")
+async def get_inventory_from_order(
+        order_id: str,
+        token: str = Depends(verify_token)
+):
+    """Получение инвентаря заказа согласно G2A спецификации"""
+    logger.info(f"Getting inventory for order: {order_id}")
 
-        conn.close()
-        return inventory_response
+    try:
+        return await db_pool.run(load_order_inventory, order_id)
 
     except HTTPException:
-        conn.close()
         raise
     except Exception as e:
-        conn.close()
         logger.error(f"Error getting inventory: {str(e)}")
         raise HTTPException(
             status_code=500,
@@ -586,15 +559,8 @@ async def get_inventory_from_order(
         )
 
 
-@app.delete("/reservation/{reservation_id}")
-async def release_reservation(
-    reservation_id: str,
-    token: str = Depends(verify_token)
-):
-    """Отмена резервации согласно G2A спецификации"""
-    logger.info(f"Releasing reservation: {reservation_id}")
-
-    conn = get_db_connection()
+def cancel_reservation(conn, reservation_id):
+    """Возврат зарезервированных ключей в продажу (выполняется в потоке пула)"""
     cursor = conn.cursor()
 
     try:
@@ -627,17 +593,27 @@ async def release_reservation(
         """, (reservation_id,))
 
         conn.commit()
-        conn.close()
 
+    except Exception:
+        conn.rollback()
+        raise
+
+
+@app.delete("/reservation/{reservation_id}")
+async def release_reservation(
+    reservation_id: str,
+    token: str = Depends(verify_token)
+):
+    """Отмена резервации согласно G2A спецификации"""
+    logger.info(f"Releasing reservation: {reservation_id}")
+
+    try:
+        await db_pool.run(cancel_reservation, reservation_id)
         return Response(status_code=204)
 
     except HTTPException:
-        conn.rollback()
-        conn.close()
         raise
     except Exception as e:
-        conn.rollback()
-        conn.close()
         logger.error(f"Error releasing reservation: {str(e)}")
         raise HTTPException(
             status_code=500,
@@ -648,13 +624,8 @@ async def release_reservation(
 async def health_check(token: str = Depends(verify_token)):
     return Response(status_code=204)
 
-@app.post("/admin/keys")
-async def add_keys(
-    keys_data: List[dict],
-    admin_key: str = Depends(verify_admin_key)
-):
-    """Добавление ключей в базу с префиксом (требует админский ключ)"""
-    conn = get_db_connection()
+def insert_keys(conn, keys_data):
+    """Добавление ключей по одному (выполняется в потоке пула)"""
     cursor = conn.cursor()
 
     added_count = 0
@@ -684,7 +655,16 @@ async def add_keys(
             continue
 
     conn.commit()
-    conn.close()
+    return added_count, errors
+
+
+@app.post("/admin/keys")
+async def add_keys(
+    keys_data: List[dict],
+    admin_key: str = Depends(verify_admin_key)
+):
+    """Добавление ключей в базу с префиксом (требует админский ключ)"""
+    added_count, errors = await db_pool.run(insert_keys, keys_data)
 
     result = {"message": f"Added {added_count} keys"}
     if errors:
@@ -693,10 +673,179 @@ async def add_keys(
     return result
 
 
-@app.get("/admin/stats")
-async def get_stats(admin_key: str = Depends(verify_admin_key)):
-    """Статистика (требует админский ключ)"""
-    conn = get_db_connection()
+BULK_KEY_COLUMNS = ("game_name", "product_id", "key_value", "price", "prefix")
+
+
+def insert_key_batch(conn, rows):
+    """
+    Вставка пачки ключей одним executemany (выполняется в потоке пула)
+
+    Дубликаты (уже в БД или повторы внутри пачки) пропускаются через
+    ON CONFLICT DO NOTHING и возвращаются списком.
+    """
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+
+        existing = set()
+        key_values = [row["key_value"] for row in rows]
+        # Ограничение SQLite на число параметров - проверяем кусками
+        for i in range(0, len(key_values), 900):
+            chunk = key_values[i:i + 900]
+            cursor.execute(
+                f"SELECT key_value FROM keys WHERE key_value IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            existing.update(r[0] for r in cursor.fetchall())
+
+        duplicates = []
+        params = []
+        for row in rows:
+            if row["key_value"] in existing:
+                duplicates.append(row["key_value"])
+                continue
+            existing.add(row["key_value"])
+            params.append((
+                str(uuid.uuid4()),
+                row.get("game_name") or "Unknown Game",
+                row.get("product_id"),
+                row["key_value"],
+                row.get("price") or 0.0,
+                row.get("prefix") or "sks"
+            ))
+
+        cursor.executemany("""
+            INSERT INTO keys (id, game_name, product_id, key_value, price, prefix)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(key_value) DO NOTHING
+        """, params)
+
+        conn.commit()
+        return len(params), duplicates
+
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _parse_bulk_line(line, csv_header):
+    """Строка NDJSON или CSV -> dict ключа"""
+    if csv_header is None:
+        row = json.loads(line)
+        if not isinstance(row, dict):
+            raise ValueError("expected JSON object")
+    else:
+        values = next(csv.reader([line]))
+        row = dict(zip(csv_header, values))
+
+    key_value = str(row.get("key_value") or "").strip()
+    if not key_value:
+        raise ValueError("key_value is empty")
+
+    product_id = row.get("product_id")
+    price = row.get("price")
+    return {
+        "game_name": row.get("game_name"),
+        "product_id": int(product_id) if product_id not in (None, "") else None,
+        "key_value": key_value,
+        "price": float(price) if price not in (None, "") else 0.0,
+        "prefix": row.get("prefix")
+    }
+
+
+@app.post("/admin/keys/bulk")
+async def add_keys_bulk(
+    request: Request,
+    data_format: Optional[str] = Query(None, alias="format"),
+    admin_key: str = Depends(verify_admin_key)
+):
+    """
+    Массовая загрузка ключей потоком NDJSON или CSV (требует админский ключ)
+
+    Формат: ?format=ndjson|csv или по Content-Type (text/csv -> CSV).
+    CSV - с заголовком из колонок game_name, product_id, key_value, price, prefix.
+    Тело читается потоком и вставляется пачками по BULK_INSERT_BATCH_SIZE.
+    """
+    content_type = request.headers.get("content-type", "")
+    is_csv = (data_format or "").lower() == "csv" or (data_format is None and "csv" in content_type)
+
+    csv_header = None
+    batch = []
+    batches = []
+    totals = {"inserted": 0, "duplicates": 0, "invalid": 0}
+    invalid = []
+    line_number = 0
+
+    async def flush_batch():
+        nonlocal batch, invalid
+        if not batch and not invalid:
+            return
+        inserted, duplicates = await db_pool.run(insert_key_batch, batch) if batch else (0, [])
+        batches.append({
+            "batch": len(batches) + 1,
+            "rows": len(batch),
+            "inserted": inserted,
+            "duplicates": duplicates,
+            "invalid": invalid
+        })
+        totals["inserted"] += inserted
+        totals["duplicates"] += len(duplicates)
+        totals["invalid"] += len(invalid)
+        batch = []
+        invalid = []
+
+    def handle_line(raw_line):
+        nonlocal csv_header, line_number
+        line_number += 1
+        line = raw_line.strip()
+        if not line:
+            return
+        if is_csv and csv_header is None:
+            csv_header = [column.strip() for column in next(csv.reader([line]))]
+            if "key_value" not in csv_header:
+                raise HTTPException(
+                    status_code=400,
+                    detail={"code": "INVALID_CSV_HEADER",
+                            "message": f"CSV header must contain key_value, columns: {list(BULK_KEY_COLUMNS)}"}
+                )
+            return
+        try:
+            batch.append(_parse_bulk_line(line, csv_header))
+        except Exception as e:
+            invalid.append({"line": line_number, "error": str(e)})
+
+    # Инкрементальный декодер: многобайтовый символ может разрезаться между чанками
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = ""
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        lines = buffer.split("\n")
+        buffer = lines.pop()
+        for raw_line in lines:
+            handle_line(raw_line)
+            if len(batch) >= BULK_INSERT_BATCH_SIZE:
+                await flush_batch()
+
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        handle_line(buffer)
+    await flush_batch()
+
+    logger.info(
+        f"Bulk import: inserted {totals['inserted']}, duplicates {totals['duplicates']}, "
+        f"invalid {totals['invalid']} in {len(batches)} batches"
+    )
+
+    return {
+        "message": f"Added {totals['inserted']} keys",
+        **totals,
+        "batches": batches
+    }
+
+
+def load_key_stats(conn):
+    """Статистика ключей по статусам и префиксам (выполняется в потоке пула)"""
     cursor = conn.cursor()
 
     cursor.execute("""
@@ -734,22 +883,35 @@ async def get_stats(admin_key: str = Depends(verify_admin_key)):
             'revenue': row['revenue'] or 0
         }
 
-    conn.close()
-
     return {
         "key_statistics": stats,
         "prefix_statistics": prefix_stats
     }
 
 
-@app.get("/admin/keys/by-product/{product_id}")
-async def get_keys_by_product(
-    product_id: int,
-    exclude_sold: bool = False,
-    admin_key: str = Depends(verify_admin_key)
-):
-    """Получение всех ключей по product_id (требует админский ключ)"""
-    conn = get_db_connection()
+@app.get("/admin/stats")
+async def get_stats(admin_key: str = Depends(verify_admin_key)):
+    """Статистика (требует админский ключ)"""
+    return await db_pool.run(load_key_stats)
+
+
+@app.get("/admin/stock/check")
+async def check_stock(admin_key: str = Depends(verify_admin_key)):
+    """Сверка счётчика product_stock с таблицей keys (требует админский ключ)"""
+    mismatches = await db_pool.run(check_product_stock)
+    return {"consistent": not mismatches, "mismatches": mismatches}
+
+
+@app.post("/admin/stock/rebuild")
+async def rebuild_stock(admin_key: str = Depends(verify_admin_key)):
+    """Пересчёт product_stock по таблице keys (требует админский ключ)"""
+    result = await db_pool.run(rebuild_product_stock)
+    logger.info(f"product_stock rebuilt: {result}")
+    return {"message": "Stock rebuilt", **result}
+
+
+def load_keys_by_product(conn, product_id, exclude_sold):
+    """Ключи продукта (выполняется в потоке пула)"""
     cursor = conn.cursor()
 
     if exclude_sold:
@@ -765,8 +927,17 @@ async def get_keys_by_product(
             WHERE product_id = ?
         """, (product_id,))
 
-    keys = cursor.fetchall()
-    conn.close()
+    return cursor.fetchall()
+
+
+@app.get("/admin/keys/by-product/{product_id}")
+async def get_keys_by_product(
+    product_id: int,
+    exclude_sold: bool = False,
+    admin_key: str = Depends(verify_admin_key)
+):
+    """Получение всех ключей по product_id (требует админский ключ)"""
+    keys = await db_pool.run(load_keys_by_product, product_id, exclude_sold)
 
     result = []
     for key in keys:
@@ -781,6 +952,23 @@ async def get_keys_by_product(
     return {"keys": result, "count": len(result)}
 
 
+def set_keys_status(conn, key_ids, new_status):
+    """Смена статуса ключей (выполняется в потоке пула)"""
+    cursor = conn.cursor()
+
+    updated_count = 0
+    for key_id in key_ids:
+        cursor.execute("""
+            UPDATE keys
+            SET status = ?
+            WHERE id = ?
+        """, (new_status, key_id))
+        updated_count += cursor.rowcount
+
+    conn.commit()
+    return updated_count
+
+
 @app.patch("/admin/keys/status")
 async def update_keys_status(
     data: dict,
@@ -804,20 +992,7 @@ async def update_keys_status(
             detail={"code": "EMPTY_KEY_IDS", "message": "key_ids cannot be empty"}
         )
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    updated_count = 0
-    for key_id in key_ids:
-        cursor.execute("""
-            UPDATE keys
-            SET status = ?
-            WHERE id = ?
-        """, (new_status, key_id))
-        updated_count += cursor.rowcount
-
-    conn.commit()
-    conn.close()
+    updated_count = await db_pool.run(set_keys_status, key_ids, new_status)
 
     return {
         "message": f"Updated {updated_count} keys to status '{new_status}'",
@@ -825,28 +1000,10 @@ async def update_keys_status(
     }
 
 
-@app.get("/admin/price-stats")
-async def get_price_stats(
-    period: str = "day",
-    admin_key: str = Depends(verify_admin_key)
-):
-    """Статистика изменений цен (day/week/month)"""
-    conn = get_db_connection()
+def load_price_stats(conn, start_date):
+    """Сводка изменений цен с даты start_date (выполняется в потоке пула)"""
     cursor = conn.cursor()
 
-    now = datetime.now()
-    if period == "day":
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        period_name = "Today"
-    elif period == "week":
-        start_date = now - timedelta(days=7)
-        period_name = "Last 7 days"
-    elif period == "month":
-        start_date = now - timedelta(days=30)
-        period_name = "Last 30 days"
-    else:
-        raise HTTPException(status_code=400, detail="Invalid period. Use: day, week, month")
-
     cursor.execute("""
         SELECT
             COUNT(*) as total_changes,
@@ -912,7 +1069,29 @@ async def get_price_stats(
             'avg_change': round(row['avg_change'], 2)
         })
 
-    conn.close()
+    return summary, changes, top_changed_games, count_today_price_changes(conn)
+
+
+@app.get("/admin/price-stats")
+async def get_price_stats(
+    period: str = "day",
+    admin_key: str = Depends(verify_admin_key)
+):
+    """Статистика изменений цен (day/week/month)"""
+    now = datetime.now()
+    if period == "day":
+        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        period_name = "Today"
+    elif period == "week":
+        start_date = now - timedelta(days=7)
+        period_name = "Last 7 days"
+    elif period == "month":
+        start_date = now - timedelta(days=30)
+        period_name = "Last 30 days"
+    else:
+        raise HTTPException(status_code=400, detail="Invalid period. Use: day, week, month")
+
+    summary, changes, top_changed_games, today_changes = await db_pool.run(load_price_stats, start_date)
 
     return {
         "period": period_name,
@@ -922,51 +1101,81 @@ async def get_price_stats(
             "price_increases": summary['price_increases'] or 0,
             "avg_price_change": round(summary['avg_price_change'], 2) if summary['avg_price_change'] else 0,
             "total_price_change": round(summary['total_price_change'], 2) if summary['total_price_change'] else 0,
-            "today_changes": get_today_price_changes_count()
+            "today_changes": today_changes
         },
         "recent_changes": changes,
         "top_changed_games": top_changed_games
     }
 
 
-def log_price_change(product_id, game_name, old_price, new_price, market_price, reason):
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+@app.get("/admin/market-history/{product_id}")
+async def get_market_history(
+    product_id: int,
+    days: int = Query(7, ge=1, le=365),
+    admin_key: str = Depends(verify_admin_key)
+):
+    """Мин. цена конкурентов по товару за days дней: сводка (тренд, волатильность) и точки"""
+    since = int(time.time()) - days * 86400
+    stats = await db_pool.run(get_market_stats, product_id, since)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No market history for this product")
+    points = await db_pool.run(get_price_range, product_id, since)
 
-        cursor.execute("""
-            INSERT INTO price_changes (product_id, game_name, old_price, new_price, market_price, change_reason)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (product_id, game_name, old_price, new_price, market_price, reason))
+    return {
+        "product_id": product_id,
+        "days": days,
+        "stats": stats,
+        "points": points
+    }
+
+
+def _insert_price_change(conn, product_id, game_name, old_price, new_price, market_price, reason):
+    conn.execute("""
+        INSERT INTO price_changes (product_id, game_name, old_price, new_price, market_price, change_reason)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (product_id, game_name, old_price, new_price, market_price, reason))
+    conn.commit()
 
-        conn.commit()
-        conn.close()
+
+async def log_price_change(product_id, game_name, old_price, new_price, market_price, reason):
+    try:
+        await db_pool.run(_insert_price_change, product_id, game_name, old_price, new_price, market_price, reason)
 
         logger.info(f"[AUTO-PRICE] {game_name} (ID:{product_id}): €{old_price:.2f} -> €{new_price:.2f} | Market: €{market_price:.2f} | Reason: {reason}")
     except Exception as e:
         logger.error(f"[AUTO-PRICE] Error logging price change: {e}")
 
 
-def get_today_price_changes_count():
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+def count_today_price_changes(conn):
+    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
 
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    cursor = conn.execute("""
+        SELECT COUNT(*) as count
+        FROM price_changes
+        WHERE created_at >= ?
+    """, (today_start,))
 
-        cursor.execute("""
-            SELECT COUNT(*) as count
-            FROM price_changes
-            WHERE created_at >= ?
-        """, (today_start,))
+    result = cursor.fetchone()
+    return result['count'] if result else 0
 
-        result = cursor.fetchone()
-        conn.close()
 
-        return result['count'] if result else 0
-    except Exception as e:
-        logger.error(f"[AUTO-PRICE] Error counting today's changes: {e}")
-        return 0
+def load_repricing_products(conn, min_offer_price):
+    cursor = conn.execute("""
+        SELECT DISTINCT product_id, game_name, price, COUNT(*) AS stock
+        FROM keys
+        WHERE status = 'available' AND price >= ?
+        GROUP BY product_id
+    """, (min_offer_price,))
+    return cursor.fetchall()
+
+
+def set_available_keys_price(conn, product_id, new_price):
+    conn.execute("""
+        UPDATE keys
+        SET price = ?
+        WHERE product_id = ? AND status = 'available'
+    """, (new_price, product_id))
+    conn.commit()
 
 
 async def auto_price_adjustment():
@@ -974,8 +1183,7 @@ async def auto_price_adjustment():
         AUTO_PRICE_CHANGE_ENABLED, AUTO_PRICE_CHECK_INTERVAL,
         AUTO_PRICE_MIN_OFFER_PRICE, AUTO_PRICE_UNDERCUT_AMOUNT,
         AUTO_PRICE_INCREASE_THRESHOLD, AUTO_PRICE_DAILY_LIMIT,
-        AUTO_PRICE_MIN_PRICE, AUTO_PRICE_MAX_PRICE,
-        G2A_CLIENT_ID, G2A_CLIENT_SECRET, G2A_API_BASE
+        AUTO_PRICE_MIN_PRICE, AUTO_PRICE_MAX_PRICE
     )
 
     if not AUTO_PRICE_CHANGE_ENABLED:
@@ -984,105 +1192,142 @@ async def auto_price_adjustment():
 
     logger.info(f"[AUTO-PRICE] Starting auto price adjustment task. Interval: {AUTO_PRICE_CHECK_INTERVAL}s")
 
-    import httpx
-    import hashlib
-
-    while True:
-        try:
-            # Проверка лимита изменений за день
-            if AUTO_PRICE_DAILY_LIMIT > 0:
-                today_changes = get_today_price_changes_count()
-                if today_changes >= AUTO_PRICE_DAILY_LIMIT:
-                    logger.warning(f"[AUTO-PRICE] Daily limit reached ({today_changes}/{AUTO_PRICE_DAILY_LIMIT}). Waiting for next day...")
-                    await asyncio.sleep(AUTO_PRICE_CHECK_INTERVAL)
-                    continue
-
-            # Получение списка продуктов
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT DISTINCT product_id, game_name, price
-                FROM keys
-                WHERE status = 'available' AND price >= ?
-                GROUP BY product_id
-            """, (AUTO_PRICE_MIN_OFFER_PRICE,))
-            products = cursor.fetchall()
-            conn.close()
-
-            if not products:
-                logger.info("[AUTO-PRICE] No products found matching criteria")
-                await asyncio.sleep(AUTO_PRICE_CHECK_INTERVAL)
-                continue
+    from g2a_api_client import G2AApiClient
 
-            logger.info(f"[AUTO-PRICE] Checking {len(products)} products for price adjustments...")
+    last_history_compact = 0
+    api_client = G2AApiClient()
+    # Снимки рынка общие с AutoPriceChanger: товар не запрашивается чаще раза в TTL
+    competitor_cache = CompetitorCache(api_fetcher(api_client), pool=db_pool)
+    # Волатильные, дорогие и продающиеся товары проверяются чаще AUTO_PRICE_CHECK_INTERVAL
+    scheduler = RepriceScheduler(AUTO_PRICE_CHECK_INTERVAL)
+    strategy = get_strategy("market_follow", increase_threshold=AUTO_PRICE_INCREASE_THRESHOLD)
 
-            api_key_hash = hashlib.sha256(G2A_CLIENT_SECRET.encode()).hexdigest()
-            auth_header = f"{G2A_CLIENT_ID}, {api_key_hash}"
+    def next_wakeup():
+        # До ближайшего товара по расписанию, но не дольше обычного интервала
+        next_due = scheduler.next_due_in()
+        if next_due is None:
+            return AUTO_PRICE_CHECK_INTERVAL
+        return max(1.0, min(AUTO_PRICE_CHECK_INTERVAL, next_due))
 
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                for product in products:
-                    product_id = product['product_id']
-                    game_name = product['game_name']
-                    current_price = product['price']
-
-                    if not product_id:
+    # Долгоживущий пул соединений клиента закрывается и при отмене задачи (shutdown)
+    try:
+        while True:
+            try:
+                # Проверка лимита изменений за день
+                if AUTO_PRICE_DAILY_LIMIT > 0:
+                    today_changes = await db_pool.run(get_quota_used, PRICE_CHANGES_SCOPE)
+                    if today_changes >= AUTO_PRICE_DAILY_LIMIT:
+                        logger.warning(f"[AUTO-PRICE] Daily limit reached ({today_changes}/{AUTO_PRICE_DAILY_LIMIT}). Waiting for next day...")
+                        await asyncio.sleep(AUTO_PRICE_CHECK_INTERVAL)
                         continue
 
-                    try:
-                        response = await client.get(
-                            f"{G2A_API_BASE}/v1/products/{product_id}",
-                            headers={"Authorization": auth_header}
-                        )
+                # Получение списка продуктов
+                products = await db_pool.run(load_repricing_products, AUTO_PRICE_MIN_OFFER_PRICE)
 
-                        if response.status_code != 200:
-                            continue
+                if not products:
+                    logger.info("[AUTO-PRICE] No products found matching criteria")
+                    await asyncio.sleep(AUTO_PRICE_CHECK_INTERVAL)
+                    continue
 
-                        data = response.json()
+                by_id = {str(product['product_id']): product for product in products if product['product_id']}
+                scheduler.sync(by_id.keys())
+                due = [by_id[product_id] for product_id in scheduler.pop_due() if product_id in by_id]
 
-                        if 'minPrice' not in data:
-                            continue
+                if not due:
+                    await asyncio.sleep(next_wakeup())
+                    continue
 
-                        market_price_cents = data['minPrice'].get('EUR', 0)
-                        market_price = market_price_cents / 100.0
+                logger.info(f"[AUTO-PRICE] Checking {len(due)} of {len(products)} products for price adjustments...")
+                signals = await db_pool.run(load_signals)
 
-                        if market_price <= 0:
-                            continue
+                # Снимки рынка пишутся одной пачкой после обхода
+                snapshots = []
+                semaphore = asyncio.Semaphore(REPRICE_SCAN_CONCURRENCY)
 
-                        price_diff = market_price - current_price
-                        new_price = None
-                        reason = None
-
-                        if market_price < current_price:
-                            new_price = round(market_price - AUTO_PRICE_UNDERCUT_AMOUNT, 2)
-                            reason = "undercut_competitor"
-                        elif price_diff >= AUTO_PRICE_INCREASE_THRESHOLD:
-                            new_price = round(market_price - AUTO_PRICE_UNDERCUT_AMOUNT, 2)
-                            reason = "market_increase"
-
-                        if new_price and new_price != current_price:
-                            if new_price < AUTO_PRICE_MIN_PRICE:
-                                new_price = AUTO_PRICE_MIN_PRICE
-                                reason = f"{reason}_capped_min"
-                            elif new_price > AUTO_PRICE_MAX_PRICE:
-                                new_price = AUTO_PRICE_MAX_PRICE
-                                reason = f"{reason}_capped_max"
-
-                            if abs(new_price - current_price) < 0.01:
+                async def fetch_market(product):
+                    """Мин. цена конкурента (общий кэш, при устаревании - G2A API), None - нет"""
+                    product_id = product['product_id']
+                    async with semaphore:
+                        try:
+                            snapshot = await competitor_cache.get(
+                                product_id, max_age=scheduler.max_age(product_id)
+                            )
+                        except Exception as e:
+                            logger.error(f"[AUTO-PRICE] Error fetching market for {product['game_name']}: {e}")
+                            return None
+                    if not snapshot or (snapshot.get("min_price") or 0) <= 0:
+                        return None
+                    # В историю - только новые снимки, не повторы из кэша
+                    if not snapshot.get("from_cache"):
+                        snapshots.append((
+                            product_id, snapshot["fetched_at"], snapshot["min_price"],
+                            product['price'], snapshot.get("competitor_count")
+                        ))
+                    return snapshot["min_price"]
+
+                # Без лимита - одна пачка на всех; с лимитом - пачками по остатку квоты,
+                # чтобы после её исчерпания не запрашивать у G2A остальные товары
+                limit_reached = False
+                position = 0
+                while position < len(due):
+                    size = len(due) - position
+                    if AUTO_PRICE_DAILY_LIMIT > 0:
+                        used = await db_pool.run(get_quota_used, PRICE_CHANGES_SCOPE)
+                        remaining = AUTO_PRICE_DAILY_LIMIT - used
+                        if limit_reached or remaining <= 0:
+                            for product in due[position:]:
+                                scheduler.reschedule(
+                                    product['product_id'], product['price'], product['stock'],
+                                    signals.get(str(product['product_id']))
+                                )
+                            break
+                        size = min(size, max(remaining, REPRICE_SCAN_CONCURRENCY))
+                    chunk = due[position:position + size]
+                    position += size
+
+                    # 1️⃣ Цены конкурентов пачки - параллельно, не больше REPRICE_SCAN_CONCURRENCY
+                    markets = await asyncio.gather(*(fetch_market(product) for product in chunk))
+
+                    # 2️⃣ Новые цены всей пачки одним расчётом
+                    batch = make_batch(
+                        [product['price'] for product in chunk], markets,
+                        AUTO_PRICE_MIN_PRICE, AUTO_PRICE_MAX_PRICE, AUTO_PRICE_UNDERCUT_AMOUNT
+                    )
+                    decisions = compute_prices(strategy, batch)
+
+                    # 3️⃣ Применение в пределах дневного лимита
+                    for index, product in enumerate(chunk):
+                        product_id = product['product_id']
+                        game_name = product['game_name']
+                        current_price = product['price']
+                        market_price = markets[index]
+                        new_price = decisions["prices"][index]
+                        reason = decisions["reasons"][index]
+                        applied_price = None
+
+                        try:
+                            if limit_reached or not decisions["changed"][index]:
+                                continue
+
+                            # Резервируем единицу дневного лимита до изменения цены
+                            granted = await db_pool.run(
+                                reserve_quota, PRICE_CHANGES_SCOPE, AUTO_PRICE_DAILY_LIMIT
+                            )
+                            if not granted:
+                                logger.warning(f"[AUTO-PRICE] Daily limit reached ({AUTO_PRICE_DAILY_LIMIT})")
+                                limit_reached = True
                                 continue
 
                             # Обновляем цену
-                            conn = get_db_connection()
-                            cursor = conn.cursor()
-                            cursor.execute("""
-                                UPDATE keys
-                                SET price = ?
-                                WHERE product_id = ? AND status = 'available'
-                            """, (new_price, product_id))
-                            conn.commit()
-                            conn.close()
+                            try:
+                                await db_pool.run(set_available_keys_price, product_id, new_price)
+                            except Exception:
+                                await db_pool.run(release_quota, PRICE_CHANGES_SCOPE)
+                                raise
+                            applied_price = new_price
 
                             # Логируем изменение цены
-                            log_price_change(product_id, game_name, current_price, new_price, market_price, reason)
+                            await log_price_change(product_id, game_name, current_price, new_price, market_price, reason)
 
                             # ✅ Отправляем уведомление о смене цены в Telegram
                             asyncio.create_task(
@@ -1097,23 +1342,36 @@ async def auto_price_adjustment():
                                 )
                             )
 
-                            # Повторная проверка дневного лимита (чтобы не переполнить)
-                            if AUTO_PRICE_DAILY_LIMIT > 0:
-                                today_changes = get_today_price_changes_count()
-                                if today_changes >= AUTO_PRICE_DAILY_LIMIT:
-                                    logger.warning(f"[AUTO-PRICE] Daily limit reached ({today_changes}/{AUTO_PRICE_DAILY_LIMIT})")
-                                    break
-
                             await asyncio.sleep(1)  # Пауза между изменениями
 
-                    except Exception as e:
-                        logger.error(f"[AUTO-PRICE] Error processing {game_name}: {e}")
-                        continue
+                        except Exception as e:
+                            logger.error(f"[AUTO-PRICE] Error processing {game_name}: {e}")
+                            continue
+                        finally:
+                            # Цену сменили, а конкурент всё ещё дешевле (упёрлись в порог) - проверяем
+                            # почти сразу; без изменения частую проверку не включаем, иначе товар
+                            # ниже порога или без квоты опрашивал бы G2A каждые REPRICE_MIN_INTERVAL
+                            scheduler.reschedule(
+                                product_id, applied_price or current_price, product['stock'],
+                                signals.get(str(product_id)),
+                                applied_price is not None and market_price is not None
+                                and applied_price > market_price
+                            )
 
-        except Exception as e:
-            logger.error(f"[AUTO-PRICE] Error in price adjustment task: {e}")
+                try:
+                    await db_pool.run(append_snapshots, snapshots)
+                    if time.time() - last_history_compact >= 86400:
+                        await db_pool.run(compact_price_history)
+                        last_history_compact = time.time()
+                except Exception as e:
+                    logger.error(f"[AUTO-PRICE] Error saving price history: {e}")
+
+            except Exception as e:
+                logger.error(f"[AUTO-PRICE] Error in price adjustment task: {e}")
 
-        await asyncio.sleep(AUTO_PRICE_CHECK_INTERVAL)
+            await asyncio.sleep(next_wakeup())
+    finally:
+        await api_client.close()
 
 async def cleanup_expired_tokens():
     while True:
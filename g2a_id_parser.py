@@ -1,22 +1,80 @@
 from curl_cffi.requests import AsyncSession
 import asyncio
-import json
 from urllib.parse import quote
 from g2a_config import G2A_BASE_URL, G2A_BASE_PARAMS, REGION_CODES, HEADERS, REQUEST_TIMEOUT, DELAY_BETWEEN_REQUESTS
+from rate_limiter import api_rate_limiter, parse_retry_after
+from g2a_items_extractor import extract_items
+from name_matching import normalize_name, match_product
+
+SEARCH_RATE_FAMILY = "search"
 
 
 class G2AIdParser:
-    def __init__(self, proxy_manager):
+    def __init__(self, proxy_manager, rate_limiter=None, catalog=None):
         self.proxy_manager = proxy_manager
-        self.session = None
-        self.count = 0
+        # Хранилище каталога товаров (PriceDatabase) - туда пишется вся выдача поиска
+        self.catalog = catalog
+        self.rate_limiter = rate_limiter or api_rate_limiter
+        # Долгоживущая сессия curl_cffi на каждый прокси (None - без прокси):
+        # {"session", "users"}; сессии прокси из карантина закрываются, когда освободятся
+        self.sessions = {}
+        self._retired_sessions = []
+        self.proxy_manager.add_retire_listener(self._on_proxy_retired)
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+        await self.close()
+
+    def _acquire_session(self, proxy):
+        entry = self.sessions.get(proxy)
+        if entry is None:
+            entry = {
+                "session": AsyncSession(
+                    headers=HEADERS,
+                    timeout=REQUEST_TIMEOUT,
+                    proxies={"http": proxy, "https": proxy} if proxy else None,
+                    impersonate="chrome120",
+                    verify=False
+                ),
+                "users": 0,
+            }
+            self.sessions[proxy] = entry
+        entry["users"] += 1
+        return entry
+
+    async def _release_session(self, entry):
+        entry["users"] -= 1
+        # Закрываем освободившиеся сессии прокси из карантина (и эту, и простаивавшие)
+        idle = [retired for retired in self._retired_sessions if retired["users"] <= 0]
+        if not idle:
+            return
+        self._retired_sessions = [retired for retired in self._retired_sessions if retired["users"] > 0]
+        for retired in idle:
+            await self._close_session(retired)
+
+    def _on_proxy_retired(self, proxy):
+        """Прокси ушёл в карантин: его соединения больше не нужны"""
+        entry = self.sessions.pop(proxy, None)
+        if entry is not None:
+            # Закроется при освобождении очередной сессии или в close()
+            self._retired_sessions.append(entry)
+
+    async def _close_session(self, entry):
+        try:
+            await entry["session"].close()
+        except Exception as e:
+            print(f"⚠️ Ошибка закрытия сессии: {e}")
+
+    async def close(self):
+        """Закрыть все сессии (и отложенные сессии прокси из карантина)"""
+        self.proxy_manager.remove_retire_listener(self._on_proxy_retired)
+        entries = list(self.sessions.values()) + self._retired_sessions
+        self.sessions = {}
+        self._retired_sessions = []
+        for entry in entries:
+            await self._close_session(entry)
 
     async def search_game_id(self, game_name, region="GLOBAL"):
         region_code = REGION_CODES.get(region, REGION_CODES["GLOBAL"])
@@ -26,32 +84,37 @@ class G2AIdParser:
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                self.count += 1
-                proxy = self.proxy_manager.get_current_proxy()
-                proxies = {"http": proxy, "https": proxy} if proxy else None
-
-                if not self.session or self.count == 13:
-                    self.session = AsyncSession(
-                        headers=HEADERS,
-                        timeout=REQUEST_TIMEOUT,
-                        proxies=proxies,
-                        impersonate="chrome120",
-                        verify=False
-                    )
-                    self.count = 0
                 print(f"Получаем G2A ID для: {game_name} (регион: {region})")
-                response = await self.session.get(url)
+
+                # Прокси арендуется на один запрос: параллельные поиски идут через разные прокси,
+                # а соединения (и TLS-отпечаток) каждого прокси переиспользуются его сессией
+                async with self.proxy_manager.lease() as lease:
+                    if lease.proxy:
+                        await lease.acquire_budget()
+                    else:
+                        await self.rate_limiter.acquire(SEARCH_RATE_FAMILY)
+                    entry = self._acquire_session(lease.proxy)
+                    try:
+                        response = await entry["session"].get(url)
+                    finally:
+                        await self._release_session(entry)
+                    retry_after = response.headers.get("Retry-After")
+                    lease.report(response.status_code, retry_after)
 
                 if response.status_code == 429:
-                    print(f"Rate limited, rotating proxy and retrying...")
-                    await asyncio.sleep(2)
+                    print(f"Rate limited, retrying when search budget allows...")
+                    if not lease.proxy:
+                        self.rate_limiter.penalize(SEARCH_RATE_FAMILY, parse_retry_after(retry_after))
                     continue
 
+                if not lease.proxy:
+                    self.rate_limiter.record_success(SEARCH_RATE_FAMILY)
+
                 if response.status_code != 200:
                     print(f"HTTP {response.status_code} for {game_name}")
                     return None
 
-                g2a_id = self.extract_id_from_html(response.text, game_name)
+                g2a_id = self.extract_id_from_html(response.text, game_name, region)
                 return g2a_id
 
             except Exception as e:
@@ -63,86 +126,71 @@ class G2AIdParser:
 
         return None
 
-    def normalize_name(self, name):
-        """Нормализация названия для сравнения - убираем технические слова но сохраняем структуру"""
-        name = name.lower()
-        # Убираем технические слова в любом месте строки
-        name = name.replace("steam key", "").replace("steam", "")
-        name = name.replace("key", "")
-        name = name.replace("(pc)", "").replace("pc", "")
-        name = name.replace("global", "").replace("europe", "").replace("eu", "")
-        name = name.replace("north america", "").replace("latam", "").replace("asia", "")
-        # Убираем лишние пробелы
-        name = " ".join(name.split())
-        return name.strip()
-
-    def extract_id_from_html(self, html, game_name):
-        try:
-            start = html.find('"items":[')
-            if start == -1:
-                print("Items block not found")
-                return None
-
-            i = start + len('"items":')
-            bracket_level = 0
-            result = ""
-
-            for ch in html[i:]:
-                result += ch
-                if ch == "[":
-                    bracket_level += 1
-                elif ch == "]":
-                    bracket_level -= 1
-                    if bracket_level == 0:
-                        break
+    async def search_game_id_in_regions(self, game_name, regions):
+        """
+        Поиск ID сразу во всех регионах, побеждает первый по приоритету
 
-            items = json.loads(result)
+        Запросы идут параллельно. Результаты разбираются в порядке regions:
+        как только найден ID в регионе, поиски в менее приоритетных регионах
+        отменяются.
 
-            # Нормализуем искомое название
-            game_normalized = self.normalize_name(game_name)
+        Returns:
+            tuple: (region, g2a_id) или (None, None)
+        """
+        tasks = [
+            asyncio.create_task(self.search_game_id(game_name, region))
+            for region in regions
+        ]
 
-            best_match = None
-            best_match_length = float('inf')
+        try:
+            for region, task in zip(regions, tasks):
+                try:
+                    g2a_id = await task
+                except Exception as e:
+                    print(f"Error searching {game_name} ({region}): {e}")
+                    continue
+                if g2a_id is not None:
+                    return region, g2a_id
+            return None, None
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # Дожидаемся отмены, чтобы не оставлять висящих запросов
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-            for product in items:
-                name = product.get("name", "")
-                name_lower = name.lower()
+    def normalize_name(self, name):
+        """Нормализация названия для сравнения (см. name_matching.normalize_name)"""
+        return normalize_name(name)
 
-                if "random" in name_lower:
-                    continue
+    def extract_id_from_html(self, html, game_name, region=None):
+        try:
+            items = extract_items(html)
+            if items is None:
+                print("Items block not found")
+                return None
 
-                # Нормализуем название продукта
-                product_normalized = self.normalize_name(name)
-
-                # Проверяем точное совпадение после нормализации
-                if game_normalized == product_normalized:
-                    product_id = product.get("meta", {}).get("productId", "")
-                    if product_id:
-                        clean_id = product_id[1:] if product_id.startswith("i") else product_id
-                        print(f"✓ Точное совпадение: {name}")
-                        return clean_id
-
-                # Проверяем полное вхождение искомой строки в название продукта
-                if game_normalized in product_normalized:
-                    # Выбираем продукт с самым коротким названием (наиболее точное совпадение)
-                    if len(product_normalized) < best_match_length:
-                        best_match_length = len(product_normalized)
-                        best_match = product
-
-            # Если нашли совпадение по вхождению
-            if best_match:
-                product_id = best_match.get("meta", {}).get("productId", "")
-                if product_id:
-                    clean_id = product_id[1:] if product_id.startswith("i") else product_id
-                    print(f"✓ Найдено вхождение '{game_normalized}' в: {best_match.get('name', '')}")
-                    return clean_id
+            # Все товары из выдачи - в локальный каталог для офлайн-поиска
+            if self.catalog is not None and region:
+                try:
+                    self.catalog.save_catalog_items(items, region)
+                except Exception as e:
+                    print(f"⚠️ Не удалось сохранить товары в каталог: {e}")
+
+            product_id, product, match_type = match_product(items, game_name)
+            if product_id:
+                if match_type == "exact":
+                    print(f"✓ Точное совпадение: {product.get('name', '')}")
+                else:
+                    print(f"✓ Найдено вхождение '{normalize_name(game_name)}' в: {product.get('name', '')}")
+                return product_id
 
             print(f"❌ Игра '{game_name}' не найдена после проверки {len(items)} результатов")
-            print(f"   Искали: '{game_normalized}'")
+            print(f"   Искали: '{normalize_name(game_name)}'")
             if items:
-                print(f"   Первый результат был: '{self.normalize_name(items[0].get('name', ''))}'")
+                print(f"   Первый результат был: '{normalize_name(items[0].get('name', ''))}'")
             return None
 
         except Exception as e:
             print(f"Error parsing HTML for {game_name}: {e}")
-            return None
\ No newline at end of file
+            return None
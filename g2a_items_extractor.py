@@ -0,0 +1,106 @@
+"""
+Быстрое извлечение массива "items":[...] из HTML страницы поиска G2A
+
+Массив разбирается прямо из буфера страницы: JSONDecoder.raw_decode
+читает значение с позиции маркера и сам находит его конец, за один
+проход C-сканера, без посимвольной склейки строки. Скобки внутри
+строк JSON (названия игр) границу не сбивают.
+
+Отдельный поиск границ + orjson проверялся: поиск границ на Python
+дороже, чем весь разбор raw_decode, поэтому orjson здесь не нужен.
+
+Микро-бенчмарк (сохранённая страница поиска или синтетическая):
+    python g2a_items_extractor.py [page.html] [повторов]
+"""
+
+import json
+import sys
+import time
+
+
+ITEMS_MARKER = '"items":['
+
+_decoder = json.JSONDecoder()
+
+
+def extract_items(html):
+    """
+    Массив товаров из HTML страницы поиска
+
+    Returns:
+        list | None: None если блока items нет или он оборван
+    """
+    marker = html.find(ITEMS_MARKER)
+    if marker == -1:
+        return None
+
+    try:
+        items, _end = _decoder.raw_decode(html, marker + len(ITEMS_MARKER) - 1)
+    except json.JSONDecodeError:
+        return None
+    return items
+
+
+def _extract_items_naive(html):
+    """Старый алгоритм (посимвольная склейка) - только для сравнения в бенчмарке"""
+    start = html.find(ITEMS_MARKER)
+    i = start + len('"items":')
+    bracket_level = 0
+    result = ""
+    for ch in html[i:]:
+        result += ch
+        if ch == "[":
+            bracket_level += 1
+        elif ch == "]":
+            bracket_level -= 1
+            if bracket_level == 0:
+                break
+    return json.loads(result)
+
+
+def _synthetic_page(items_count=2000):
+    items = [
+        {
+            "name": f"Game [Edition {n}] \"Deluxe\" Steam Key GLOBAL",
+            "meta": {"productId": f"i{10000000000000 + n}"},
+            "price": {"value": n / 10, "tags": ["a", "b]", "[c"]},
+        }
+        for n in range(items_count)
+    ]
+    padding = "<div>" + "x" * 200_000 + "</div>"
+    return f'<html>{padding}<script>window.__DATA__={{"items":{json.dumps(items)},"total":{items_count}}}</script>{padding}</html>'
+
+
+def _benchmark(html, repeats):
+    def timed(fn):
+        best = float("inf")
+        for _ in range(repeats):
+            started = time.perf_counter()
+            fn(html)
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    # Скобки внутри строк старый алгоритм не учитывает - сверяем только если он справился
+    try:
+        naive_ok = _extract_items_naive(html) == extract_items(html)
+    except ValueError:
+        naive_ok = False
+
+    naive = timed(_extract_items_naive) if naive_ok else None
+    fast = timed(extract_items)
+
+    print(f"Страница: {len(html) / 1024:.0f} KB, товаров: {len(extract_items(html) or [])}")
+    print(f"Новый алгоритм: {fast * 1000:.2f} мс")
+    if naive is None:
+        print("Старый алгоритм: результат неверный (скобки внутри строк)")
+    else:
+        print(f"Старый алгоритм: {naive * 1000:.2f} мс  (ускорение x{naive / fast:.1f})")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] != "-":
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            page = f.read()
+    else:
+        page = _synthetic_page()
+    _benchmark(page, int(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -5,6 +5,7 @@ from typing import List, Dict
 from datetime import datetime
 import asyncio
 import httpx
+from db_migrations import apply_migrations
 
 # Импортируем только то, что есть
 try:
@@ -57,6 +58,7 @@ class KeyManager:
         """)
 
         conn.commit()
+        apply_migrations(conn)
         conn.close()
 
     def add_keys_from_file(self, file_path: str, prefix: str = "sks") -> int:
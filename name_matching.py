@@ -0,0 +1,99 @@
+"""
+Сопоставление названий игр с товарами G2A
+
+Общие функции для парсера поиска (G2AIdParser) и локального каталога
+товаров (PriceDatabase): нормализация названия, триграммы и выбор
+подходящего товара из результатов поиска.
+"""
+
+import re
+
+
+_WORD_RE = re.compile(r"\w+")
+# Номера частей: "2", "2077", "iii" - у сиквелов отличаются только ими
+_NUMBER_WORD_RE = re.compile(r"^(?:\d+|[ivx]+)$")
+
+
+def normalize_name(name):
+    """Нормализация названия для сравнения - убираем технические слова но сохраняем структуру"""
+    name = name.lower()
+    # Убираем технические слова в любом месте строки
+    name = name.replace("steam key", "").replace("steam", "")
+    name = name.replace("key", "")
+    name = name.replace("(pc)", "").replace("pc", "")
+    name = name.replace("global", "").replace("europe", "").replace("eu", "")
+    name = name.replace("north america", "").replace("latam", "").replace("asia", "")
+    # Убираем лишние пробелы
+    name = " ".join(name.split())
+    return name.strip()
+
+
+def name_trigrams(normalized):
+    """Множество триграмм нормализованного названия (по словам, без пунктуации)"""
+    padded = f"  {' '.join(_WORD_RE.findall(normalized))} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigram_similarity(a, b):
+    """Коэффициент Жаккара по триграммам двух нормализованных названий"""
+    trigrams_a = name_trigrams(a)
+    trigrams_b = name_trigrams(b)
+    if not trigrams_a or not trigrams_b:
+        return 0.0
+    return len(trigrams_a & trigrams_b) / len(trigrams_a | trigrams_b)
+
+
+def same_numbers(a, b):
+    """Совпадают ли номера частей/годы в двух нормализованных названиях"""
+    numbers_a = [w for w in _WORD_RE.findall(a) if _NUMBER_WORD_RE.match(w)]
+    numbers_b = [w for w in _WORD_RE.findall(b) if _NUMBER_WORD_RE.match(w)]
+    return numbers_a == numbers_b
+
+
+def clean_product_id(product_id):
+    """productId из поиска G2A приходит с префиксом 'i'"""
+    return product_id[1:] if product_id.startswith("i") else product_id
+
+
+def match_product(items, game_name):
+    """
+    Выбор товара из результатов поиска G2A
+
+    Сначала точное совпадение нормализованных названий, иначе - товар
+    с самым коротким названием, в которое входит искомое.
+
+    Returns:
+        tuple: (product_id | None, товар | None, "exact" | "contains" | None)
+    """
+    game_normalized = normalize_name(game_name)
+
+    best_match = None
+    best_match_length = float('inf')
+
+    for product in items:
+        name = product.get("name", "")
+
+        if "random" in name.lower():
+            continue
+
+        product_normalized = normalize_name(name)
+
+        # Проверяем точное совпадение после нормализации
+        if game_normalized == product_normalized:
+            product_id = product.get("meta", {}).get("productId", "")
+            if product_id:
+                return clean_product_id(product_id), product, "exact"
+
+        # Проверяем полное вхождение искомой строки в название продукта
+        if game_normalized in product_normalized:
+            # Выбираем продукт с самым коротким названием (наиболее точное совпадение)
+            if len(product_normalized) < best_match_length:
+                best_match_length = len(product_normalized)
+                best_match = product
+
+    if best_match:
+        product_id = best_match.get("meta", {}).get("productId", "")
+        if product_id:
+            return clean_product_id(product_id), best_match, "contains"
+
+    return None, None, None
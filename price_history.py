@@ -0,0 +1,245 @@
+"""
+История цен конкурентов (временной ряд в SQLite)
+
+Каждый снимок рынка (минимальная цена конкурента, наша цена, число
+конкурентов) дописывается в компактную таблицу: целые секунды и центы,
+кластеризация WITHOUT ROWID по (product_id, ts) - выборка диапазона по
+товару читает соседние страницы без отдельного индекса.
+
+Политика хранения (compact_price_history):
+    - сырые снимки старше PRICE_HISTORY_RAW_DAYS сворачиваются по часам
+      в price_history_hourly (min / max / среднее / число снимков)
+    - часовые агрегаты старше PRICE_HISTORY_KEEP_DAYS удаляются
+"""
+
+import sqlite3
+import time
+
+from g2a_config import (
+    DATABASE_FILE, PRICE_HISTORY_RAW_DAYS, PRICE_HISTORY_KEEP_DAYS, PRICE_HISTORY_FLUSH_ROWS
+)
+
+
+HOUR = 3600
+DAY = 86400
+
+
+def create_price_history(cursor):
+    """Создать таблицы истории цен (колонку sum_sq_cents старым БД добавляет миграция 12)"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS price_history (
+            product_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            min_cents INTEGER,
+            my_cents INTEGER,
+            competitors INTEGER,
+            PRIMARY KEY (product_id, ts)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS price_history_hourly (
+            product_id INTEGER NOT NULL,
+            hour_ts INTEGER NOT NULL,
+            low_cents INTEGER,
+            high_cents INTEGER,
+            sum_cents INTEGER NOT NULL DEFAULT 0,
+            sum_sq_cents INTEGER,
+            samples INTEGER NOT NULL DEFAULT 0,
+            competitors INTEGER,
+            PRIMARY KEY (product_id, hour_ts)
+        ) WITHOUT ROWID
+    """)
+
+
+def to_cents(price):
+    return None if price is None else int(round(float(price) * 100))
+
+
+def append_snapshots(conn, rows):
+    """
+    Дописать снимки рынка одной транзакцией
+
+    Args:
+        rows: [(product_id, ts, min_price, my_price, competitors)] - цены в EUR
+    """
+    values = [
+        (product_id, int(ts), to_cents(min_price), to_cents(my_price), competitors)
+        for product_id, ts, min_price, my_price, competitors in rows
+    ]
+    if not values:
+        return 0
+    # Два снимка в одну секунду - оставляем первый
+    conn.executemany("""
+        INSERT OR IGNORE INTO price_history (product_id, ts, min_cents, my_cents, competitors)
+        VALUES (?, ?, ?, ?, ?)
+    """, values)
+    conn.commit()
+    return len(values)
+
+
+def get_price_range(conn, product_id, since, until=None):
+    """
+    Снимки товара за период (часовые агрегаты + сырые), по возрастанию времени
+
+    Returns:
+        list: [{"ts", "min_price", "high_price", "avg_price", "spread", "competitors", "samples"}]
+              (для часовых строк avg_price - среднее по samples снимкам часа,
+               spread - дисперсия внутри часа в EUR², None - неизвестна)
+    """
+    until = until if until is not None else int(time.time())
+    cursor = conn.execute("""
+        SELECT hour_ts, low_cents, high_cents,
+               sum_cents * 1.0 / NULLIF(samples, 0),
+               sum_sq_cents * 1.0 / NULLIF(samples, 0),
+               competitors, samples
+        FROM price_history_hourly
+        WHERE product_id = ? AND hour_ts >= ? AND hour_ts <= ?
+        UNION ALL
+        SELECT ts, min_cents, min_cents, min_cents, min_cents * min_cents, competitors, 1
+        FROM price_history
+        WHERE product_id = ? AND ts >= ? AND ts <= ?
+        ORDER BY 1
+    """, (product_id, int(since) - int(since) % HOUR, int(until), product_id, int(since), int(until)))
+
+    return [
+        {
+            "ts": ts,
+            "min_price": low / 100 if low is not None else None,
+            "high_price": high / 100 if high is not None else None,
+            "avg_price": avg / 100 if avg is not None else None,
+            "spread": max(0.0, mean_sq - avg * avg) / 10000 if mean_sq is not None and avg is not None else None,
+            "competitors": competitors,
+            "samples": samples,
+        }
+        for ts, low, high, avg, mean_sq, competitors, samples in cursor.fetchall()
+    ]
+
+
+def get_price_stats(conn, product_id, since):
+    """
+    Сводка по минимальной цене конкурента с момента since
+
+    Returns:
+        dict | None: {"samples", "first", "last", "low", "high", "mean",
+                      "change", "volatility"} - volatility = стд. отклонение / среднее
+
+    Часовой агрегат входит своим средним и разбросом с весом samples, поэтому
+    mean и volatility после compact_price_history не меняются. first / last /
+    change для свёрнутых часов - средние часа, а не крайние снимки.
+    """
+    points = [
+        p for p in get_price_range(conn, product_id, since)
+        if p["avg_price"] is not None and p["samples"]
+    ]
+    if not points:
+        return None
+
+    prices = [p["avg_price"] for p in points]
+    weights = [p["samples"] for p in points]
+    total = sum(weights)
+    mean = sum(price * weight for price, weight in zip(prices, weights)) / total
+    variance = sum(
+        weight * ((p["spread"] or 0.0) + (price - mean) ** 2)
+        for p, price, weight in zip(points, prices, weights)
+    ) / total
+
+    return {
+        "samples": total,
+        "first": prices[0],
+        "last": prices[-1],
+        "low": min(p["min_price"] for p in points),
+        "high": max(p["high_price"] for p in points),
+        "mean": round(mean, 4),
+        "change": round(prices[-1] - prices[0], 2),
+        "volatility": round(variance ** 0.5 / mean, 4) if mean else 0.0,
+    }
+
+
+def compact_price_history(conn, raw_days=None, keep_days=None, now=None):
+    """
+    Свернуть старые снимки по часам и удалить устаревшие агрегаты
+
+    Returns:
+        dict: {"downsampled": сырых строк свёрнуто, "expired": часовых удалено}
+    """
+    raw_days = raw_days if raw_days is not None else PRICE_HISTORY_RAW_DAYS
+    keep_days = keep_days if keep_days is not None else PRICE_HISTORY_KEEP_DAYS
+    now = int(now if now is not None else time.time())
+    # Граница по целому часу: час не делится между сырыми и свёрнутыми данными
+    raw_cutoff = (now - raw_days * DAY) // HOUR * HOUR
+    keep_cutoff = now - keep_days * DAY
+
+    try:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            INSERT INTO price_history_hourly
+                (product_id, hour_ts, low_cents, high_cents, sum_cents, sum_sq_cents, samples, competitors)
+            SELECT product_id, ts / 3600 * 3600, MIN(min_cents), MAX(min_cents),
+                   TOTAL(min_cents), TOTAL(min_cents * min_cents), COUNT(min_cents), MAX(competitors)
+            FROM price_history
+            WHERE ts < ?
+            GROUP BY product_id, ts / 3600
+            ON CONFLICT(product_id, hour_ts) DO UPDATE SET
+                low_cents = MIN(COALESCE(low_cents, excluded.low_cents), COALESCE(excluded.low_cents, low_cents)),
+                high_cents = MAX(COALESCE(high_cents, excluded.high_cents), COALESCE(excluded.high_cents, high_cents)),
+                sum_cents = sum_cents + excluded.sum_cents,
+                sum_sq_cents = sum_sq_cents + excluded.sum_sq_cents,
+                samples = samples + excluded.samples,
+                competitors = MAX(COALESCE(competitors, 0), COALESCE(excluded.competitors, 0))
+        """, (raw_cutoff,))
+        downsampled = conn.execute("DELETE FROM price_history WHERE ts < ?", (raw_cutoff,)).rowcount
+        expired = conn.execute(
+            "DELETE FROM price_history_hourly WHERE hour_ts < ?", (keep_cutoff,)
+        ).rowcount
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+    return {"downsampled": downsampled, "expired": expired}
+
+
+class PriceHistoryRecorder:
+    """
+    Буферизованная запись снимков из асинхронного кода (свое соединение)
+
+    record() только добавляет строку в буфер, запись в БД - пачкой
+    по flush_rows строк или при flush() / close().
+    """
+
+    def __init__(self, db_path=None, flush_rows=None):
+        self.conn = sqlite3.connect(db_path or DATABASE_FILE)
+        create_price_history(self.conn)
+        self.conn.commit()
+        self.flush_rows = flush_rows or PRICE_HISTORY_FLUSH_ROWS
+        self._buffer = []
+
+    def record(self, product_id, min_price, my_price=None, competitors=None, ts=None):
+        self._buffer.append((product_id, ts or time.time(), min_price, my_price, competitors))
+        if len(self._buffer) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        rows, self._buffer = self._buffer, []
+        try:
+            return append_snapshots(self.conn, rows)
+        except sqlite3.Error as e:
+            print(f"⚠️ История цен не сохранена ({len(rows)} снимков): {e}")
+            return 0
+
+    def range(self, product_id, since, until=None):
+        self.flush()
+        return get_price_range(self.conn, product_id, since, until)
+
+    def stats(self, product_id, since):
+        self.flush()
+        return get_price_stats(self.conn, product_id, since)
+
+    def compact(self, raw_days=None, keep_days=None):
+        self.flush()
+        return compact_price_history(self.conn, raw_days, keep_days)
+
+    def close(self):
+        self.flush()
+        self.conn.close()
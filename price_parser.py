@@ -7,14 +7,16 @@ from g2a_id_parser import G2AIdParser
 from g2a_api_client import G2AApiClient
 from region_analyzer import RegionAnalyzer
 from g2a_config import API_BASE_URL, DEFAULT_PREFIX, MIN_PRICE_TO_SELL, ADMIN_API_KEY,KEYS_FOLDER,RESULT_FOLDER
+from g2a_config import PIPELINE_RESOLVE_WORKERS, PIPELINE_PRICE_WORKERS, PIPELINE_SELL_WORKERS, PIPELINE_QUEUE_SIZE
 import httpx
 from color_utils import print_success, print_error, print_warning, print_info
 
 class KeyPriceParser:
     def __init__(self):
+        # Отложенная запись включается только в run_pipeline (write_behind_mode)
         self.db = PriceDatabase()
         self.proxy_manager = ProxyManager()
-        self.id_parser = G2AIdParser(self.proxy_manager)
+        self.id_parser = G2AIdParser(self.proxy_manager, catalog=self.db)
         self.api_client = G2AApiClient()
         self.region_analyzer = RegionAnalyzer()
         self.client = httpx.AsyncClient(verify=False)
@@ -35,49 +37,68 @@ class KeyPriceParser:
         if auto_sell:
             print("🔄 Режим автопродажи активен")
 
-        for filename in key_files:
-            await self.process_file(filename, auto_sell)
+        purged = self.db.purge_expired_cache()
+        if purged["prices"] or purged["product_ids"]:
+            print(f"🧹 Удалено устаревших записей кэша: цен {purged['prices']}, ID {purged['product_ids']}")
 
+        files_lines = [(filename, self.read_key_file(filename)) for filename in key_files]
+
+        await self.api_client.get_rate()
+        offers_cache = await self.load_offers_cache() if auto_sell else {}
+
+        # Один конвейер на все файлы: стадии не простаивают на границе файлов
+        results = await self.run_pipeline(files_lines, auto_sell, offers_cache)
+
+        for filename, lines in files_lines:
+            self.write_file_result(filename, lines, results[filename], auto_sell)
+
+        await self.api_client.close()
+        await self.id_parser.close()
         self.db.close()
         print("Все файлы обработаны")
 
     async def process_file(self, filename, auto_sell=False):
-        input_path = os.path.join(KEYS_FOLDER, filename)
-        output_path = os.path.join(RESULT_FOLDER, filename)
-
-        print(f"\nОбрабатываем файл: {filename}")
-
-        with open(input_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        lines = self.read_key_file(filename)
 
         await self.api_client.get_rate()
+        offers_cache = await self.load_offers_cache() if auto_sell else {}
 
-        offers_cache = {}
-        if auto_sell:
-            print("📥 Загружаем список существующих офферов...")
-            await self.api_client.get_token()
-            print_info("✓ Токен получен для автопродажи")
-            offers_response = await self.api_client.get_offers()
-            if offers_response.get("success"):
-                offers_cache = offers_response.get("offers_cache", {})
-                total_loaded = offers_response.get("total_loaded", 0)
-                print(f"Загружено {total_loaded} офферов")
-            else:
-                print(f"Ошибка загрузки офферов: {offers_response.get('error')}")
+        results = await self.run_pipeline([(filename, lines)], auto_sell, offers_cache)
+        self.write_file_result(filename, lines, results[filename], auto_sell)
 
+    def read_key_file(self, filename):
+        input_path = os.path.join(KEYS_FOLDER, filename)
+        print(f"\nЧитаем файл: {filename}")
+        with open(input_path, 'r', encoding='utf-8') as f:
+            return f.readlines()
+
+    async def load_offers_cache(self):
+        print("📥 Загружаем список существующих офферов...")
+        await self.api_client.get_token()
+        print_info("✓ Токен получен для автопродажи")
+        offers_response = await self.api_client.get_offers()
+        if offers_response.get("success"):
+            total_loaded = offers_response.get("total_loaded", 0)
+            print(f"Загружено {total_loaded} офферов")
+            return offers_response.get("offers_cache", {})
+
+        print(f"Ошибка загрузки офферов: {offers_response.get('error')}")
+        return {}
+
+    def write_file_result(self, filename, lines, results, auto_sell=False):
+        """Сохранение результата файла: строки в исходном порядке -> sort_lines_by_price"""
         processed_lines = []
         steam_keys_count = 0
         regional_keys_count = 0
         sold_count = 0
 
-        for i, line in enumerate(lines):
+        for index, line in enumerate(lines):
             line = line.strip()
             if not line:
                 processed_lines.append(line)
                 continue
 
-            processed_line = await self.process_line(line, auto_sell, offers_cache)
-
+            processed_line = results.get(index)
             if processed_line is None:
                 continue
 
@@ -95,11 +116,13 @@ class KeyPriceParser:
         sorted_lines = self.sort_lines_by_price(processed_lines)
         from datetime import datetime
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        with open(f'result/keys_result_{timestamp}.txt', 'w', encoding='utf-8') as f:
+        # Имя файла в названии: файлы одного запуска завершаются в одну секунду
+        output_path = os.path.join(RESULT_FOLDER, f"keys_result_{Path(filename).stem}_{timestamp}.txt")
+        with open(output_path, 'w', encoding='utf-8') as f:
             for line in sorted_lines:
                 f.write(line + '\n')
 
-        print(f"Всего обработано: {steam_keys_count} (Региональных: {regional_keys_count})")
+        print(f"\n{filename}: всего обработано: {steam_keys_count} (Региональных: {regional_keys_count})")
         if auto_sell:
             print(f"Выставлено на продажу: {sold_count} ключей")
 
@@ -159,88 +182,279 @@ class KeyPriceParser:
 
 
 
-    async def process_line(self, line, auto_sell=False, offers_cache=None):
-        parts = line.split(' | ')
-
-        if line.startswith('selling'):
-            return line
-
-        if not self.is_steam_key(line):
-            return line
+    def new_run(self, auto_sell=False, offers_cache=None):
+        """Состояние одного запуска обработки, общее для всех стадий"""
+        return {
+            "auto_sell": auto_sell,
+            "offers_cache": offers_cache if offers_cache is not None else {},
+            # offers_cache[product_id] меняется после await - продажи одного товара по очереди
+            "product_locks": {},
+            # (game_name, target_region) -> Future с итогом поиска цены/ID (single-flight)
+            "lookups": {},
+        }
+
+    async def run_pipeline(self, files_lines, auto_sell=False, offers_cache=None):
+        """
+        Конвейер обработки строк: разбор -> поиск G2A ID -> цена -> продажа
+
+        У каждой стадии свои воркеры и ограниченная очередь на входе, поэтому
+        поиск ID, запросы цен и создание офферов для разных строк идут
+        одновременно. Частоту запросов ограничивает общий api_rate_limiter.
+
+        Args:
+            files_lines: [(filename, lines)]
+
+        Returns:
+            dict: filename -> {индекс строки: результат | None}
+        """
+        # Отложенная запись: тысячи save_price/save_g2a_id за прогон без fsync на каждую
+        with self.db.write_behind_mode():
+            return await self._run_pipeline(files_lines, auto_sell, offers_cache)
+
+    async def _run_pipeline(self, files_lines, auto_sell, offers_cache):
+        results = {filename: {} for filename, _lines in files_lines}
+        run = self.new_run(auto_sell, offers_cache)
+
+        stages = {
+            "resolve": (self._stage_resolve, PIPELINE_RESOLVE_WORKERS),
+            "price": (self._stage_price, PIPELINE_PRICE_WORKERS),
+            "sell": (self._stage_sell, PIPELINE_SELL_WORKERS),
+        }
+        queues = {name: asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE) for name in stages}
+
+        def finish(item, value):
+            results[item["file"]][item["index"]] = value
+
+        async def worker(stage_name):
+            handler = stages[stage_name][0]
+            queue = queues[stage_name]
+            while True:
+                item = await queue.get()
+                try:
+                    next_stage = await handler(item, run)
+                    if next_stage is None:
+                        finish(item, item["result"])
+                    else:
+                        await queues[next_stage].put(item)
+                except Exception as e:
+                    print_error(f"Ошибка обработки строки {item['line']}: {e}")
+                    self._abandon_lookup(item, run)
+                    finish(item, f"{item['line']} | {item['target_region']}")
+                finally:
+                    queue.task_done()
+
+        workers = [
+            asyncio.create_task(worker(name))
+            for name, (_handler, count) in stages.items()
+            for _ in range(max(1, count))
+        ]
 
+        try:
+            # Стадия разбора: строки без ключа сразу идут в результат
+            for filename, lines in files_lines:
+                for index, line in enumerate(lines):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    item = self.parse_line(filename, index, line)
+                    if item["result"] is not None:
+                        finish(item, item["result"])
+                    else:
+                        await queues["resolve"].put(item)
+
+            # Стадии дренируются по порядку: воркер кладёт строку дальше до task_done
+            for name in stages:
+                await queues[name].join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return results
+
+    def parse_line(self, filename, index, line):
+        """Разбор строки в элемент конвейера (result заполнен - обработка не нужна)"""
+        item = {
+            "file": filename,
+            "index": index,
+            "line": line,
+            "parts": line.split(' | '),
+            "game_name": None,
+            "key_value": None,
+            "target_region": None,
+            "g2a_id": None,
+            "price": None,
+            "lookup": None,
+            "result": None,
+        }
+
+        if line.startswith('selling') or not self.is_steam_key(line):
+            item["result"] = line
+            return item
+
+        parts = item["parts"]
         if '€' in parts[0]:
-            game_name = parts[1].strip()
-            key_value = parts[2].strip() if len(parts) > 2 else None
+            item["game_name"] = parts[1].strip()
+            item["key_value"] = parts[2].strip() if len(parts) > 2 else None
         else:
-            game_name = parts[0].strip()
-            key_value = parts[1].strip() if len(parts) > 1 else None
-
-        target_region = self.region_analyzer.analyze_key_region(parts)
+            item["game_name"] = parts[0].strip()
+            item["key_value"] = parts[1].strip() if len(parts) > 1 else None
+
+        item["target_region"] = self.region_analyzer.analyze_key_region(parts)
+        return item
+
+    def _can_sell(self, item, auto_sell, price):
+        return auto_sell and item["key_value"] and price >= MIN_PRICE_TO_SELL
+
+    def _settle_lookup(self, item, price, g2a_id):
+        """Отдать итог поиска строкам-дубликатам, которые его ждут"""
+        lookup = item["lookup"]
+        if lookup is not None and not lookup.done():
+            lookup.set_result({"price": price, "g2a_id": g2a_id})
+        item["lookup"] = None
+
+    def _abandon_lookup(self, item, run):
+        """Поиск упал: дубликаты ищут заново, следующая строка станет ведущей"""
+        lookup = item.get("lookup")
+        if lookup is None:
+            return
+        key = (item["game_name"], item["target_region"])
+        if run["lookups"].get(key) is lookup:
+            del run["lookups"][key]
+        if not lookup.done():
+            lookup.set_result(None)
+        item["lookup"] = None
+
+    def _apply_lookup(self, item, run, outcome):
+        """Результат строки-дубликата по итогу ведущей строки - без запросов"""
+        line = item["line"]
+        target_region = item["target_region"]
+        price = outcome["price"]
+
+        if price is None:
+            item["result"] = f"{line} | {target_region}"
+            return None
+
+        item["price"] = price
+        item["g2a_id"] = outcome["g2a_id"]
+        item["result"] = f"€{price} | {line} | {target_region}"
+
+        if self._can_sell(item, run["auto_sell"], price):
+            if item["g2a_id"]:
+                return "sell"
+            print(f"G2A ID не найден в кэше для {item['game_name']}, пропускаем автопродажу")
+        return None
+
+    async def _stage_resolve(self, item, run):
+        """Цена из БД или поиск G2A ID (БД -> каталог -> сайт G2A)"""
+        game_name = item["game_name"]
+        target_region = item["target_region"]
+        line = item["line"]
+
+        # Один поиск на название в запуске: дубликаты ждут ведущую строку
+        key = (game_name, target_region)
+        while key in run["lookups"]:
+            outcome = await run["lookups"][key]
+            if outcome is not None:
+                return self._apply_lookup(item, run, outcome)
+        item["lookup"] = asyncio.get_running_loop().create_future()
+        run["lookups"][key] = item["lookup"]
 
         cached_price = self.db.get_price(game_name, target_region)
         if cached_price is not None:
             print(f"Используем цену из бд {game_name} ({target_region}): €{cached_price}")
-
-            if auto_sell and key_value and cached_price >= MIN_PRICE_TO_SELL:
+            cached_g2a_id = None
+            if run["auto_sell"] and cached_price >= MIN_PRICE_TO_SELL:
                 cached_g2a_id = self.db.get_g2a_id(game_name, target_region)
-                if cached_g2a_id:
-                    result = await self.sell_key_on_g2a(
-                        game_name, key_value, cached_g2a_id, cached_price, offers_cache, parts
-                    )
-                    if result == "duplicate":
-                        return None
-                    elif result:
-                        return f"selling | €{cached_price} | {line} | {target_region}"
-                    else:
-                        return f"€{cached_price} | {line} | {target_region}"
-                else:
-                    print(f"G2A ID не найден в кэше для {game_name}, пропускаем автопродажу")
-                    return f"€{cached_price} | {line} | {target_region}"
-            else:
-                return f"€{cached_price} | {line} | {target_region}"
+            self._settle_lookup(item, cached_price, cached_g2a_id)
+            return self._apply_lookup(item, run, {"price": cached_price, "g2a_id": cached_g2a_id})
 
         cached_g2a_id = self.db.get_g2a_id(game_name, target_region)
 
+        if cached_g2a_id is None:
+            # Локальный каталог товаров: без запроса к G2A
+            cached_g2a_id = self.db.find_catalog_product(game_name, target_region)
+            if cached_g2a_id is not None:
+                print(f"G2A ID из каталога для {game_name} ({target_region}): {cached_g2a_id}")
+                self.db.save_g2a_id(game_name, cached_g2a_id, target_region)
+
         if cached_g2a_id is None:
             search_regions = self.region_analyzer.get_search_regions_priority(target_region)
-            for region in search_regions:
-                g2a_id = await self.id_parser.search_game_id(game_name, region)
-                if g2a_id is not None:
-                    self.db.save_g2a_id(game_name, g2a_id, region)
-                    if region == target_region:
-                        cached_g2a_id = g2a_id
-                    break
+            region, g2a_id = await self.id_parser.search_game_id_in_regions(game_name, search_regions)
+            if g2a_id is not None:
+                self.db.save_g2a_id(game_name, g2a_id, region)
+                if region == target_region:
+                    cached_g2a_id = g2a_id
 
         if cached_g2a_id is None:
             print(f"G2A ID не найден для {game_name}")
-            return f"{line} | {target_region}"
+            self._settle_lookup(item, None, None)
+            item["result"] = f"{line} | {target_region}"
+            return None
 
-        price_data = await self.api_client.get_product_price(cached_g2a_id)
+        item["g2a_id"] = cached_g2a_id
+        return "price"
 
-        if price_data is not None:
-            min_price = price_data['min_price']
-            retail_price = price_data['retail_price']
-            usd_price = price_data['min_price_usd']
+    async def _stage_price(self, item, run):
+        """Минимальная цена товара через G2A API"""
+        game_name = item["game_name"]
+        target_region = item["target_region"]
+        line = item["line"]
 
-            self.db.save_price(game_name, retail_price, target_region)
+        price_data = await self.api_client.get_product_price(item["g2a_id"])
+        if price_data is None:
+            print(f"Цена не найдена {game_name}")
+            self._settle_lookup(item, None, item["g2a_id"])
+            item["result"] = f"{line} | {target_region}"
+            return None
 
-            print(f"Найдена цена для {game_name}: ${usd_price:.2f} (€{min_price:.2f})")
+        min_price = price_data['min_price']
+        retail_price = price_data['retail_price']
+        usd_price = price_data['min_price_usd']
 
-            if auto_sell and key_value and retail_price >= MIN_PRICE_TO_SELL:
-                result = await self.sell_key_on_g2a(
-                    game_name, key_value, cached_g2a_id, retail_price, offers_cache, parts
-                )
-                if result == "duplicate":
-                    return None
-                elif result:
-                    return f"selling | €{retail_price} | {line} | {target_region}"
-                else:
-                    return f"€{retail_price} | {line} | {target_region}"
-            else:
-                return f"€{retail_price} | {line} | {target_region}"
-        else:
-            print(f"Цена не найдена {game_name}")
-            return f"{line} | {target_region}"
+        self.db.save_price(game_name, retail_price, target_region)
+
+        print(f"Найдена цена для {game_name}: ${usd_price:.2f} (€{min_price:.2f})")
+
+        self._settle_lookup(item, retail_price, item["g2a_id"])
+        item["price"] = retail_price
+        item["result"] = f"€{retail_price} | {line} | {target_region}"
+        return "sell" if self._can_sell(item, run["auto_sell"], retail_price) else None
+
+    async def _stage_sell(self, item, run):
+        """Выставление ключа на продажу (по одному товару за раз)"""
+        product_key = str(item["g2a_id"])
+        lock = run["product_locks"].setdefault(product_key, asyncio.Lock())
+
+        async with lock:
+            result = await self.sell_key_on_g2a(
+                item["game_name"], item["key_value"], item["g2a_id"], item["price"],
+                run["offers_cache"], item["parts"]
+            )
+
+        if result == "duplicate":
+            item["result"] = None
+        elif result:
+            item["result"] = f"selling | €{item['price']} | {item['line']} | {item['target_region']}"
+        # иначе остаётся строка с ценой из предыдущей стадии
+        return None
+
+    async def process_line(self, line, auto_sell=False, offers_cache=None, run=None):
+        """Обработка одной строки без конвейера: те же стадии по очереди"""
+        item = self.parse_line(None, 0, line)
+        if item["result"] is not None:
+            return item["result"]
+
+        run = run or self.new_run(auto_sell, offers_cache)
+        stages = {"resolve": self._stage_resolve, "price": self._stage_price, "sell": self._stage_sell}
+        next_stage = "resolve"
+        try:
+            while next_stage is not None:
+                next_stage = await stages[next_stage](item, run)
+        except Exception:
+            self._abandon_lookup(item, run)
+            raise
+        return item["result"]
 
     async def sell_key_on_g2a(self, game_name, key_value, product_id, price, offers_cache,line_parts=None):
         """Выставление ключа на продажу через G2A API"""
@@ -487,31 +701,37 @@ class KeyPriceParser:
         except Exception as e:
             print(f"Ошибка в режиме изменения цен: {e}")
 
-    async def update_offer_price(self, offer_id, new_price, offer_type, variant_data):
-        """Обновление цены оффера через PATCH запрос (ИСПРАВЛЕНО)"""
-        try:
-            adjusted_price = round(new_price, 2)
+    def build_price_update_data(self, new_price, offer_type, variant_data):
+        """Тело PATCH запроса для смены цены оффера"""
+        adjusted_price = round(new_price, 2)
 
-            # Подготавливаем данные для PATCH запроса
-            update_data = {
-                "offerType": offer_type,
-                "variant": {
-                    "price": {
-                        "retail": str(adjusted_price),
-                        "business": str(adjusted_price)
-                    },
-                    "active": True,  # ✅ Всегда активируем при обновлении цены
-                    "visibility": variant_data.get("visibility", "all")
-                }
+        update_data = {
+            "offerType": offer_type,
+            "variant": {
+                "price": {
+                    "retail": str(adjusted_price),
+                    "business": str(adjusted_price)
+                },
+                "active": True,  # ✅ Всегда активируем при обновлении цены
+                "visibility": variant_data.get("visibility", "all")
             }
+        }
 
-            # Добавляем regions если есть
-            if "regions" in variant_data:
-                update_data["variant"]["regions"] = variant_data["regions"]
+        # Добавляем regions если есть
+        if "regions" in variant_data:
+            update_data["variant"]["regions"] = variant_data["regions"]
 
-            # Добавляем regionRestrictions если есть
-            if "regionRestrictions" in variant_data:
-                update_data["variant"]["regionRestrictions"] = variant_data["regionRestrictions"]
+        # Добавляем regionRestrictions если есть
+        if "regionRestrictions" in variant_data:
+            update_data["variant"]["regionRestrictions"] = variant_data["regionRestrictions"]
+
+        return update_data
+
+    async def update_offer_price(self, offer_id, new_price, offer_type, variant_data):
+        """Обновление цены оффера через PATCH запрос (ИСПРАВЛЕНО)"""
+        try:
+            adjusted_price = round(new_price, 2)
+            update_data = self.build_price_update_data(adjusted_price, offer_type, variant_data)
 
             # Отправляем PATCH запрос
             result = await self.api_client.update_offer_partial(offer_id, update_data)
@@ -652,20 +872,18 @@ class KeyPriceParser:
             total_updated = 0
             total_failed = 0
 
-            for idx, offer in enumerate(offers_to_update, 1):
-                offer_id = offer["offer_id"]
-                product_name = offer["product_name"]
-                current_price = offer["current_price"]
-                new_price = offer["new_price"]
-                offer_type = offer["offer_type"]
-
-                print(f"\n[{idx}/{len(offers_to_update)}] 🔄 Обновляем: {product_name}")
-                print(f"   Цена: €{current_price:.2f} → €{new_price:.2f}")
+            # 1. Детали всех офферов параллельно (visibility / регионы для PATCH)
+            print(f"\n📥 Загружаем детали {len(offers_to_update)} офферов...")
+            details_by_offer = await self.api_client.get_offer_details_batch(
+                [offer["offer_id"] for offer in offers_to_update]
+            )
 
-                offer_details = await self.api_client.get_offer_details(offer_id)
+            updates = []
+            for offer in offers_to_update:
+                offer_details = details_by_offer.get(offer["offer_id"], {})
 
                 if not offer_details.get("success"):
-                    print_error(f"   ❌ Ошибка получения деталей: {offer_details.get('error')}")
+                    print_error(f"   ❌ {offer['product_name']}: ошибка получения деталей: {offer_details.get('error')}")
                     total_failed += 1
                     continue
 
@@ -681,31 +899,42 @@ class KeyPriceParser:
                 if "regionRestrictions" in offer_data:
                     variant_data["regionRestrictions"] = offer_data["regionRestrictions"]
 
-                success = await self.update_offer_price(
-                    offer_id,
-                    new_price,
-                    offer_type,
-                    variant_data
-                )
+                updates.append({
+                    "offer_id": offer["offer_id"],
+                    "data": self.build_price_update_data(offer["new_price"], offer["offer_type"], variant_data),
+                    "offer": offer
+                })
+
+            # 2. Пакетное обновление цен
+            done = 0
+
+            def report(result):
+                nonlocal done
+                done += 1
+                offer = result["offer"]
+                if result["success"]:
+                    print_success(f"[{done}/{len(updates)}] ✓ {offer['product_name']}: €{offer['current_price']:.2f} → €{offer['new_price']:.2f}")
+                else:
+                    print_error(f"[{done}/{len(updates)}] ❌ {offer['product_name']}: {result.get('error')}")
 
-                if success:
-                    print_success(f"   ✓ Цена обновлена")
-                    total_updated += 1
+            print(f"\n🔄 Обновляем цены на {len(updates)} офферах...")
+            results = await self.api_client.update_offers_batch(updates, on_result=report)
 
-                    product_id = offer["product_id"]
-                    region = self.extract_region_from_product_name(product_name)
+            for result in results:
+                if not result["success"]:
+                    total_failed += 1
+                    continue
 
-                    game_name = product_name
-                    if region in product_name:
-                        game_name = product_name.replace(region, "").strip()
+                total_updated += 1
+                offer = result["offer"]
+                product_name = offer["product_name"]
+                region = self.extract_region_from_product_name(product_name)
 
-                    self.db.save_price(game_name, new_price, region)
-                    print(f"   ✓ Цена обновлена в БД для {game_name} ({region})")
-                else:
-                    print_error(f"   ❌ Не удалось обновить цену")
-                    total_failed += 1
+                game_name = product_name
+                if region in product_name:
+                    game_name = product_name.replace(region, "").strip()
 
-                await asyncio.sleep(1.5)
+                self.db.save_price(game_name, offer["new_price"], region)
 
             # Итоговая статистика
             print(f"\n{'=' * 80}")
@@ -811,31 +1040,36 @@ class KeyPriceParser:
             total_removed_offers = 0
             total_removed_keys = 0
 
-            # Открываем файл для записи
-            with open(output_path, 'w', encoding='utf-8') as result_file:
-                # Снимаем офферы с продажи
-                for offer in offers_to_remove:
-                    product_id = offer["product_id"]
-                    offer_id = offer["offer_id"]
-                    product_name = offer["product_name"]
-                    offer_type = offer.get("offer_type", "dropshipping")
-
-                    print(f"\n🗑️  Обрабатываем оффер: {product_name} (€{offer['price']})")
-
-                    # 1. Обнуляем инвентарь и деактивируем оффер
-                    print(f"🔄 Обнуляем инвентарь и деактивируем оффер...")
-                    update_inventory_result = await self.api_client.update_offer_partial(offer_id, {
-                        "offerType": offer_type,
+            # 1. Обнуляем инвентарь и деактивируем все офферы одним пакетом
+            print(f"\n🔄 Обнуляем инвентарь и деактивируем {len(offers_to_remove)} офферов...")
+            results = await self.api_client.update_offers_batch([
+                {
+                    "offer_id": offer["offer_id"],
+                    "data": {
+                        "offerType": offer.get("offer_type", "dropshipping"),
                         "variant": {
                             "inventory": {
                                 "size": 0
                             },
                             "active": False
                         }
-                    })
+                    },
+                    "offer": offer
+                }
+                for offer in offers_to_remove
+            ])
+
+            # Открываем файл для записи
+            with open(output_path, 'w', encoding='utf-8') as result_file:
+                for result in results:
+                    offer = result["offer"]
+                    product_id = offer["product_id"]
+                    product_name = offer["product_name"]
+
+                    print(f"\n🗑️  Обрабатываем оффер: {product_name} (€{offer['price']})")
 
-                    if not update_inventory_result.get("success"):
-                        print_error(f"❌ Не удалось обнулить инвентарь: {update_inventory_result.get('error')}")
+                    if not result["success"]:
+                        print_error(f"❌ Не удалось обнулить инвентарь: {result.get('error')}")
                         continue
                     else:
                         print_success(f"✓ Инвентарь обнулен и оффер деактивирован")
@@ -0,0 +1,390 @@
+"""
+Стратегии цен: пакетный расчёт новых цен за один проход
+
+Все товары цикла передаются столбцами (текущая цена, мин. конкурент,
+порог, максимум, снижение, остаток), стратегия считает новые цены сразу
+для всего столбца. С numpy - векторно, без него (сборка exe исключает
+numpy) - тот же код работает на поэлементных списках.
+
+Стратегии:
+    - undercut        - AutoPriceChanger: конкурент - снижение, вне [порог, максимум] не трогаем
+    - market_follow   - сервер: вниз за конкурентом, вверх от increase_threshold, обрезка по min/max
+    - listing_markup  - цена при выставлении оффера (PRICING_LISTING_TIERS)
+
+    batch = make_batch(current=[1.5, 9.0], market=[1.2, 10.0], floor=0.1, ceiling=100)
+    result = compute_prices("undercut", batch)
+    result["prices"], result["reasons"], result["changed"]
+
+Своя стратегия - подкласс PricingStrategy с @register_strategy.
+"""
+
+import math
+import operator
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from g2a_config import PRICING_LISTING_TIERS
+from price_history import get_price_range
+
+
+HAS_NUMPY = np is not None
+NAN = float("nan")
+INF = float("inf")
+# Разница меньше полцента - та же цена после округления
+MIN_STEP = 0.005
+
+
+# ==================== СТОЛБЦЫ ====================
+
+class _Vector(list):
+    """Замена numpy-массива: поэлементные операции над list (без ==, см. absolute)"""
+
+    def _map(self, other, op):
+        if isinstance(other, list):
+            return _Vector(op(a, b) for a, b in zip(self, other))
+        return _Vector(op(a, other) for a in self)
+
+    def __add__(self, other):
+        return self._map(other, operator.add)
+
+    def __radd__(self, other):
+        return self._map(other, lambda a, b: b + a)
+
+    def __sub__(self, other):
+        return self._map(other, operator.sub)
+
+    def __rsub__(self, other):
+        return self._map(other, lambda a, b: b - a)
+
+    def __mul__(self, other):
+        return self._map(other, operator.mul)
+
+    def __rmul__(self, other):
+        return self._map(other, lambda a, b: b * a)
+
+    def __truediv__(self, other):
+        return self._map(other, operator.truediv)
+
+    __iadd__ = __add__
+    __isub__ = __sub__
+    __imul__ = __mul__
+
+    def __lt__(self, other):
+        return self._map(other, operator.lt)
+
+    def __le__(self, other):
+        return self._map(other, operator.le)
+
+    def __gt__(self, other):
+        return self._map(other, operator.gt)
+
+    def __ge__(self, other):
+        return self._map(other, operator.ge)
+
+    def __and__(self, other):
+        return self._map(other, lambda a, b: bool(a and b))
+
+    def __or__(self, other):
+        return self._map(other, lambda a, b: bool(a or b))
+
+    def __invert__(self):
+        return _Vector(not a for a in self)
+
+    def __neg__(self):
+        return _Vector(-a for a in self)
+
+
+def _float(value):
+    try:
+        return NAN if value is None else float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def vector(values):
+    values = [_float(value) for value in values]
+    return np.asarray(values, dtype=float) if HAS_NUMPY else _Vector(values)
+
+
+def _broadcast(value, size):
+    return value if isinstance(value, list) or (HAS_NUMPY and isinstance(value, np.ndarray)) else [value] * size
+
+
+def where(cond, a, b):
+    if HAS_NUMPY:
+        return np.where(cond, a, b)
+    size = len(cond)
+    return _Vector(x if c else y for c, x, y in zip(cond, _broadcast(a, size), _broadcast(b, size)))
+
+
+def tag(reasons, cond, suffix):
+    """Дописать суффикс к причине там, где cond"""
+    if HAS_NUMPY:
+        return np.where(cond, np.char.add(reasons.astype(str), suffix), reasons)
+    return _Vector(r + suffix if c else r for r, c in zip(reasons, cond))
+
+
+def round2(values):
+    return np.round(values, 2) if HAS_NUMPY else _Vector(round(v, 2) for v in values)
+
+
+def minimum(a, b):
+    if HAS_NUMPY:
+        return np.minimum(a, b)
+    return where(a > b, b, a)
+
+
+def absolute(values):
+    return np.abs(values) if HAS_NUMPY else _Vector(abs(v) for v in values)
+
+
+def isfinite(values):
+    return np.isfinite(values) if HAS_NUMPY else _Vector(math.isfinite(v) for v in values)
+
+
+def to_list(values):
+    return values.tolist() if HAS_NUMPY else list(values)
+
+
+def make_batch(current, market=None, floor=None, ceiling=None, undercut=None, stock=None):
+    """
+    Столбцы товаров цикла (скаляр - одно значение для всех, None - нет данных)
+
+    Args:
+        current: Текущие цены
+        market: Мин. цены конкурентов (None / 0 - конкурентов нет)
+        floor: Пороги (минимальная цена)
+        ceiling: Максимальные цены
+        undercut: Снижение относительно конкурента
+        stock: Остатки
+    """
+    size = len(current)
+
+    def column(values, default):
+        values = default if values is None else values
+        if not isinstance(values, (list, tuple)) and not (HAS_NUMPY and isinstance(values, np.ndarray)):
+            values = [values] * size
+        return vector(values)
+
+    return {
+        "size": size,
+        "current": column(current, NAN),
+        "market": column(market, NAN),
+        "floor": column(floor, 0.0),
+        "ceiling": column(ceiling, INF),
+        "undercut": column(undercut, 0.01),
+        "stock": column(stock, NAN),
+    }
+
+
+# ==================== СТРАТЕГИИ ====================
+
+STRATEGIES = {}
+
+
+def register_strategy(cls):
+    STRATEGIES[cls.name] = cls
+    return cls
+
+
+def get_strategy(name, **params):
+    if name not in STRATEGIES:
+        raise ValueError(f"Неизвестная стратегия цен: {name} (есть: {', '.join(STRATEGIES)})")
+    return STRATEGIES[name](**params)
+
+
+class PricingStrategy:
+    """Стратегия: compute(batch) -> (prices, reasons), NaN в prices - не менять"""
+
+    name = None
+
+    def compute(self, batch):
+        raise NotImplementedError
+
+
+@register_strategy
+class UndercutStrategy(PricingStrategy):
+    """
+    Правила AutoPriceChanger:
+        1. Цена = мин. конкурент - снижение (не выше максимума)
+        2. Конкурент вне [порог, максимум] - не меняем
+        3. Новая цена ниже порога - не меняем
+    """
+
+    name = "undercut"
+
+    def compute(self, batch):
+        market, floor, ceiling = batch["market"], batch["floor"], batch["ceiling"]
+
+        target = minimum(round2(market - batch["undercut"]), ceiling)
+        has_market = market > 0
+        in_range = has_market & (market >= floor) & (market <= ceiling)
+        ok = in_range & (target >= floor)
+
+        prices = where(ok, target, NAN)
+        reasons = where(ok, "undercut", where(
+            has_market, where(in_range, "below_floor", "out_of_range"), "no_market"
+        ))
+        return prices, reasons
+
+
+@register_strategy
+class MarketFollowStrategy(PricingStrategy):
+    """
+    Правила auto_price_adjustment сервера:
+        1. Конкурент дешевле нас - цена = конкурент - снижение
+        2. Конкурент дороже на increase_threshold и больше - поднимаем так же
+        3. Результат обрезается до [порог, максимум] (причина *_capped_min / *_capped_max)
+    """
+
+    name = "market_follow"
+
+    def __init__(self, increase_threshold=0.5):
+        self.increase_threshold = increase_threshold
+
+    def compute(self, batch):
+        current, market = batch["current"], batch["market"]
+        floor, ceiling = batch["floor"], batch["ceiling"]
+
+        has_market = market > 0
+        down = has_market & (market < current)
+        up = has_market & ~down & ((market - current) >= self.increase_threshold)
+
+        target = round2(market - batch["undercut"])
+        move = (down | up) & (target > 0)
+        capped_min = target < floor
+        capped_max = ~capped_min & (target > ceiling)
+        target = where(capped_min, floor, where(capped_max, ceiling, target))
+
+        ok = move & (absolute(target - current) >= MIN_STEP)
+        reasons = where(down, "undercut_competitor", "market_increase")
+        reasons = tag(tag(reasons, capped_min, "_capped_min"), capped_max, "_capped_max")
+
+        prices = where(ok, target, NAN)
+        reasons = where(ok, reasons, where(has_market, "unchanged", "no_market"))
+        return prices, reasons
+
+
+@register_strategy
+class ListingMarkupStrategy(PricingStrategy):
+    """Цена нового оффера: текущая цена x множитель ступени (по умолчанию 0.97 до 5€, дальше 0.99)"""
+
+    name = "listing_markup"
+
+    def __init__(self, tiers=None):
+        self.tiers = sorted(tiers or PRICING_LISTING_TIERS)
+
+    def compute(self, batch):
+        current = batch["current"]
+        factor = vector([1.0] * batch["size"])
+        # С верхней ступени вниз: у цены остаётся множитель самой нижней подходящей
+        for limit, multiplier in reversed(self.tiers):
+            factor = where(current <= limit, multiplier, factor)
+
+        prices = round2(current * factor)
+        return prices, where(isfinite(prices), "listing_markup", "no_price")
+
+
+# ==================== РАСЧЁТ ====================
+
+def compute_prices(strategy, batch):
+    """
+    Новые цены для всего пакета
+
+    Args:
+        strategy: Имя из STRATEGIES или экземпляр PricingStrategy
+
+    Returns:
+        dict: {"prices": [float | None], "reasons": [str], "changed": [bool]}
+    """
+    if isinstance(strategy, str):
+        strategy = get_strategy(strategy)
+
+    prices, reasons = strategy.compute(batch)
+    changed = isfinite(prices) & (absolute(prices - batch["current"]) >= MIN_STEP)
+
+    return {
+        "prices": [price if math.isfinite(price) else None for price in to_list(prices)],
+        "reasons": [str(reason) for reason in to_list(reasons)],
+        "changed": [bool(flag) for flag in to_list(changed)],
+    }
+
+
+def listing_price(price, strategy="listing_markup"):
+    """Цена выставления одного оффера"""
+    result = compute_prices(strategy, make_batch([price]))
+    return result["prices"][0] if result["prices"][0] is not None else price
+
+
+# ==================== БЭКТЕСТ ====================
+
+def load_market_matrix(conn, product_ids, since, step=3600, until=None):
+    """
+    Мин. цены конкурентов из price_history по шагам времени
+
+    Returns:
+        list: строки по шагам, в строке - цена по каждому товару из product_ids
+              (последняя известная на шаге, None - ещё не было снимков)
+    """
+    until = int(until if until is not None else time.time())
+    steps = max(1, (until - int(since)) // step + 1)
+    matrix = [[None] * len(product_ids) for _ in range(steps)]
+
+    for column, product_id in enumerate(product_ids):
+        for point in get_price_range(conn, product_id, since, until):
+            if point["min_price"] is not None:
+                matrix[min(steps - 1, (point["ts"] - int(since)) // step)][column] = point["min_price"]
+        # Протягиваем последнюю известную цену на пустые шаги
+        last = None
+        for row in matrix:
+            if row[column] is None:
+                row[column] = last
+            last = row[column]
+
+    return matrix
+
+
+def backtest(strategy, markets, start_prices, floor=None, ceiling=None, undercut=None):
+    """
+    Прогон стратегии по истории рынка (каждый шаг - один пакетный расчёт)
+
+    Args:
+        markets: Строки load_market_matrix - мин. цена конкурента по товарам на шаге
+        start_prices: Наши цены до первого шага
+
+    Returns:
+        dict: {"steps", "changes", "cheapest_share" (доля наблюдений, где мы не дороже
+               конкурента), "avg_price", "final_prices"}
+    """
+    if isinstance(strategy, str):
+        strategy = get_strategy(strategy)
+
+    current = list(start_prices)
+    changes = observed = cheapest = 0
+    price_sum = 0.0
+
+    for row in markets:
+        result = compute_prices(strategy, make_batch(current, row, floor, ceiling, undercut))
+        for index, (price, changed) in enumerate(zip(result["prices"], result["changed"])):
+            if changed:
+                current[index] = price
+                changes += 1
+
+        for price, market in zip(current, row):
+            if market is None or price is None:
+                continue
+            observed += 1
+            price_sum += price
+            cheapest += price <= market
+
+    return {
+        "steps": len(markets),
+        "changes": changes,
+        "cheapest_share": round(cheapest / observed, 4) if observed else 0.0,
+        "avg_price": round(price_sum / observed, 4) if observed else 0.0,
+        "final_prices": current,
+    }
@@ -0,0 +1,129 @@
+"""
+Счётчик доступных ключей по продуктам (таблица product_stock)
+
+Остаток обновляется триггерами на таблице keys при любом изменении
+статуса / product_id, поэтому inventory_size читается одной строкой
+вместо COUNT(*) по всем ключам продукта.
+"""
+
+
+STOCK_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_keys_stock_insert
+    AFTER INSERT ON keys
+    WHEN NEW.status = 'available' AND NEW.product_id IS NOT NULL
+    BEGIN
+        INSERT INTO product_stock (product_id, available) VALUES (NEW.product_id, 1)
+        ON CONFLICT(product_id) DO UPDATE SET available = available + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_keys_stock_delete
+    AFTER DELETE ON keys
+    WHEN OLD.status = 'available' AND OLD.product_id IS NOT NULL
+    BEGIN
+        UPDATE product_stock SET available = available - 1
+        WHERE product_id = OLD.product_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_keys_stock_update
+    AFTER UPDATE OF status, product_id ON keys
+    WHEN (OLD.status = 'available' AND OLD.product_id IS NOT NULL)
+      OR (NEW.status = 'available' AND NEW.product_id IS NOT NULL)
+    BEGIN
+        UPDATE product_stock SET available = available - 1
+        WHERE OLD.status = 'available' AND product_id = OLD.product_id;
+
+        INSERT INTO product_stock (product_id, available)
+        SELECT NEW.product_id, 1
+        WHERE NEW.status = 'available' AND NEW.product_id IS NOT NULL
+        ON CONFLICT(product_id) DO UPDATE SET available = available + 1;
+    END
+    """,
+]
+
+
+def create_product_stock(cursor):
+    """Создать таблицу остатков и триггеры (при первом создании - заполнить)"""
+    cursor.execute("""
+        SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'product_stock'
+    """)
+    existed = cursor.fetchone() is not None
+
+    # WITHOUT ROWID: product_id в старых базах бывает TEXT, ключ не должен падать
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_stock (
+            product_id INTEGER NOT NULL PRIMARY KEY,
+            available INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+
+    for trigger_sql in STOCK_TRIGGERS:
+        cursor.execute(trigger_sql)
+
+    if not existed:
+        _fill_product_stock(cursor)
+
+
+def _fill_product_stock(cursor):
+    cursor.execute("DELETE FROM product_stock")
+    cursor.execute("""
+        INSERT INTO product_stock (product_id, available)
+        SELECT product_id, COUNT(*)
+        FROM keys
+        WHERE status = 'available' AND product_id IS NOT NULL
+        GROUP BY product_id
+    """)
+
+
+def get_available_stock(cursor, product_id):
+    """Доступный остаток продукта (O(1) по первичному ключу)"""
+    cursor.execute("SELECT available FROM product_stock WHERE product_id = ?", (product_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def check_product_stock(conn):
+    """
+    Сверка product_stock с фактическим количеством ключей
+
+    Returns:
+        list: [{"product_id", "counter", "actual"}] для расходящихся продуктов
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT product_id, SUM(counter) AS counter, SUM(actual) AS actual
+        FROM (
+            SELECT product_id, available AS counter, 0 AS actual
+            FROM product_stock
+            UNION ALL
+            -- Приводим как INTEGER-колонка product_stock: '123' -> 123
+            SELECT CASE WHEN CAST(product_id AS INTEGER) = product_id
+                        THEN CAST(product_id AS INTEGER) ELSE product_id END,
+                   0, COUNT(*)
+            FROM keys
+            WHERE status = 'available' AND product_id IS NOT NULL
+            GROUP BY product_id
+        )
+        GROUP BY product_id
+        HAVING SUM(counter) != SUM(actual)
+    """)
+    return [
+        {"product_id": row[0], "counter": row[1], "actual": row[2]}
+        for row in cursor.fetchall()
+    ]
+
+
+def rebuild_product_stock(conn):
+    """Пересчитать product_stock с нуля по таблице keys"""
+    # db_migrations сам импортирует этот модуль - импорт здесь, не на уровне модуля
+    from db_migrations import atomic
+
+    # Внутри транзакции вызывающего - SAVEPOINT, его транзакцию не коммитим
+    with atomic(conn, "rebuild_product_stock"):
+        cursor = conn.cursor()
+        _fill_product_stock(cursor)
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(available), 0) FROM product_stock")
+        products, available = cursor.fetchone()
+    return {"products": products, "available": available}
@@ -1,12 +1,105 @@
+"""
+Пул прокси с оценкой здоровья и арендой на запрос
+
+Каждый запрос арендует прокси (lease) и по завершении сообщает результат:
+по нему считаются EWMA задержки и доли ошибок. Выбор - случайный,
+взвешенный по здоровью и загрузке. На 429 прокси уходит на паузу
+(Retry-After), после серии ошибок подряд - в карантин с экспоненциальной
+задержкой. У каждого прокси свой token bucket для поиска G2A, поэтому
+пропускная способность растёт с размером пула.
+
+    async with proxy_manager.lease() as lease:
+        await lease.acquire_budget()
+        response = await session.get(url, proxies=lease.proxies)
+        lease.report(response.status_code, response.headers.get("Retry-After"))
+
+Старый интерфейс (get_current_proxy / should_rotate / rotate_proxy) сохранён.
+"""
+
+import asyncio
 import os
-from g2a_config import PROXY_FILE
+import random
+import time
+from contextlib import asynccontextmanager
+
+from g2a_config import (
+    PROXY_FILE, API_RATE_LIMITS,
+    PROXY_MAX_IN_FLIGHT, PROXY_FAILURE_THRESHOLD, PROXY_QUARANTINE_BASE,
+    PROXY_QUARANTINE_MAX, PROXY_COOLDOWN_429, PROXY_EWMA_ALPHA
+)
+from rate_limiter import TokenBucket, parse_retry_after
 
 PROXY_ROTATION_COUNT = 15
+
+
+class ProxyState:
+    """Статистика одного прокси"""
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = 1.0  # EWMA, секунды
+        self.error_rate = 0.0  # EWMA доли неудачных запросов
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.quarantine_count = 0
+        self.cooldown_until = 0.0
+        self.quarantined_until = 0.0
+        rate, capacity = API_RATE_LIMITS.get("search", (2.0, 4))
+        self.bucket = TokenBucket(rate, capacity, name=f"search:{url}")
+
+    def available_at(self):
+        return max(self.cooldown_until, self.quarantined_until)
+
+    def score(self):
+        """Чем выше, тем чаще выбирается: быстрый, без ошибок, не загруженный"""
+        health = (1.0 - self.error_rate) ** 2
+        return max(health, 0.01) / (self.latency + 0.5) / (1 + self.in_flight)
+
+
+class ProxyLease:
+    """Аренда прокси на один запрос"""
+
+    def __init__(self, manager, state):
+        self.manager = manager
+        self.state = state
+        self.proxy = state.url if state else None
+        self.proxies = {"http": self.proxy, "https": self.proxy} if self.proxy else None
+        self.started_at = time.monotonic()
+        self.reported = False
+
+    async def acquire_budget(self):
+        """Дождаться разрешения token bucket'а этого прокси (без прокси - не ждём)"""
+        if self.state:
+            await self.state.bucket.acquire()
+        self.started_at = time.monotonic()
+
+    def report(self, status_code=None, retry_after=None, error=False):
+        """Сообщить результат запроса: код ответа или error=True для исключения"""
+        if self.reported:
+            return
+        self.reported = True
+        latency = time.monotonic() - self.started_at
+
+        if status_code == 429:
+            self.manager.record_rate_limited(self.state, parse_retry_after(retry_after))
+        elif error or (status_code is not None and (status_code >= 500 or status_code in (403, 407))):
+            self.manager.record_failure(self.state, latency)
+        else:
+            self.manager.record_success(self.state, latency)
+
+
 class ProxyManager:
-    def __init__(self):
+    def __init__(self, max_in_flight=None):
         self.proxies = []
         self.current_index = 0
         self.request_count = 0
+        self.max_in_flight = max_in_flight or PROXY_MAX_IN_FLIGHT
+        self.states = {}
+        self._available = None  # asyncio.Condition, создаётся в event loop
+        # Вызываются с URL прокси, ушедшего в карантин (закрыть его сессии и т.п.)
+        self.retire_listeners = []
         self.load_proxies()
 
     def load_proxies(self):
@@ -25,11 +118,157 @@ class ProxyManager:
                         ip, port = address.split(':')
 
                         proxy_url = f"http://{login}:{password}@{ip}:{port}"
-                        self.proxies.append(proxy_url)
+                        self.add_proxy(proxy_url)
                     else:
                         proxy_url = f"http://{line}"
-                        self.proxies.append(proxy_url)
+                        self.add_proxy(proxy_url)
+
+    def add_proxy(self, proxy_url):
+        if proxy_url in self.states:
+            return
+        self.proxies.append(proxy_url)
+        self.states[proxy_url] = ProxyState(proxy_url)
+
+    # ==================== АРЕНДА ====================
+
+    def _condition(self):
+        if self._available is None:
+            self._available = asyncio.Condition()
+        return self._available
+
+    def _pick(self, now):
+        candidates = [
+            state for state in self.states.values()
+            if state.available_at() <= now and state.in_flight < self.max_in_flight
+        ]
+        if not candidates:
+            return None
+        weights = [state.score() for state in candidates]
+        return random.choices(candidates, weights=weights, k=1)[0]
+
+    async def acquire(self):
+        """Арендовать прокси (ждёт, если все заняты, на паузе или в карантине)"""
+        if not self.states:
+            return ProxyLease(self, None)
+
+        condition = self._condition()
+        async with condition:
+            while True:
+                now = time.monotonic()
+                state = self._pick(now)
+                if state is not None:
+                    state.in_flight += 1
+                    return ProxyLease(self, state)
+
+                # Ждём освобождения прокси или конца ближайшей паузы/карантина
+                waiting = [s.available_at() - now for s in self.states.values() if s.available_at() > now]
+                timeout = min(waiting) if waiting else None
+                try:
+                    await asyncio.wait_for(condition.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, lease):
+        """Вернуть прокси в пул (без report() - считается успехом)"""
+        if not lease.reported:
+            lease.report()
+        if lease.state is None:
+            return
+        lease.state.in_flight = max(0, lease.state.in_flight - 1)
+        condition = self._condition()
+        async with condition:
+            condition.notify()
+
+    @asynccontextmanager
+    async def lease(self):
+        lease = await self.acquire()
+        try:
+            yield lease
+        except asyncio.CancelledError:
+            # Отмена - не вина прокси
+            lease.reported = True
+            raise
+        except Exception:
+            lease.report(error=True)
+            raise
+        finally:
+            await self.release(lease)
+
+    # ==================== ЗДОРОВЬЕ ====================
+
+    def _update(self, state, latency, failed):
+        alpha = PROXY_EWMA_ALPHA
+        state.requests += 1
+        state.error_rate = (1 - alpha) * state.error_rate + alpha * (1.0 if failed else 0.0)
+        if latency is not None:
+            state.latency = (1 - alpha) * state.latency + alpha * latency
+
+    def record_success(self, state, latency=None):
+        if state is None:
+            return
+        self._update(state, latency, failed=False)
+        state.consecutive_failures = 0
+        state.quarantine_count = 0
+
+    def record_failure(self, state, latency=None):
+        if state is None:
+            return
+        self._update(state, latency, failed=True)
+        state.failures += 1
+        state.consecutive_failures += 1
+        if state.consecutive_failures >= PROXY_FAILURE_THRESHOLD:
+            self.quarantine(state)
+
+    def record_rate_limited(self, state, retry_after=None):
+        if state is None:
+            return
+        pause = retry_after if retry_after else PROXY_COOLDOWN_429
+        state.cooldown_until = max(state.cooldown_until, time.monotonic() + pause)
+        state.bucket.penalize(retry_after)
+        self._update(state, None, failed=True)
+
+    def quarantine(self, state):
+        """Карантин: 30с, 60с, 120с ... до PROXY_QUARANTINE_MAX"""
+        duration = min(PROXY_QUARANTINE_MAX, PROXY_QUARANTINE_BASE * (2 ** state.quarantine_count))
+        state.quarantine_count += 1
+        state.consecutive_failures = 0
+        state.quarantined_until = time.monotonic() + duration
+        print(f"🚫 Прокси {self._display(state.url)} в карантине на {duration:.0f}с")
+        for listener in list(self.retire_listeners):
+            try:
+                listener(state.url)
+            except Exception as e:
+                print(f"⚠️ Ошибка обработчика карантина прокси: {e}")
+
+    def add_retire_listener(self, listener):
+        if listener not in self.retire_listeners:
+            self.retire_listeners.append(listener)
+
+    def remove_retire_listener(self, listener):
+        if listener in self.retire_listeners:
+            self.retire_listeners.remove(listener)
+
+    def _display(self, proxy_url):
+        # Без логина/пароля в логах
+        return proxy_url.rsplit('@', 1)[-1]
+
+    def stats(self):
+        now = time.monotonic()
+        return [
+            {
+                "proxy": self._display(state.url),
+                "score": round(state.score(), 3),
+                "latency": round(state.latency, 3),
+                "error_rate": round(state.error_rate, 3),
+                "in_flight": state.in_flight,
+                "requests": state.requests,
+                "cooldown_for": round(max(0.0, state.cooldown_until - now), 1),
+                "quarantined_for": round(max(0.0, state.quarantined_until - now), 1),
+            }
+            for state in self.states.values()
+        ]
 
+    # ==================== СТАРЫЙ ИНТЕРФЕЙС ====================
 
     def get_current_proxy(self):
         if not self.proxies:
@@ -54,4 +293,4 @@ class ProxyManager:
         self.request_count = 0
 
     def has_proxies(self):
-        return len(self.proxies) > 0
\ No newline at end of file
+        return len(self.proxies) > 0
@@ -0,0 +1,152 @@
+"""
+Клиентский rate limiter для G2A API (token bucket)
+
+У каждого семейства эндпоинтов (products, offers, jobs, oauth, search)
+свой бюджет запросов. При 429 / BR03 бюджет семейства временно
+уменьшается и учитывается Retry-After, после серии успешных запросов
+скорость постепенно возвращается к базовой.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from g2a_config import API_RATE_LIMITS
+from error_handling import error_handler
+
+
+class TokenBucket:
+    """Асинхронный token bucket с адаптивной скоростью пополнения"""
+
+    def __init__(self, rate: float, capacity: int, name: str = "", min_rate: float = None):
+        self.name = name
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = float(min_rate) if min_rate else self.base_rate / 10
+        self.capacity = max(1, int(capacity))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.success_streak = 0
+        # Критическая секция без await: защищает от гонок между потоками GUI
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    async def acquire(self):
+        """Дождаться разрешения на один запрос"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Токены могут уйти в минус - это очередь уже выданных разрешений
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate, self.blocked_until - now)
+
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        # Пока ждали, сервер мог ответить 429 с Retry-After
+        while True:
+            wait = self.blocked_until - time.monotonic()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+
+    def record_success(self):
+        """Успешный ответ: постепенно возвращаем базовую скорость"""
+        with self._lock:
+            if self.rate >= self.base_rate:
+                return
+            self.success_streak += 1
+            if self.success_streak >= self.capacity:
+                self.success_streak = 0
+                self.rate = min(self.base_rate, self.rate * 1.25)
+
+    def penalize(self, retry_after: Optional[float] = None):
+        """429 / BR03: снижаем скорость вдвое и блокируем до Retry-After"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.success_streak = 0
+            self.tokens = min(self.tokens, 0.0)
+            pause = retry_after if retry_after and retry_after > 0 else 1.0 / self.rate
+            self.blocked_until = max(self.blocked_until, now + pause)
+
+
+class RateLimiter:
+    """Набор token bucket'ов по семействам эндпоинтов"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]]):
+        self.buckets = {
+            family: TokenBucket(rate, capacity, name=family)
+            for family, (rate, capacity) in limits.items()
+        }
+
+    def get_bucket(self, family: Optional[str]) -> Optional[TokenBucket]:
+        if family is None:
+            return None
+        return self.buckets.get(family)
+
+    async def acquire(self, family: Optional[str]):
+        bucket = self.get_bucket(family)
+        if bucket:
+            await bucket.acquire()
+
+    def record_success(self, family: Optional[str]):
+        bucket = self.get_bucket(family)
+        if bucket:
+            bucket.record_success()
+
+    def penalize(self, family: Optional[str], retry_after: Optional[float] = None):
+        bucket = self.get_bucket(family)
+        if bucket:
+            bucket.penalize(retry_after)
+
+    def on_rate_limited(self, endpoint: Optional[str], retry_after: Optional[float] = None):
+        """Слушатель G2AErrorHandler: вызывается на каждую ошибку BR03"""
+        self.penalize(endpoint, retry_after)
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            family: {
+                "rate": round(bucket.rate, 3),
+                "base_rate": bucket.base_rate,
+                "tokens": round(bucket.tokens, 2),
+                "blocked_for": round(max(0.0, bucket.blocked_until - time.monotonic()), 2)
+            }
+            for family, bucket in self.buckets.items()
+        }
+
+
+def endpoint_family(url: str) -> Optional[str]:
+    """Определить семейство эндпоинта G2A по URL"""
+    if "/oauth/" in url:
+        return "oauth"
+    if "/jobs" in url:
+        return "jobs"
+    if "/sales/offers" in url:
+        return "offers"
+    if "/products" in url:
+        return "products"
+    return None
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах (формат HTTP-даты G2A не использует)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# Общий экземпляр на процесс: все клиенты делят один бюджет
+api_rate_limiter = RateLimiter(API_RATE_LIMITS)
+error_handler.add_rate_limit_listener(api_rate_limiter.on_rate_limited)
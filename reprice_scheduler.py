@@ -0,0 +1,240 @@
+"""
+Адаптивное расписание проверок цен (очередь с приоритетом)
+
+Вместо обхода всех товаров раз в check_interval каждый товар получает
+своё время следующей проверки. Интервал - базовый, делённый на
+"давление" товара:
+
+    - волатильность цены конкурентов за окно (price_history)
+    - изменения наших цен и продажи за окно (price_changes, orders)
+    - ценовой диапазон: дорогой товар важнее копеечного
+    - остаток: без остатка проверять незачем (REPRICE_MAX_INTERVAL)
+
+Товар, где конкурент только что оказался дешевле нас, проверяется снова
+через REPRICE_MIN_INTERVAL.
+
+    scheduler = RepriceScheduler(base_interval=1800)
+    scheduler.sync(product_ids)
+    for product_id in scheduler.pop_due():
+        ...
+        scheduler.reschedule(product_id, price, stock, signals.get(product_id), contested)
+    await asyncio.sleep(scheduler.next_due_in())
+"""
+
+import heapq
+import math
+import sqlite3
+import time
+from datetime import datetime
+
+from g2a_config import (
+    REPRICE_MIN_INTERVAL, REPRICE_MAX_INTERVAL, REPRICE_SIGNAL_WINDOW,
+    REPRICE_VOLATILITY_WEIGHT, REPRICE_ACTIVITY_WEIGHT
+)
+
+
+# ==================== СИГНАЛЫ ====================
+
+def _window(column):
+    # Префикс по дате использует индекс по created_at, datetime() сравнивает
+    # оба формата дат в БД (CURRENT_TIMESTAMP и isoformat)
+    return f"{column} >= ? AND datetime({column}) >= datetime(?, 'unixepoch')"
+
+
+def _window_params(since):
+    return (datetime.fromtimestamp(since - 86400).strftime("%Y-%m-%d"), int(since))
+
+
+def _load_volatility(conn, since):
+    cursor = conn.execute("""
+        SELECT CAST(product_id AS TEXT), AVG(min_cents), AVG(min_cents * min_cents)
+        FROM price_history
+        WHERE ts >= ? AND min_cents IS NOT NULL
+        GROUP BY product_id
+    """, (int(since),))
+
+    volatility = {}
+    for product_id, mean, mean_sq in cursor.fetchall():
+        if mean:
+            # Коэффициент вариации: стд. отклонение / среднее
+            volatility[product_id] = math.sqrt(max(0.0, mean_sq - mean * mean)) / mean
+    return volatility
+
+
+def _load_changes(conn, since):
+    cursor = conn.execute(f"""
+        SELECT CAST(product_id AS TEXT), COUNT(*)
+        FROM price_changes
+        WHERE {_window("created_at")}
+        GROUP BY 1
+    """, _window_params(since))
+    return dict(cursor.fetchall())
+
+
+def _load_sales(conn, since):
+    # В общей БД таблица orders бывает двух видов: PriceDatabase (product_id)
+    # и сервера (по резервациям)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(orders)")}
+
+    if "product_id" in columns:
+        query = f"""
+            SELECT CAST(product_id AS TEXT), SUM(COALESCE(quantity, 1))
+            FROM orders
+            WHERE {_window("created_at")}
+            GROUP BY 1
+        """
+    elif "reservation_id" in columns:
+        query = f"""
+            SELECT CAST(r.product_id AS TEXT), SUM(r.quantity)
+            FROM orders o
+            JOIN reservations r ON r.reservation_id = o.reservation_id
+            WHERE {_window("o.created_at")}
+            GROUP BY 1
+        """
+    else:
+        return {}
+
+    return dict(conn.execute(query, _window_params(since)).fetchall())
+
+
+def load_signals(conn, window=None, now=None):
+    """
+    Сигналы для расписания по всем товарам за окно (несколько GROUP BY запросов)
+
+    Returns:
+        dict: {str(product_id): {"volatility", "changes", "sales"}}
+    """
+    window = window if window is not None else REPRICE_SIGNAL_WINDOW
+    since = (now if now is not None else time.time()) - window
+    signals = {}
+
+    for name, loader in (("volatility", _load_volatility),
+                         ("changes", _load_changes),
+                         ("sales", _load_sales)):
+        try:
+            values = loader(conn, since)
+        except sqlite3.OperationalError:
+            # Таблицы ещё нет (история не собиралась, продаж не было)
+            continue
+        for product_id, value in values.items():
+            entry = signals.setdefault(product_id, {"volatility": 0.0, "changes": 0, "sales": 0})
+            entry[name] = value or 0
+
+    return signals
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def check_interval(base, price=None, stock=None, signals=None, contested=False,
+                   min_interval=None, max_interval=None):
+    """
+    Через сколько секунд снова проверить товар
+
+    Args:
+        base: Базовый интервал (check_interval / AUTO_PRICE_CHECK_INTERVAL)
+        price: Наша цена, EUR
+        stock: Остаток (None - неизвестен)
+        signals: {"volatility", "changes", "sales"} из load_signals
+        contested: Конкурент дешевле нас на последней проверке
+    """
+    min_interval = min_interval if min_interval is not None else REPRICE_MIN_INTERVAL
+    max_interval = max_interval if max_interval is not None else REPRICE_MAX_INTERVAL
+
+    if stock is not None and _to_float(stock) <= 0:
+        return max_interval
+    if contested:
+        return min_interval
+
+    signals = signals or {}
+    pressure = 1.0
+    pressure *= 1 + signals.get("volatility", 0.0) * REPRICE_VOLATILITY_WEIGHT
+    pressure *= 1 + signals.get("changes", 0) * REPRICE_ACTIVITY_WEIGHT
+    pressure *= 1 + signals.get("sales", 0) * REPRICE_ACTIVITY_WEIGHT
+    # €0.50 -> x1.2, €5 -> x1.8, €40 -> x2.6
+    pressure *= 1 + math.log10(1 + max(0.0, _to_float(price)))
+    if stock:
+        pressure *= 1 + math.log10(max(1.0, _to_float(stock))) * REPRICE_ACTIVITY_WEIGHT
+
+    return max(min_interval, min(max_interval, base / pressure))
+
+
+# ==================== ОЧЕРЕДЬ ====================
+
+class RepriceScheduler:
+    """Очередь товаров по времени следующей проверки (heapq, ленивое удаление)"""
+
+    def __init__(self, base_interval, min_interval=None, max_interval=None):
+        self.base_interval = base_interval
+        self.min_interval = min_interval if min_interval is not None else REPRICE_MIN_INTERVAL
+        self.max_interval = max_interval if max_interval is not None else REPRICE_MAX_INTERVAL
+        self._heap = []  # (due_at, product_id)
+        self._due = {}  # product_id -> актуальный due_at
+        self.intervals = {}  # product_id -> последний интервал
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, product_id):
+        return str(product_id) in self._due
+
+    def schedule(self, product_id, delay, now=None):
+        product_id = str(product_id)
+        due_at = (now if now is not None else time.time()) + max(0.0, delay)
+        self._due[product_id] = due_at
+        # Старая запись остаётся в куче и пропускается в pop_due
+        heapq.heappush(self._heap, (due_at, product_id))
+
+    def sync(self, product_ids, now=None):
+        """Новые товары - к проверке сразу, пропавшие - из расписания"""
+        product_ids = {str(product_id) for product_id in product_ids}
+        for product_id in product_ids - self._due.keys():
+            self.schedule(product_id, 0, now)
+        for product_id in self._due.keys() - product_ids:
+            del self._due[product_id]
+            self.intervals.pop(product_id, None)
+
+    def pop_due(self, now=None, limit=None):
+        """Снять с очереди товары, время проверки которых наступило"""
+        now = now if now is not None else time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+            due_at, product_id = heapq.heappop(self._heap)
+            if self._due.get(product_id) != due_at:
+                continue  # устаревшая запись
+            del self._due[product_id]
+            due.append(product_id)
+        return due
+
+    def next_due_in(self, now=None):
+        """Секунд до ближайшей проверки (None - расписание пусто)"""
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - (now if now is not None else time.time()))
+
+    def postpone(self, delay, now=None):
+        """Отложить всё, что должно было проверяться раньше now + delay"""
+        now = now if now is not None else time.time()
+        for product_id, due_at in list(self._due.items()):
+            if due_at < now + delay:
+                self.schedule(product_id, delay, now)
+
+    def reschedule(self, product_id, price=None, stock=None, signals=None, contested=False, now=None):
+        """Поставить товар в очередь по его сигналам, возвращает интервал"""
+        interval = check_interval(
+            self.base_interval, price, stock, signals, contested,
+            self.min_interval, self.max_interval
+        )
+        self.intervals[str(product_id)] = interval
+        self.schedule(product_id, interval, now)
+        return interval
+
+    def max_age(self, product_id):
+        """Допустимый возраст снимка рынка: не старше интервала проверки товара"""
+        return self.intervals.get(str(product_id))